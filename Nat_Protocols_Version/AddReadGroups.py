@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+'''
+Add Read Groups
+Version 1.0
+
+Written for Python 3
+Required modules: Pysam
+
+Inputs:
+    A position-sorted BAM file of aligned DCSs (*.dcs.aln.sort.bam)
+
+Outputs:
+    1: A BAM file with the reads that mapped, each tagged with the read group, and a header with that read group
+    2: An index of that BAM file (.bai)
+
+This program does in a single pass what 'samtools view -F 4' followed by Picard's AddOrReplaceReadGroups did in
+PostDCSProcessing.sh: unmapped reads are dropped, every @RG line of the header is replaced by the one read group
+given, and the RG tag of every read is set to it.  Compression of the output can use several threads, and the output
+is indexed if it is position-sorted.
+
+usage: AddReadGroups.py [-h] --infile INFILE --outfile OUTFILE [--RGID RGID]
+                        [--RGLB RGLB] [--RGPL RGPL] [--RGPU RGPU]
+                        [--RGSM RGSM] [--keep_unmapped] [--threads THREADS]
+                        [--no_index]
+
+optional arguments:
+  -h, --help            show this help message and exit
+  --infile INFILE       input BAM file
+  --outfile OUTFILE     output BAM file
+  --RGID RGID           Read group ID [1]
+  --RGLB RGLB           Read group library [UW]
+  --RGPL RGPL           Read group platform [Illumina]
+  --RGPU RGPU           Read group platform unit [ATATAT]
+  --RGSM RGSM           Read group sample name [default]
+  --keep_unmapped       Keep unmapped reads [False]
+  --threads THREADS     Number of threads used to compress and decompress
+                        BAM files. [1]
+  --no_index            Do not index the output [False]
+'''
+
+import os
+import sys
+import pysam
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+
+
+def read_group_header(header, o):
+	# The header of the input, with its @RG lines replaced by the one read group.
+	header = header.to_dict()
+	header['RG'] = [{'ID': o.RGID, 'PL': o.RGPL, 'PU': o.RGPU, 'LB': o.RGLB, 'SM': o.RGSM}]
+	return header
+
+
+def main():
+	# Parameters to be input.
+	parser = ArgumentParser()
+	parser.add_argument("--infile", action="store", dest="infile", help="input BAM file", required=True)
+	parser.add_argument("--outfile", action="store", dest="outfile", help="output BAM file", required=True)
+	parser.add_argument('--RGID', default='1', dest='RGID', help="Read group ID [1]")
+	parser.add_argument('--RGLB', default='UW', dest='RGLB', help="Read group library [UW]")
+	parser.add_argument('--RGPL', default='Illumina', dest='RGPL', help="Read group platform [Illumina]")
+	parser.add_argument('--RGPU', default='ATATAT', dest='RGPU', help="Read group platform unit [ATATAT]")
+	parser.add_argument('--RGSM', default='default', dest='RGSM', help="Read group sample name [default]")
+	parser.add_argument('--keep_unmapped', action="store_true", default=False, dest='keep_unmapped',
+						help="Keep unmapped reads [False]")
+	parser.add_argument('--threads', type=int, default=1, dest='threads',
+						help="Number of threads used to compress and decompress BAM files. [1]")
+	parser.add_argument('--no_index', action="store_true", default=False, dest='no_index',
+						help="Do not index the output [False]")
+	add_profile_arguments(parser, ['readgroups', 'index'])
+	o = parser.parse_args()
+	profiler = profiler_from_args(o, o.outfile.replace(".bam", ""))
+	profiler.start()
+
+	in_bam = pysam.AlignmentFile(o.infile, "rb", threads=o.threads)
+	header = read_group_header(in_bam.header, o)
+	out_bam = pysam.AlignmentFile(o.outfile, "wb", header=header, threads=o.threads)
+
+	reads_in = 0
+	unmapped = 0
+	profiler.begin('readgroups')
+	for read in in_bam.fetch(until_eof=True):
+		reads_in += 1
+		if read.is_unmapped and not o.keep_unmapped:
+			unmapped += 1
+			continue
+		read.set_tag('RG', o.RGID, 'Z')
+		out_bam.write(read)
+	profiler.end('readgroups')
+	in_bam.close()
+	out_bam.close()
+
+	profiler.begin('index')
+	if not o.no_index:
+		if header.get('HD', {}).get('SO') == 'coordinate':
+			pysam.index(o.outfile)
+		else:
+			sys.stderr.write("%s is not marked as position-sorted; not indexing it\n" % o.infile)
+	profiler.end('index')
+
+	# Write summary statistics
+	sys.stderr.write("Summary Statistics: \n")
+	sys.stderr.write("Reads processed: %s\n" % reads_in)
+	sys.stderr.write("Unmapped reads removed: %s\n" % unmapped)
+	sys.stderr.write("Reads written: %s\n" % (reads_in - unmapped))
+	profiler.stop()
+
+if __name__ == "__main__":
+	main()
@@ -7,8 +7,8 @@ By Brendan Kohrn and Scott Kennedy(1)
 Based on work by Scott Kennedy
 January 21, 2014
 
-Written for Python 2.7.3
-Required modules: Pysam, Samtools
+Written for Python 2.7.3, updated for Python 3
+Required modules: Pysam, Samtools, NumPy
 
 Inputs: 
 	A position-sorted paired-end BAM file containing reads with a duplex tag in the header.
@@ -16,9 +16,10 @@ Inputs:
 Outputs:
 	1: A paired-end BAM file containing SSCSs
 	2: A single-end BAM file containing unpaired SSCSs (if --read_type is 'd')
-	3: A single-end BAM file containing reads with less common cigar strings
-	4: A single-end BAM file containing reads not in --read_type
+	3: A single-end BAM file containing reads with less common cigar strings (see --side_outputs)
+	4: A single-end BAM file containing reads not in --read_type (see --side_outputs)
 	5: A tagcounts file
+	6: With --duplex, a paired-end BAM file and a pair of fastq files containing DCSs, as from DuplexMaker.py
 
 	Note that quality scores in outputs 1, 2, and 3 are just space fillers and do not signify anything about the
 	quality of the sequence.
@@ -40,6 +41,13 @@ usage: consensus_maker.py [-h] [--infile INFILE] [--tag_file tag_file] [--tag_st
 						[--Ncut_off Ncut_off] [--read_length READ_LENGTH]
 						[--read_type READ_TYPE] [--isize ISIZE]
 						[--read_out ROUT] [--filt FILT] [--sam_tag SAM_TAG]
+						[--seed SEED] [--tag_buffer TAG_BUFFER]
+						[--mate_buffer MATE_BUFFER]
+						[--processes PROCESSES] [--chunk_size CHUNK_SIZE]
+						[--duplex DUPLEX] [--barcode_length BLENGTH]
+						[--dcs_Ncut_off DCS_NCUT_OFF] [--gzip-fqs] [--no_sscs]
+						[--side_outputs {bam,summary,counts,off}]
+						[--threads THREADS]
 
 optional arguments:
 	-h, --help            show this help message and exit
@@ -76,6 +84,43 @@ optional arguments:
 	--sam_tag SAM_TAG     The SAM tag that store the duplex tag sequence (can
 						be set one more times).  Otherwise use the sequence
 						in the read name."
+	--seed SEED         Seed for the sample of reads used for families larger
+						than --maxmem. [0]
+	--tag_buffer TAG_BUFFER
+						Number of distinct tags counted in memory; past that,
+						counts are kept in temporary files next to the tag
+						file. [1000000]
+	--mate_buffer MATE_BUFFER
+						Number of unpaired SSCSs kept in memory while
+						waiting for their mates; past that, some are kept in
+						a temporary file next to the output. [1000000]
+	--processes PROCESSES
+						Number of worker processes.  With more than one,
+						regions of the input, which must be indexed, are
+						processed in parallel. [1]
+	--chunk_size CHUNK_SIZE
+						Length of the regions given to each worker with
+						--processes. [10000000]
+	--duplex DUPLEX     Also make DCSs, as DuplexMaker.py would from the
+						sorted SSCSs, and write them to this BAM file and to
+						a pair of fastq files next to it.
+	--barcode_length BLENGTH
+						With --duplex, length of the duplex tag sequence.
+						Should match the value in tag_to_header. [12]
+	--dcs_Ncut_off DCS_NCUT_OFF
+						With --duplex, maximum fraction of Ns allowed in a
+						DCS [1.0]
+	--gzip-fqs          With --duplex, output gzipped fastqs [False]
+	--no_sscs           With --duplex, do not write the SSCSs (--outfile
+						still names the other outputs). [False]
+	--side_outputs {bam,summary,counts,off}
+						What to write of the reads with less common cigar
+						strings and the bad reads: bam: the _LCC.bam and
+						_NM.bam files.  summary: _LCC.txt and _NM.txt tables
+						with one line per family.  counts: only their counts,
+						in _side_counts.txt.  off: nothing. [bam]
+	--threads THREADS   Number of threads used to compress the _LCC.bam and
+						_NM.bam files. [1]
 
 Details of different arguments:
 	--minmem and --maxmem set the range of family sizes (constrained by cigar score) that can be used to make a
@@ -89,7 +134,7 @@ Details of different arguments:
 			has a cigar string of 20M1D60M.  No SSCS results.
 		Example 3:
 			A family with over 1000 members exists.  A random sample of 1000 reads from that family is used to make a
-			SSCS.
+			SSCS.  The sample depends only on --seed and the family, so reruns give the same SSCS.
 	--cut_off sets the strictness of the consensus making.
 		Example (--cut_off = 0.7):
 			Four reads (read_length = 10) are as follows:
@@ -126,14 +171,69 @@ Details of different arguments:
 	--isize
 		If not -1, sets the maximum distance between read 1 and read 2 for the two to not be considered unpaired.  Only 
 		works if --read_type is 'd'
+	--mate_buffer
+		SSCSs are kept until their mate is made.  When more than --mate_buffer are waiting, those whose mate position 
+		has already been passed, and then the oldest others, are moved to a temporary file until half the limit is 
+		left; they can still be paired from there, and are written in their original order at the end, so the 
+		outputs do not change.
+	--processes and --chunk_size
+		With --processes N, the contigs are cut into regions of --chunk_size bases, and N worker processes make the 
+		SSCSs for the reads starting in each region (reads with no coordinate form a last region of their own).  
+		Each worker writes its own side outputs, and its SSCSs in the order it made them; the main process then 
+		pairs the SSCSs, moves distant unpaired ones to the _UP file, and concatenates the files, region by region, 
+		so that mates and families that cross from one region to the next are handled as in a single process.  The 
+		outputs are the same as without --processes: the sample of a family larger than --maxmem is seeded by 
+		--seed and the family, so it is the same with or without --processes.
+	--duplex
+		The two strands of a duplex are aligned at the same position, so their SSCSs are made together.  With 
+		--duplex DCS.bam, the SSCSs made at each position are paired with the SSCSs of the other strand (the tag 
+		with its two halves of --barcode_length swapped) and their DCSs are written straight away to DCS.bam, 
+		DCS.r1.fq and DCS.r2.fq, which replaces sorting the SSCSs and running DuplexMaker.py.  DCSs are made 
+		from every SSCS, including those that end up in the _UP file, and each is named after the smaller of its 
+		two tags, so the DCSs of read 1 and read 2 are always given the same name and paired.  Their cigar strings 
+		are a plain match of --read_length.  With --no_sscs, the SSCSs are not written at all and no _UP file is 
+		made.
+	--side_outputs
+		Writing every bad read to the _NM file, and building a new read for every read with a less common cigar 
+		string for the _LCC file, can cost as much as the SSCSs on a noisy library.  With 'bam', the default, the 
+		files are as they have always been, compressed with --threads threads.  With 
+		'summary', _LCC.txt and _NM.txt take their place: tab-separated tables, with a header, of one line per 
+		family and less common cigar string (contig, pos, tag, family_size, family_cigar, cigar, reads) or per 
+		family and reason for rejection (contig, pos, tag, reason, reads).  Positions are 1-based, and reads 
+		counts all the reads of the family concerned.  With 'counts', the rejected reads are only counted, and 
+		the counts written to _side_counts.txt; with 'off', nothing is written.  The summary statistics are the 
+		same with every choice.
 """
 
+import os
 import sys
+import shutil
+import numpy
 import pysam
 import random
-from collections import defaultdict
+import re
+from collections import defaultdict, deque
+from multiprocessing import Pool
 from argparse import ArgumentParser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.duplex import DuplexWriter, dcs_batch
+from dsutils.matebuffer import MateBuffer
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+from dsutils.regions import fetch_region, genome_chunks, read_key, region_reads
+from dsutils.sideoutputs import POLICIES, SideOutputs, merge_side_outputs, write_side_counts
+from dsutils.tagcounts import TagCounts
+
+
+# Codes for consensus_batch: T, C, G and A are 0 to 3, anything else counts as N (4).
+NUC_CODES = numpy.full(256, 4, numpy.uint8)
+NUC_CODES[numpy.frombuffer(b'TCGA', numpy.uint8)] = numpy.arange(4)
+NUC_CHARS = numpy.frombuffer(b'TCGAN', numpy.uint8)
+
+# Cigar operations, in the order of their codes in pysam.
+CIGAR_OPS = 'MIDNSHP=XB'
+CIGAR_RE = re.compile(r'(\d+)(\D)')
+
 
 def print_read(read_in):
 	sys.stderr.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (read_in.qname, read_in.flag, read_in.tid, 
@@ -150,9 +250,9 @@ def consensus_maker(grouped_reads_list,  cut_off,  read_length):
 	nuc_key_dict = {0: 'T', 1: 'C', 2: 'G', 3: 'A', 4: 'N'}
 	consensus_read = ''
 
-	for i in xrange(read_length):  # Count the types of nucleotides at a position in a read. i is the nucleotide index 
+	for i in range(read_length):  # Count the types of nucleotides at a position in a read. i is the nucleotide index 
 		# within a read in grouped_reads_list
-		for j in xrange(len(grouped_reads_list)):  # Do this for every read that comprises a SMI group. j is the read 
+		for j in range(len(grouped_reads_list)):  # Do this for every read that comprises a SMI group. j is the read 
 			# index within grouped_reads_list
 			try:
 				if grouped_reads_list[j][i] == 'T':
@@ -183,25 +283,428 @@ def consensus_maker(grouped_reads_list,  cut_off,  read_length):
 	return consensus_read, len(grouped_reads_list)
 
 
-def tag_stats(tag_counts_file, tag_stats_file):
-	fam_size_counts = defaultdict(lambda: 0)
+def consensus_batch(families, cut_off, read_length):
+	# consensus_maker for many families at once.  families is a list of lists of read sequences; returns the list of 
+	# their consensus sequences.  All the reads are stacked into one matrix of nucleotide codes (T, C, G, A, N, 
+	# and a filler for positions past the end of a read), and the counts for every family and position come from 
+	# one pass over it.  As in consensus_maker, a read that is too short stops the counting for the reads after it 
+	# in its family.
+	if not families:
+		return []
+	sizes = numpy.array([len(reads) for reads in families])
+	if not sizes.all():
+		# A family without reads has no consensus at any position.
+		consensuses = iter(consensus_batch([reads for reads in families if reads], cut_off, read_length))
+		return [next(consensuses) if reads else 'N' * read_length for reads in families]
+	reads = [read for family in families for read in family]
+	data = NUC_CODES[numpy.frombuffer("".join(reads).encode('ascii', 'replace'), numpy.uint8)]
+	lengths = numpy.array([len(read) for read in reads])
+	starts = numpy.cumsum(sizes) - sizes
+	if (lengths == read_length).all():
+		codes = data.reshape(len(reads), read_length)
+		counted = True
+		totals = sizes[:, None]
+	else:
+		used = numpy.minimum(lengths, read_length)
+		codes = numpy.full((len(reads), read_length), 5, numpy.uint8)
+		rows = numpy.repeat(numpy.arange(len(reads)), used)
+		columns = numpy.arange(used.sum()) - numpy.repeat(numpy.cumsum(used) - used, used)
+		codes[rows, columns] = data[numpy.repeat(numpy.cumsum(lengths) - lengths, used) + columns]
+
+		# A read is counted at a position unless it, or an earlier read of its family, ends before that position.
+		ended = numpy.cumsum(codes == 5, axis=0)
+		ended_before = numpy.zeros((len(families), read_length), ended.dtype)
+		ended_before[1:] = ended[starts[1:] - 1]
+		counted = ended == numpy.repeat(ended_before, sizes, axis=0)
+		totals = numpy.add.reduceat(counted, starts, axis=0)
+
+	consensus = numpy.full((len(families), read_length), 4, numpy.uint8)
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		for nuc in (3, 2, 1, 0):  # Earlier nucleotides win, as in consensus_maker
+			counts = numpy.add.reduceat(counted & (codes == nuc), starts, axis=0)
+			consensus[counts / totals > cut_off] = nuc
+	text = NUC_CHARS[consensus].tobytes().decode()
+	return [text[i * read_length:(i + 1) * read_length] for i in range(len(families))]
+
+
+def get_good_flags(read_type):
+	# Flags of the reads that are used to make consensuses with --read_type read_type.
+	good_flag = set()
+	if 'd' in read_type:
+		good_flag.update((99, 83, 163, 147))
+	if 'm' in read_type:
+		good_flag.update((181, 117, 137, 133, 73, 89, 69, 153))
+	if 'p' in read_type:
+		good_flag.update((97, 81, 161, 145, 129, 65, 177, 113))
+	if 'n' in read_type:
+		good_flag.update((141, 77, 4))
+	if 's' in read_type:
+		good_flag.update((0, 16))
+	if 'u' in read_type:
+		good_flag.update((103, 167))
+	return good_flag
+
+
+def new_stats():
+	# Counters for the summary statistics.
+	return dict.fromkeys(('reads', 'nM', 'bF', 'oL', 'sC', 'rT', 'LCC', 'consensuses', 'nC', 'UP', 'duplexes',
+						'dcs_nC'), 0)
+
+
+def position_groups(bam_entry):
+	# Group consecutive reads that start at the same position of the same contig.  Yields (reads, next_pos) for each 
+	# group, where next_pos is the position of the first read after the group, or None after the last group.
+	reads = []
+	key = None
+	for read in bam_entry:
+		read_key = (read.tid, read.pos)
+		if read_key != key:
+			if reads:
+				yield reads, read_key[1]
+			reads = []
+			key = read_key
+		reads.append(read)
+	if reads:
+		yield reads, None
+
+
+def cigar_tuple(cigar_string):
+	# The cigar of a read, as a tuple of (operation, length), from its cigar string.
+	return tuple((CIGAR_OPS.index(operation), int(length)) for length, operation in CIGAR_RE.findall(cigar_string))
+
+
+def compile_read_filter(o):
+	# Compile --read_type, --filt and --rep_filt into one function, reject(read, flag, pos, cigar, tag), that gives 
+	# the reason a read is not used, as the key of its counter in the summary statistics (bad flag, overlap, 
+	# soft_clipping, repetitive tag, checked in that order), or None for a good read.  cigar is the cigar string.  
+	# Flags are looked up in a table which also says whether the overlap filter applies to them; the homomeric runs 
+	# are made once (substring tests are faster here than a regular expression).
+	flag_codes = bytearray(4096)  # 0: bad flag, 1: good flag, 2: good flag, check for overlap
+	for flag in get_good_flags(o.read_type):
+		flag_codes[flag] = 1
+	if 'o' in o.filt:
+		for flag in (83, 99, 147, 163):
+			if flag_codes[flag]:
+				flag_codes[flag] = 2
+	check_soft_clip = 's' in o.filt
+	run_a, run_c, run_g, run_t = (base * o.rep_filt for base in 'ACGT')
+	read_length = o.read_length
+
+	def reject(read, flag, pos, cigar, tag):
+		code = flag_codes[flag] if flag < 4096 else 0
+		if code == 0:
+			return 'bF'
+		if code == 2 and pos - read_length < read.mpos < pos + read_length:
+			return 'oL'
+		if check_soft_clip and 'S' in cigar:
+			return 'sC'
+		if run_a in tag or run_c in tag or run_g in tag or run_t in tag:
+			return 'rT'
+		return None
+	return reject
+
+
+def sort_reads(reads, o, read_filter, tag_counts, side_outputs, stats):
+	# Count the tags of the reads at one position, and bucket the reads that pass read_filter (from 
+	# compile_read_filter) into a read dictionary by tag and cigar string.  Reads that fail are 
+	# given to side_outputs, if it wants them.  Each attribute of a read is looked up once, and whatever is the same for the whole 
+	# group is worked out once.  The tag counts of the group are added to tag_counts at the end.
+	read_dict = {}
+	tag_dict = defaultdict(lambda: 0)
+	rejected = dict.fromkeys(('bF', 'oL', 'sC', 'rT'), 0)
+	rejected_reads = []
+	keep_reads = side_outputs.keep_reads
+	samtags = o.samtags
+	tid = reads[0].tid
+	pos = reads[0].pos
+	for n, read in enumerate(reads):
+		flag = read.flag
+		try:
+			if samtags:
+				tag = "".join([tag_tuple[1] for tag_tuple in read.tags if tag_tuple[0] in samtags])
+			else:
+				tag = read.qname.split('|')[1].split('/')[0]
+			tag += (":1" if flag & 64 else (":2" if flag & 128 else ":se"))
+			tag_dict[tag] += 1
+		except:
+			print(stats['reads'] + n)
+			raise
+
+		cigar = read.cigarstring or ''
+		reason = read_filter(read, flag, pos, cigar, tag)
+		if reason is None:
+			# Add the sequence to the read dictionary
+			if tag not in read_dict:
+				read_dict[tag] = [flag, tid, pos, read.mrnm, read.mpos, read.isize, {}]
+			cigars = read_dict[tag][6]
+			if cigar not in cigars:
+				cigars[cigar] = [0, cigar_tuple(cigar)]
+			cigars[cigar].append(read.seq)
+			cigars[cigar][0] += 1
+		else:
+			rejected[reason] += 1
+			if keep_reads:
+				rejected_reads.append((read, tag, reason))
+	stats['reads'] += len(reads)
+	for reason, count in rejected.items():
+		stats['nM'] += count
+		stats[reason] += count
+	side_outputs.rejected(rejected_reads)
+	tag_counts.add(tag_dict)
+	return read_dict
+
+
+def make_consensuses(read_dict, o, quality_score, side_outputs, stats):
+	# Make the SSCSs for all the tags at one position.  Returns a list of (tag, SSCS) in tag order; reads with less 
+	# common cigar strings are given to side_outputs, if it wants them.
+	families = []
+	less_common = []
+	for dict_tag, tag_reads in read_dict.items():
+		# Cigar string filtering: use the most common cigar string (the larger one on a tie)
+		cigars = tag_reads[6]
+		max_cigar = max(cigars, key=lambda cigar: cigars[cigar][:2])
+
+		if cigars[max_cigar][0] >= o.minmem:
+			stats['consensuses'] += 1
+			seqs = cigars[max_cigar][2:]
+			if len(seqs) > o.maxmem:
+				# The sample is seeded by the family, so it is the same on every run and with --processes.
+				seqs = random.Random("%s:%s:%s:%s" % (o.seed, tag_reads[1], tag_reads[2], dict_tag)).sample(
+					seqs, o.maxmem)
+			fam_size = len(seqs)
+
+			for cigar in cigars:
+				if cigar != max_cigar:
+					# As always, all but two of the reads with a less common cigar string are counted.
+					stats['LCC'] += max(0, cigars[cigar][0] - 2)
+					if side_outputs.keep_reads:
+						less_common.append((dict_tag, tag_reads, fam_size, cigars[max_cigar][1], cigars[cigar][1], 
+											cigars[cigar][2:]))
+			families.append((dict_tag, cigars[max_cigar][1], seqs))
+	side_outputs.less_common(less_common)
+
+	made = []
+	consensuses = consensus_batch([seqs for dict_tag, max_cigar, seqs in families], o.cut_off, o.read_length)
+	for (dict_tag, max_cigar, seqs), consensus in zip(families, consensuses):
+		# Filter out consensuses with too many Ns in them
+		if (consensus.count("N")/ float(len(consensus)) <= o.Ncut_off and 'n' in o.filt) or ('n' not in o.filt):
+			tag_reads = read_dict[dict_tag]
+			a = pysam.AlignedRead()
+			a.qname = dict_tag + ":" + str(len(seqs))
+			a.flag = tag_reads[0]
+			a.seq = consensus
+			a.rname = tag_reads[1]
+			a.pos = tag_reads[2]
+			a.mapq = 255
+			a.cigar = max_cigar
+			a.mrnm = tag_reads[3]
+			a.mpos = tag_reads[4]
+			a.isize = tag_reads[5]
+			a.qual = quality_score
+			made.append((dict_tag, a))
+		else:
+			stats['nC'] += 1
+	return made
 
-	in_file = open(tag_counts_file, 'r')
-	out_file = open(tag_stats_file, 'w')
-	for line in in_file:
-		fam_size_counts[int(line.strip().split()[1].split(":")[0])] += 1
-	in_file.close()
 
-	totals = 0
-	for size in fam_size_counts.keys():
-		fam_size_counts[size] *= int(size)
-		totals += int(fam_size_counts[size])
+def pair_consensus(dict_tag, a, consensus_dict, out_bam_file):
+	# Write SSCSs to output BAM file in read pairs.
+	altTag = dict_tag.replace(("1" if "1" in dict_tag else "2"), ("2" if "1" in dict_tag else "1"))
 
-	for size in sorted(fam_size_counts.keys()):
-		out_file.write("%s\t%s\n" % (size, float(fam_size_counts[size])/float(totals)))
+	if altTag in consensus_dict:
+		if a.is_read1 is True:
+			out_bam_file.write(a)
+			out_bam_file.write(consensus_dict.pop(altTag))
+		else:
+			out_bam_file.write(consensus_dict.pop(altTag))
+			out_bam_file.write(a)
+	else:
+		consensus_dict[dict_tag] = a
+
+
+def make_duplexes(made, o, quality_score, stats):
+	# With --duplex: make the DCSs from the SSCSs made at one position, pairing each tag with the tag of the other 
+	# strand, tag[blength:] + tag[:blength], as DuplexMaker.py does.  A DCS is named after the smaller of its two 
+	# tags, so that the DCSs for read 1 and read 2 of a molecule get the same name and are paired.  Returns a list of 
+	# (name, DCS).
+	sscs = {}
+	for dict_tag, a in made:
+		if a.is_unmapped is False:
+			sscs[dict_tag.split(':')[0]] = a
+	pairs = []
+	for tag in list(sscs.keys()):
+		switch_tag = tag[o.blength:] + tag[:o.blength]
+		if tag in sscs and switch_tag in sscs:
+			dcs_tag = min(tag, switch_tag)
+			pairs.append((dcs_tag, sscs[tag].seq, sscs[switch_tag].seq, sscs[dcs_tag]))
+			del sscs[tag]
+			sscs.pop(switch_tag, None)
+	consensuses = dcs_batch([(seq, switch_seq) for dcs_tag, seq, switch_seq, sscs_read in pairs], o.read_length, 
+							[sscs_read.is_reverse for dcs_tag, seq, switch_seq, sscs_read in pairs])
+
+	duplexes = []
+	for (dcs_tag, seq, switch_seq, sscs_read), consensus in zip(pairs, consensuses):
+		stats['duplexes'] += 1
+		# Filter out consensuses with too many Ns in them
+		if consensus.count("N")/float(len(consensus)) > o.dcs_Ncut_off:
+			stats['dcs_nC'] += 1
+			continue
+		a = pysam.AlignedRead()
+		a.qname = dcs_tag
+		a.flag = sscs_read.flag
+		a.seq = consensus  # Already reverse complemented for reverse strand reads
+		a.rname = sscs_read.rname
+		a.pos = sscs_read.pos
+		a.mapq = 255
+		a.cigar = [(0, o.read_length)]
+		a.mrnm = sscs_read.mrnm
+		a.mpos = sscs_read.mpos
+		a.isize = sscs_read.isize
+		a.qual = quality_score
+		duplexes.append((dcs_tag, a))
+	return duplexes
+
+
+def drop_distant(consensus_dict, pos, o, extraneous_read_bam, stats):
+	# With --read_type d and --isize, move SSCSs whose mates can no longer turn up before pos to the _UP file.
+	if o.read_type == 'd':
+		if o.isize != -1:
+			for consensus_tag, a in consensus_dict.pop_before(pos - o.isize):
+				extraneous_read_bam.write(a)
+				stats['UP'] += 1
+
+
+def edge_reads(in_bam_file):
+	# The loop in main() never processes the first read of the file, nor the last read if it is alone at its 
+	# position.  Find those reads, so that --processes can leave them out too.  Returns their keys, and the 
+	# position of the last read, which is where the last check for distant unpaired SSCSs is made.
+	first = next(in_bam_file.fetch(until_eof=True), None)
+	if first is None:
+		return [], None
+	skip = [read_key(first)]
+	if in_bam_file.nocoordinate > 1:
+		return skip, -1
+	if in_bam_file.nocoordinate == 1:
+		last_reads = deque(in_bam_file.fetch('*'))
+	else:
+		last_reads = deque()
+	for contig_stats in reversed(in_bam_file.get_index_statistics()):
+		if len(last_reads) >= 2:
+			break
+		if contig_stats.total == 0:
+			continue
+		# Look back from the end of the contig until enough reads start in the window.
+		length = in_bam_file.get_reference_length(contig_stats.contig)
+		width = 1000
+		while True:
+			start = max(0, length - width)
+			window = deque((read for read in in_bam_file.fetch(contig_stats.contig, start, length) 
+							if read.pos >= start), maxlen=2 - len(last_reads))
+			if len(window) + len(last_reads) >= 2 or start == 0:
+				break
+			width *= 10
+		last_reads.extendleft(reversed(window))
+	if len(last_reads) == 2 and (last_reads[1].tid, last_reads[1].pos) != (last_reads[0].tid, last_reads[0].pos):
+		skip.append(read_key(last_reads[1]))
+	return skip, last_reads[-1].pos
+
+
+def consensus_chunk(job):
+	# Worker for --processes: make the SSCSs for the reads starting in one region.  SSCSs are not paired here; they 
+	# are written to prefix.bam in the order they are made, and events records how many were made before each check 
+	# for distant unpaired SSCSs, and at which position, so that replay_chunk can pair them exactly as main() would.  
+	# With --duplex, the DCSs are written, also unpaired, to prefix.dcs.bam.
+	o, region, skip, prefix = job
+	read_filter = compile_read_filter(o)
+	quality_score = 'J' * o.read_length
+	stats = new_stats()
+	tag_counts = TagCounts(o.tag_buffer, os.path.dirname(os.path.abspath(o.tag_file)))
+
+	in_bam_file = pysam.Samfile(o.infile, "rb")
+	sscs_file = pysam.Samfile(prefix + ".bam", "wb0", template=in_bam_file)
+	side_outputs = SideOutputs(o.side_outputs, prefix, in_bam_file, quality_score, o.threads, header=False)
+	if o.duplex is not None:
+		dcs_file = pysam.Samfile(prefix + ".dcs.bam", "wb0", template=in_bam_file)
+	bam_entry = region_reads(fetch_region(in_bam_file, region), region, skip)
+
+	events = []
+	first_pos = None
+	for reads, next_pos in position_groups(bam_entry):
+		if first_pos is None:
+			first_pos = reads[0].pos
+		read_dict = sort_reads(reads, o, read_filter, tag_counts, side_outputs, stats)
+		made = make_consensuses(read_dict, o, quality_score, side_outputs, stats)
+		for dict_tag, a in made:
+			sscs_file.write(a)
+		if o.duplex is not None:
+			for dcs_tag, a in make_duplexes(made, o, quality_score, stats):
+				dcs_file.write(a)
+		if not made and events and next_pos is not None:
+			events[-1][1] = max(events[-1][1], next_pos)
+		else:
+			events.append([len(made), next_pos])  # None: checked at the first position of the next region
 
-	out_file.close()
-	return True
+	in_bam_file.close()
+	sscs_file.close()
+	side_outputs.close()
+	if o.duplex is not None:
+		dcs_file.close()
+	return {'prefix': prefix, 'first_pos': first_pos, 'events': events, 'stats': stats, 'tags': tag_counts.export()}
+
+
+def replay_chunk(result, o, consensus_dict, out_bam_file, extraneous_read_bam, duplex_writer, stats):
+	# Pair the SSCSs made by consensus_chunk, and drop distant unpaired ones, in the order main() would have.  Then 
+	# pair its DCSs.
+	if duplex_writer is not None:
+		dcs_file = pysam.Samfile(result['prefix'] + ".dcs.bam", "rb", check_sq=False)
+		for a in dcs_file.fetch(until_eof=True):
+			duplex_writer.write(a.qname, a)
+		dcs_file.close()
+	if o.no_sscs:
+		return
+	sscs_file = pysam.Samfile(result['prefix'] + ".bam", "rb", check_sq=False)
+	sscs = sscs_file.fetch(until_eof=True)
+	for made, pos in result['events']:
+		for n in range(made):
+			a = next(sscs)
+			pair_consensus(a.qname.rsplit(':', 1)[0], a, consensus_dict, out_bam_file)
+		if pos is not None:
+			drop_distant(consensus_dict, pos, o, extraneous_read_bam, stats)
+	sscs_file.close()
+
+
+def parallel_consensus(o, in_bam_file, out_bam_file, extraneous_read_bam, consensus_dict, duplex_writer, stats, 
+						tag_counts):
+	# Make the SSCSs for the regions of the input in o.processes worker processes, then pair them, merge the counts, 
+	# and concatenate the side outputs of the regions in order.  Unpaired SSCSs are left in consensus_dict.
+	if not in_bam_file.has_index():
+		raise ValueError("--processes needs an index for %s (samtools index)" % o.infile)
+	skip, last_pos = edge_reads(in_bam_file)
+	chunk_dir = o.outfile.replace(".bam", ".chunks")
+	if not os.path.isdir(chunk_dir):
+		os.makedirs(chunk_dir)
+	jobs = [(o, region, skip, os.path.join(chunk_dir, str(i)))
+			for i, region in enumerate(genome_chunks(in_bam_file, o.chunk_size))]
+
+	checked = True
+	pool = Pool(o.processes)
+	for result in pool.imap(consensus_chunk, jobs):
+		for key in stats:
+			stats[key] += result['stats'][key]
+		tag_counts.absorb(result['tags'])
+		if result['first_pos'] is not None:
+			if not checked:
+				drop_distant(consensus_dict, result['first_pos'], o, extraneous_read_bam, stats)
+			replay_chunk(result, o, consensus_dict, out_bam_file, extraneous_read_bam, duplex_writer, stats)
+			checked = False
+		sys.stderr.write("Reads processed:" + str(stats['reads']) + "\n")
+	pool.close()
+	pool.join()
+	if not checked:
+		drop_distant(consensus_dict, last_pos, o, extraneous_read_bam, stats)
+
+	merge_side_outputs(o.side_outputs, o.outfile.replace(".bam", ""), [job[3] for job in jobs])
+	shutil.rmtree(chunk_dir)
 
 
 def main():
@@ -238,262 +741,161 @@ def main():
 	parser.add_argument('--sam_tag', action='append', type=str, dest='samtags', 
 						help="The SAM tag that store the duplex tag sequence (can be set one more times). "
 							" Otherwise use the sequence in the read name.", default=list())
+	parser.add_argument('--seed', type=int, default=0, dest='seed',
+						help="Seed for the sample of reads used for families larger than --maxmem. [0]")
+	parser.add_argument('--tag_buffer', type=int, default=1000000, dest='tag_buffer',
+						help="Number of distinct tags counted in memory; past that, counts are kept in temporary files "
+							"next to the tag file. [1000000]")
+	parser.add_argument('--mate_buffer', type=int, default=1000000, dest='mate_buffer',
+						help="Number of unpaired SSCSs kept in memory while waiting for their mates; past that, some "
+							"are kept in a temporary file next to the output. [1000000]")
+	parser.add_argument('--processes', type=int, default=1, dest='processes',
+						help="Number of worker processes.  With more than one, regions of the input, which must be "
+							"indexed, are processed in parallel. [1]")
+	parser.add_argument('--chunk_size', type=int, default=10000000, dest='chunk_size',
+						help="Length of the regions given to each worker with --processes. [10000000]")
+	parser.add_argument('--duplex', action="store", dest='duplex', default=None,
+						help="Also make DCSs, as DuplexMaker.py would from the sorted SSCSs, and write them to this BAM "
+							"file and to a pair of fastq files next to it.")
+	parser.add_argument('--barcode_length', type=int, default=12, dest='blength',
+						help="With --duplex, length of the duplex tag sequence. Should match the value in "
+							"tag_to_header. [12]")
+	parser.add_argument('--dcs_Ncut_off', type=float, default=1.0, dest='dcs_Ncut_off',
+						help="With --duplex, maximum fraction of Ns allowed in a DCS [1.0]")
+	parser.add_argument('--gzip-fqs', action="store_true", default=False, dest='gzip_fastqs',
+						help="With --duplex, output gzipped fastqs [False]")
+	parser.add_argument('--no_sscs', action="store_true", default=False, dest='no_sscs',
+						help="With --duplex, do not write the SSCSs (--outfile still names the other outputs). "
+							"[False]")
+	parser.add_argument('--side_outputs', choices=POLICIES, default='bam', dest='side_outputs',
+						help="What to write of the reads with less common cigar strings and the bad reads: bam: the "
+							"_LCC.bam and _NM.bam files.  summary: _LCC.txt and _NM.txt tables with one line per "
+							"family.  counts: only their counts, in _side_counts.txt.  off: nothing. [bam]")
+	parser.add_argument('--threads', type=int, default=1, dest='threads',
+						help="Number of threads used to compress the _LCC.bam and _NM.bam files. [1]")
+	add_profile_arguments(parser, ['consensus', 'tagcounts'])
 	o = parser.parse_args()
+	if o.no_sscs and o.duplex is None:
+		parser.error("--no_sscs needs --duplex")
+	profiler = profiler_from_args(o, o.outfile.replace(".bam", ""))
+	profiler.start()
 
 	# Initialization of all global variables, main input/output files, and main iterator and dictionaries.
-	good_flag = []
-	if 'd' in o.read_type:
-		good_flag.extend((99, 83, 163, 147))
-	if 'm' in o.read_type:
-		good_flag.extend((181, 117, 137, 133, 73, 89, 69, 153))
-	if 'p' in o.read_type:
-		good_flag.extend((97, 81, 161, 145, 129, 65, 177, 113))
-	if 'n' in o.read_type:
-		good_flag.extend((141, 77, 4))
-	if 's' in o.read_type:
-		good_flag.extend((0, 16))
-	if 'u' in o.read_type:
-		good_flag.extend((103, 167))
+	read_filter = compile_read_filter(o)
 
 	in_bam_file = pysam.Samfile(o.infile, "rb")  # Open the input BAM file
-	out_bam_file = pysam.Samfile(o.outfile, "wb", template=in_bam_file)  # Open the output BAM file
-	outNC1 = pysam.Samfile(o.outfile.replace(".bam", "_LCC.bam"), "wb", template=in_bam_file)
-	nonmapped_file = pysam.Samfile(o.outfile.replace(".bam", "_NM.bam"), "wb", template=in_bam_file)  # File for reads
-	# with strange flags
-	if o.read_type == 'd':
+	out_bam_file = None
+	if not o.no_sscs:
+		out_bam_file = pysam.Samfile(o.outfile, "wb", template=in_bam_file)  # Open the output BAM file
+	extraneous_read_bam = None
+	if o.read_type == 'd' and not o.no_sscs:
 		extraneous_read_bam = pysam.Samfile(o.outfile.replace(".bam", "_UP.bam"), "wb", template=in_bam_file)
-	samtags = o.samtags
-
-	read_number_count = 0
-	nM = 0
-	bF = 0
-	oL = 0
-	sC = 0
-	rT = 0
-	nC = 0
 
-	LCC = 0
-	consenuses_made = 0
-	if o.read_type == 'd':
-		UP = 0
+	stats = new_stats()
+	# Tag counts; past --tag_buffer distinct tags, they are kept in temporary files next to the tag file
+	tag_counts = TagCounts(o.tag_buffer, os.path.dirname(os.path.abspath(o.tag_file)))
 
-	file_done = False  # Initialize end of file bool
-	read_one = False
+	# SSCSs waiting for their mates; past --mate_buffer of them, some are kept in a temporary file
+	consensus_dict = MateBuffer(o.mate_buffer, os.path.dirname(os.path.abspath(o.outfile)))
 
+	# With --duplex, the DCS BAM and fastq files, and the DCSs waiting for their mates
+	duplex_writer = None
+	if o.duplex is not None:
+		duplex_writer = DuplexWriter(o.duplex, in_bam_file, o.gzip_fastqs, o.mate_buffer,
+									os.path.dirname(os.path.abspath(o.duplex)))
 	quality_score = 'J' * o.read_length  # Set a dummy quality score
 
-	bam_entry = in_bam_file.fetch(until_eof=True)  # Initialize the iterator
-	read_window = [bam_entry.next(), '']  # Get the first read
-	window_position = 0
-
-	read_dict = {}  # Initialize the read dictionary
-	tag_dict = defaultdict(lambda: 0)  # Initialize the tag dictionary
-
-	consensus_dict = {}
-
-# Start going through the input BAM file, one position at a time.
-	for line in bam_entry:
-		window_position += 1
-		read_window[window_position % 2] = line
-		# Reinitialize first line
-		if read_one is True:
-			window_position -= 1
-		while (read_window[window_position % 2].pos == read_window[(window_position-1) % 2].pos and
-							file_done is False and read_one is False) or read_one is True:
-			if read_number_count % o.rOut == 0:
-				sys.stderr.write("Reads processed:" + str(read_number_count) + "\n")
-			try:
-				if 0 < len(samtags):
-					tag = "".join([tag_tuple[1] for tag_tuple in read_window[window_position%2].tags if tag_tuple[0] in samtags])
-				else:
-					tag = read_window[window_position % 2].qname.split('|')[1].split('/')[0]
-				tag += (":1" if read_window[window_position % 2].is_read1 is True
-							else (":2" if read_window[window_position % 2].is_read2 is True else ":se"))
-				tag_dict[tag] += 1
-			except:
-				print read_number_count
-				raise
-
-			# Overlap filter: filters out overlapping reads (with --filt o)
-			overlap = False
-			if 'o' in o.filt:
-				if read_window[window_position % 2].pos < read_window[window_position % 2].mpos and \
-								read_window[window_position % 2].mpos < read_window[window_position % 2].pos + \
-								o.read_length and int(read_window[window_position % 2].flag) in (83, 99, 147, 163):
-					overlap = True
-				elif read_window[window_position % 2].pos > read_window[window_position % 2].mpos \
-						and read_window[window_position % 2].pos < read_window[window_position % 2].mpos + o.read_length \
-						and int(read_window[window_position % 2].flag) in (83, 99, 147, 163):
-					overlap = True
-				elif read_window[window_position % 2].pos == read_window[window_position % 2].mpos \
-						and int(read_window[window_position % 2].flag) in (83, 99, 147, 163):
-					overlap = True
-					
-			read_number_count += 1
-
-			# soft_clip filter: filters out soft_clipped reads (with --filt s)
-			soft_clip = False
-			if 's' in o.filt:
-				if read_window[window_position % 2].cigar is not None:
-					for tupple in read_window[window_position % 2].cigar:
-						if tupple[0] == 4:
-							soft_clip = True
-
-			# Check if the given read is good data
-			if int(read_window[window_position % 2].flag) in good_flag and overlap is False and soft_clip is False:
-				if ('A' * o.rep_filt in tag) or ('C' * o.rep_filt in tag) or ('G' * o.rep_filt in tag) \
-						or ('T' * o.rep_filt in tag):
-					# Check for bad barcodes
-					nM += 1
-					nonmapped_file.write(read_window[window_position % 2])
-					rT += 1
-				else:
-					# Add the sequence to the read dictionary
-					if tag not in read_dict:
-						read_dict[tag] = [read_window[window_position % 2].flag, read_window[window_position % 2].rname,
-										read_window[window_position % 2].pos, read_window[window_position % 2].mrnm,
-										read_window[window_position % 2].mpos, read_window[window_position % 2].isize,
-										{str(read_window[window_position % 2].cigar):[0, read_window[window_position%2].cigar]}]
-
-					if str(read_window[window_position % 2].cigar) not in read_dict[tag][6]:
-						read_dict[tag][6][str(read_window[window_position % 2].cigar)] = \
-							[0, read_window[window_position % 2].cigar]
-
-					read_dict[tag][6][str(read_window[window_position % 2].cigar)].append(read_window[window_position%2].seq)
-					read_dict[tag][6][str(read_window[window_position % 2].cigar)][0] += 1
-			else:
-				nM += 1
-				nonmapped_file.write(read_window[window_position % 2])
-				if int(read_window[window_position % 2].flag) not in good_flag:
-					bF += 1
-				elif overlap is True:
-					oL += 1
-				elif soft_clip is True:
-					sC += 1
-
-			window_position += 1
-			if read_one is False:
-				try:  # Keep StopIteration error from happening at the end of a file
-					read_window[window_position % 2] = bam_entry.next()  # Iterate the line
-				except:
-					file_done = True  # Tell the program that it has reached the end of the file
+	profiler.begin('consensus')
+	if o.processes > 1:
+		parallel_consensus(o, in_bam_file, out_bam_file, extraneous_read_bam, consensus_dict, duplex_writer, stats,
+						tag_counts)
+	else:
+		# Files for reads with less common cigar strings and reads with strange flags, as --side_outputs says
+		side_outputs = SideOutputs(o.side_outputs, o.outfile.replace(".bam", ""), in_bam_file, quality_score, 
+									o.threads)
+
+		bam_entry = in_bam_file.fetch(until_eof=True)  # Initialize the iterator
+		# The first read of the file, and the last read if it is alone at its position, have never been sent to the 
+		# consensus maker; they are still left out so that the output stays the same.
+		first_read = next(bam_entry, None)
+		if first_read is not None:
+			first_key = (first_read.tid, first_read.pos)
+
+		# Go through the input BAM file, one position at a time.
+		for reads, next_pos in position_groups(bam_entry):
+			if next_pos is None and len(reads) == 1 and (reads[0].tid, reads[0].pos) != first_key:
+				next_pos = reads[0].pos
 			else:
-				read_one = False
-		else:
-
-			# Send reads to consensus_maker
-			read_one = True
-			for dict_tag in read_dict.keys():  # Extract sequences to send to the consensus maker
-				# Cigar string filtering
-				cigar_string_set = {}
-
-				for cigar_string in read_dict[dict_tag][6].keys():  # Determine the most common cigar string
-					cigar_string_set[cigar_string] = read_dict[dict_tag][6][cigar_string][0]
-
-				max_cigar = max(cigar_string_set)
-
-				if cigar_string_set[max_cigar] >= o.minmem:
-					if cigar_string_set[max_cigar] <= o.maxmem:
-						consenuses_made += 1
-						consensus, fam_size = consensus_maker(read_dict[dict_tag][6][max_cigar][2:], o.cut_off,
-																o.read_length)
-					else:
-						consenuses_made += 1
-						consensus, fam_size = consensus_maker(random.sample(read_dict[dict_tag][6][max_cigar][2:],
-																			o.maxmem), o.cut_off, o.read_length)
-
-					for cigar_string in read_dict[dict_tag][6].keys():
-						if cigar_string != max_cigar:
-							for n in xrange(2, len(read_dict[dict_tag][6][cigar_string][2:])):
-								a = pysam.AlignedRead()
-								a.qname = dict_tag + ':' + str(fam_size)
-								a.flag = read_dict[dict_tag][0]
-								a.seq = read_dict[dict_tag][6][cigar_string][n]
-								a.rname = read_dict[dict_tag][1]
-								a.pos = read_dict[dict_tag][2]
-								a.mapq = 255
-								a.cigar = read_dict[dict_tag][6][cigar_string][1]
-								a.mrnm = read_dict[dict_tag][3]
-								a.mpos = read_dict[dict_tag][4]
-								a.isize = read_dict[dict_tag][5]
-								a.qual = quality_score  
-								outNC1.write(a)
-								LCC += 1
-
-					# Filter out consensuses with too many Ns in them
-					if (consensus.count("N")/ float(len(consensus)) <= o.Ncut_off and 'n' in o.filt) \
-							or ('n' not in o.filt):
-						# Write a line to the consensus_dictionary
-						a = pysam.AlignedRead()
-						a.qname = dict_tag + ":" + str(fam_size)
-						a.flag = read_dict[dict_tag][0]
-						a.seq = consensus
-						a.rname = read_dict[dict_tag][1]
-						a.pos = read_dict[dict_tag][2]
-						a.mapq = 255
-						a.cigar = read_dict[dict_tag][6][max_cigar][1]
-						a.mrnm = read_dict[dict_tag][3]
-						a.mpos = read_dict[dict_tag][4]
-						a.isize = read_dict[dict_tag][5]
-						a.qual = quality_score
-
-						# Write SSCSs to output BAM file in read pairs.
-						altTag = dict_tag.replace(("1" if "1" in dict_tag else "2"), ("2" if "1" in dict_tag else "1"))
-
-						if altTag in consensus_dict:
-							if a.is_read1 is True:
-								out_bam_file.write(a)
-								out_bam_file.write(consensus_dict.pop(altTag))
-							else:
-								out_bam_file.write(consensus_dict.pop(altTag))
-								out_bam_file.write(a)
-						else:
-							consensus_dict[dict_tag] = a
-					else:
-						nC += 1
-		read_dict = {}  # Reset the read dictionary
-		if o.read_type == 'd':
-			if o.isize != -1:
-				for consensus_tag in consensus_dict.keys():
-					if consensus_dict[consensus_tag].pos + o.isize < read_window[window_position % 2].pos:
-						extraneous_read_bam.write(consensus_dict.pop(consensus_tag))
-						UP += 1
+				reads_before = stats['reads']
+				read_dict = sort_reads(reads, o, read_filter, tag_counts, side_outputs, stats)
+				if reads_before // o.rOut != stats['reads'] // o.rOut:
+					sys.stderr.write("Reads processed:" + str(stats['reads']) + "\n")
+
+				# Send reads to consensus_maker
+				made = make_consensuses(read_dict, o, quality_score, side_outputs, stats)
+				if not o.no_sscs:
+					for dict_tag, a in made:
+						pair_consensus(dict_tag, a, consensus_dict, out_bam_file)
+				if duplex_writer is not None:
+					for dcs_tag, a in make_duplexes(made, o, quality_score, stats):
+						duplex_writer.write(dcs_tag, a)
+				if next_pos is None:
+					next_pos = reads[-1].pos
+			drop_distant(consensus_dict, next_pos, o, extraneous_read_bam, stats)
+
+		side_outputs.close()
 
 	# Write unpaired SSCSs
-	for consensus_tag in consensus_dict.keys():
+	for consensus_tag, a in consensus_dict.pop_all():
 		if o.read_type == 'd':
-			extraneous_read_bam.write(consensus_dict.pop(consensus_tag))
-			UP += 1
+			extraneous_read_bam.write(a)
+			stats['UP'] += 1
 		else:
-			out_bam_file.write(consensus_dict.pop(consensus_tag))
+			out_bam_file.write(a)
+	consensus_dict.close()
+
+	# Write unpaired DCSs
+	if duplex_writer is not None:
+		duplex_writer.write_unpaired(o.read_length, quality_score, [(0, o.read_length)])
+		duplex_writer.close()
+
+	profiler.end('consensus')
 
 	# Close BAM files
 	in_bam_file.close()
-	out_bam_file.close()
-	nonmapped_file.close()
-	outNC1.close()
+	if out_bam_file is not None:
+		out_bam_file.close()
 
-	if o.read_type == 'd':
+	if extraneous_read_bam is not None:
 		extraneous_read_bam.close()
 
+	if o.side_outputs == 'counts':
+		write_side_counts(o.outfile.replace(".bam", "_side_counts.txt"), stats)
+
 	# Write summary statistics
 	sys.stderr.write("Summary Statistics: \n")
-	sys.stderr.write("Reads processed:" + str(read_number_count) + "\n")
-	sys.stderr.write("Bad reads: %s\n" % nM)
-	sys.stderr.write("\tReads with Bad Flags: %s\n" % bF)
-	sys.stderr.write("\tOverlapping Reads: %s\n" % oL)
-	sys.stderr.write("\tsoft_clipped Reads: %s\n" % sC)
-	sys.stderr.write("\tRepetitive Duplex Tag: %s\n" % rT)
-	sys.stderr.write("Reads with Less Common Cigar Strings: %s\n" % LCC)
-	sys.stderr.write("Consensuses Made: %s\n" % consenuses_made)
-	sys.stderr.write("Consensuses with Too Many Ns: %s\n\n" % nC)
+	sys.stderr.write("Reads processed:" + str(stats['reads']) + "\n")
+	sys.stderr.write("Bad reads: %s\n" % stats['nM'])
+	sys.stderr.write("\tReads with Bad Flags: %s\n" % stats['bF'])
+	sys.stderr.write("\tOverlapping Reads: %s\n" % stats['oL'])
+	sys.stderr.write("\tsoft_clipped Reads: %s\n" % stats['sC'])
+	sys.stderr.write("\tRepetitive Duplex Tag: %s\n" % stats['rT'])
+	sys.stderr.write("Reads with Less Common Cigar Strings: %s\n" % stats['LCC'])
+	sys.stderr.write("Consensuses Made: %s\n" % stats['consensuses'])
+	if duplex_writer is None:
+		sys.stderr.write("Consensuses with Too Many Ns: %s\n\n" % stats['nC'])
+	else:
+		sys.stderr.write("Consensuses with Too Many Ns: %s\n" % stats['nC'])
+		sys.stderr.write("Duplexes Made: %s\n" % stats['duplexes'])
+		sys.stderr.write("Unpaired Duplexes: %s\n" % duplex_writer.unpaired)
+		sys.stderr.write("N-clipped Duplexes: %s\n\n" % stats['dcs_nC'])
 
 	# Write the tag counts file.
-	tag_file = open( o.tag_file, "w" )
-	tag_file.write ( "\n".join(["%s\t%d" % (SMI, tag_dict[SMI]) 
-								for SMI in sorted(tag_dict.keys(), key=lambda x: tag_dict[x], reverse=True ) ] ))
-	tag_file.close()
-	tag_stats(o.tag_file, o.tag_stats)
+	profiler.begin('tagcounts')
+	tag_counts.write(o.tag_file, o.tag_stats)
+	tag_counts.close()
+	profiler.end('tagcounts')
+	profiler.stop()
 
 if __name__ == "__main__":
 	main()
@@ -10,6 +10,10 @@ Edited by Brendan Kohrn to fix a problem with 0 depth where no 0 depth should be
 
 This script pulls out the mutation frequencies from a pileup file given as stdin, or can take an imput file using the -i option, and writes to stdout, or can take an output file name.   
 
+The input file can also be a position-sorted BAM file of DCSs, with its reference genome (-f).  The pileup is then counted straight from the reads (dsutils/bampileup.py), with the counts that 'samtools mpileup -B -A -Q MIN_BASE_QUALITY -f REF' would give, without making the pileup text.
+
+With --processes N, the input, which must then be an indexed BAM file or a pileup compressed with bgzip and indexed with 'tabix -s 1 -b 2 -e 2', is cut into regions of --chunk_size bases, and N worker processes count the lines of the regions.  Their counts are added up before the report, which is the same as without --processes.  The regions of a pileup are its contigs, cut by the contig lengths of -f REF if it is given.  --targets BED counts only the positions in the regions of a BED file, in the same way.
+
 Sites with less than MINDEPTH, or clonalities outside of the range MIN_CLONALITY-MAX_CLONALITY, are excluded from analysis.
 
 If -u is specified, this program counts each mutation exactly once (i.e. clonal expansions are counted as a single mutation)
@@ -17,6 +21,8 @@ If -u is specified, this program counts each mutation exactly once (i.e. clonal
 Usage:
 
 cat seq.pileup | CountMuts.py [-h] [-d MINDEPTH] [-C MAX_CLONALITY] [-c MIN_CLONALITY] [-n N_CUTOFF] [-s START] [-e END] [-u] > outfile.countmuts
+CountMuts.py -i seq.dcs.bam -f ref.fa [-Q MIN_BASE_QUALITY] [options] -o outfile.countmuts
+CountMuts.py -i seq.dcs.bam -f ref.fa --processes N [--chunk_size CHUNK_SIZE] [--targets BED] [options] -o outfile.countmuts
 
 optional arguments:
   -h, --help            show this help message and exit
@@ -39,14 +45,39 @@ optional arguments:
                         set to 0, no position filtering will be performed
                         (default = 0)
   -u, --unique          run countMutsUnique instead of countMuts
+  -f REF, --ref REF     The reference genome of a BAM --infile (default = None)
+  -Q MIN_BASE_QUALITY, --min_base_quality MIN_BASE_QUALITY
+                        Minimum base quality of a BAM --infile, as for
+                        samtools mpileup -Q (default = 13)
+  --processes PROCESSES
+                        Number of worker processes.  With more than one,
+                        regions of the input, which must be an indexed BAM
+                        file or a pileup compressed with bgzip and indexed
+                        with tabix, are counted in parallel (default = 1)
+  --chunk_size CHUNK_SIZE
+                        Length of the regions given to each worker with
+                        --processes (default = 10000000)
+  --targets TARGETS     A BED file of the regions to count; only the
+                        positions in them are scored.  Needs an indexed
+                        input, as for --processes (default = None)
 
 """
 
 from __future__ import print_function
 from argparse import ArgumentParser
+import os
 import sys
 import re
 from math import sqrt
+from multiprocessing import Pool
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.bampileup import MIN_BASE_QUALITY, bam_blocks
+from dsutils.pileup import BASES, line_blocks, pileup_blocks
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+from dsutils.regions import genome_chunks, read_bed, split_regions
 
 def Wilson(positive,  total) :
     
@@ -63,36 +94,13 @@ def Wilson(positive,  total) :
         return  (phat, positiveCI , negativeCI )
 
 
-def CountMutations(o, f, fOut):
-    depths = []
-
-    Aseq = 0
-    AtoT = 0
-    AtoC = 0
-    AtoG = 0
-
-    Tseq = 0
-    TtoA = 0
-    TtoC = 0
-    TtoG = 0
-
-    Cseq = 0
-    CtoA = 0
-    CtoT = 0
-    CtoG = 0
-
-    Gseq = 0
-    GtoA = 0
-    GtoT = 0
-    GtoC = 0
+# The point mutations counted for each reference base, in report order
+MUTATIONS = (('A', 'TCG'), ('T', 'ACG'), ('C', 'ATG'), ('G', 'ATC'))
 
-    ins = {0:0}
 
-    dels = {0:0}
-
-    #mpFile = open("testMPfile.mutpos", "w") #ADDED
-    #mpFirst = True #ADDED
-    for line in f:
+def CountLine(o, line, seq, muts, ins, dels):
+    # Count one line of the pileup.  This is the original line by line
+    # count, kept for the lines that dsutils.pileup marks as irregular.
           linebins = line.split()
 
     #convert sequence information to uppercase
@@ -106,7 +114,7 @@ def CountMutations(o, f, fOut):
           depth = int(linebins[3]) - linebins[4].count('N')
           
       #count and remove insertions
-          newIns = map(int, re.findall(r'\+\d+', linebins[4]))  
+          newIns = list(map(int, re.findall(r'\+\d+', linebins[4])))  
           if o.unique:
               newIns = list(set(newIns))
           for length in newIns:
@@ -118,7 +126,7 @@ def CountMutations(o, f, fOut):
               linebins[4] = re.sub(rmStr, '', linebins[4])
   
 #count and remove deletions
-          newDels = map(str, re.findall(r'-\d+', linebins[4]))
+          newDels = list(map(str, re.findall(r'-\d+', linebins[4])))
           if o.unique:
               newDels = list(set(newDels))
           for length in newDels:
@@ -144,51 +152,209 @@ def CountMutations(o, f, fOut):
           elif (float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'), (max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0))) / float(depth)) < o.min_clonality:
                 pass
           else:
-              #remove N entries
-                #linebins[4] = linebins[4].replace('N','')
               #remove start line and end line markers
                 linebins[4] = re.sub('\$','',linebins[4])
                 linebins[4] = re.sub('\^.','',linebins[4])
          
     #count point mutations
-           
-                if linebins[2] == 'A':
-                      Aseq += depth
-                      if linebins[4].count('T') > 0: AtoT += (1 if o.unique else linebins[4].count('T'))
-                      if linebins[4].count('C') > 0: AtoC += (1 if o.unique else linebins[4].count('C'))
-                      if linebins[4].count('G') > 0: AtoG += (1 if o.unique else linebins[4].count('G'))
-
-                elif linebins[2] == 'T':
-                      Tseq += depth
-                      if linebins[4].count('A') > 0: TtoA += (1 if o.unique else linebins[4].count('A'))
-                      if linebins[4].count('C') > 0: TtoC += (1 if o.unique else linebins[4].count('C'))
-                      if linebins[4].count('G') > 0: TtoG += (1 if o.unique else linebins[4].count('G'))
-                
-                elif linebins[2] == 'C':
-                      Cseq += depth
-                      if linebins[4].count('A') > 0: CtoA += (1 if o.unique else linebins[4].count('A'))
-                      if linebins[4].count('T') > 0: CtoT += (1 if o.unique else linebins[4].count('T'))
-                      if linebins[4].count('G') > 0: CtoG += (1 if o.unique else linebins[4].count('G'))
-                
-                elif linebins[2] == 'G':
-                      Gseq += depth
-                      if linebins[4].count('A') > 0: GtoA += (1 if o.unique else linebins[4].count('A'))
-                      if linebins[4].count('T') > 0: GtoT += (1 if o.unique else linebins[4].count('T'))
-                      if linebins[4].count('C') > 0: GtoC += (1 if o.unique else linebins[4].count('C'))
-                #if mpFirst: #ADDED
-                    #mpFirst = False #ADDED
-                #else: #ADDED
-                    #mpFile.write("\n") #ADDED
-                #mpFile.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s" % (linebins[0],linebins[2], linebins[1], depth, linebins[4].count('T') + linebins[4].count('C') + linebins[4].count('G') + linebins[4].count('A'), linebins[4].count('T'), linebins[4].count('C'), linebins[4].count('G'), linebins[4].count('A'), len(newIns), len(newDels), linebins[4].count('N'))) #ADDED
-
-    totalseq = Aseq + Tseq + Cseq + Gseq
-
-    totalptmut = AtoT + AtoC + AtoG + TtoA + TtoC + TtoG + CtoA + CtoT + CtoG + GtoA + GtoT + GtoC
+                if linebins[2] in seq:
+                      seq[linebins[2]] += depth
+                      for alt in muts[linebins[2]]:
+                          if linebins[4].count(alt) > 0: muts[linebins[2]][alt] += (1 if o.unique else linebins[4].count(alt))
+
+
+def CountBlock(o, block, seq, muts, ins, dels):
+    # Count a block of lines parsed by dsutils.pileup, as CountLine would.
+    # CountLine removed the indels, then filtered on the counts of the
+    # rest, mapping qualities included; the mutations were counted
+    # without the mapping qualities.
+    ns = block.bases[:, 4] + block.quals[:, 4] + block.indels[:, 4]
+    depth = block.depth - ns
+    filtered = block.bases + block.quals
+    irregular = block.irregular.copy()
+    if o.end != 0:
+        in_range = (block.pos >= o.start) & (block.pos <= o.end)
+    else:
+        in_range = numpy.ones(block.n, bool)
+
+    # The N fraction and clonality of CountLine divide by zero for some
+    # lines: it can raise the error for them.
+    total = depth + filtered[:, 4]
+    n_ok = filtered[:, 4] / numpy.where(total == 0, 1, total) <= o.n_cutoff
+    deep = depth >= o.mindepth
+    irregular |= in_range & (total == 0)
+    irregular |= in_range & n_ok & deep & (depth == 0)
+
+    # Indels are counted before the filters
+    most = filtered[:, :4].max(axis=1)
+    for lengths, counts in ((block.ins, ins), (block.dels, dels)):
+        lines = []
+        repeats = []
+        for i, line_lengths in lengths.items():
+            if irregular[i]:
+                continue
+            if o.unique:
+                line_lengths = set(line_lengths)
+            for length in line_lengths:
+                counts[length] = counts.get(length, 0) + 1
+            lines.append(i)
+            repeats.append(1 if len(line_lengths) == 1 else
+                           max(map(list(line_lengths).count, line_lengths)))
+        numpy.maximum.at(most, lines, repeats)
+
+    clonality = most / numpy.where(depth == 0, 1, depth)
+    counted = (~irregular & in_range & n_ok & deep
+               & ~(clonality > o.max_clonality)
+               & ~(clonality < o.min_clonality))
+    found = block.bases - block.dropped
+    for ref, alts in MUTATIONS:
+        at = counted & (block.ref == ord(ref))
+        seq[ref] += int(depth[at].sum())
+        for alt in alts:
+            alt_counts = found[at, BASES.index(alt)]
+            if o.unique:
+                muts[ref][alt] += int(numpy.count_nonzero(alt_counts))
+            else:
+                muts[ref][alt] += int(alt_counts.sum())
+
+    for i in numpy.flatnonzero(irregular).tolist():
+        CountLine(o, block.line(i), seq, muts, ins, dels)
+
+
+class MutationCounts:
+    # The counts of CountMutations, added up a block of the pileup at a time
+    def __init__(self, o):
+        self.o = o
+        # Sites sequenced and point mutations, by reference base
+        self.seq = dict.fromkeys('ACGT', 0)
+        self.muts = dict((ref, dict.fromkeys(alts, 0)) for ref, alts in MUTATIONS)
+        self.ins = {0:0}
+        self.dels = {0:0}
+
+    def add(self, block):
+        # Count a block from dsutils.pileup.pileup_blocks or
+        # dsutils.bampileup.bam_blocks
+        if block.lines is not None:
+            for line in block.lines:
+                CountLine(self.o, line, self.seq, self.muts, self.ins, self.dels)
+        else:
+            CountBlock(self.o, block, self.seq, self.muts, self.ins, self.dels)
+
+    def merge(self, other):
+        # Add the counts of another MutationCounts, e.g. of another region
+        for ref in self.seq:
+            self.seq[ref] += other.seq[ref]
+            for alt in self.muts[ref]:
+                self.muts[ref][alt] += other.muts[ref][alt]
+        for lengths, other_lengths in ((self.ins, other.ins), (self.dels, other.dels)):
+            for length, count in other_lengths.items():
+                lengths[length] = lengths.get(length, 0) + count
+        return self
+
+    def report(self, fOut):
+        Report(self.o, self.seq, self.muts, self.ins, self.dels, fOut)
+
+
+def CountMutations(o, f, fOut):
+    counts = MutationCounts(o)
+    for block in pileup_blocks(f):
+        counts.add(block)
+    counts.report(fOut)
+
+
+def CountBamMutations(o, bam_file, fasta_file, fOut):
+    # Count the pileup of a BAM file from its reads, as CountMutations
+    # would count its samtools mpileup
+    counts = MutationCounts(o)
+    for block in bam_blocks(bam_file, fasta_file,
+                            min_base_quality=o.min_base_quality):
+        counts.add(block)
+    counts.report(fOut)
+
+
+def count_region(job):
+    # Worker for --processes: the MutationCounts of the pileup lines of one
+    # region, from a BAM file or a tabix-indexed pileup
+    o, region = job
+    import pysam
+    counts = MutationCounts(o)
+    if o.inFile.endswith('.bam'):
+        with pysam.AlignmentFile(o.inFile, 'rb') as bam_file, pysam.FastaFile(o.ref) as fasta_file:
+            for block in bam_blocks(bam_file, fasta_file, region, min_base_quality=o.min_base_quality):
+                counts.add(block)
+    else:
+        with pysam.TabixFile(o.inFile) as pileup_file:
+            if region[0] in pileup_file.contigs:
+                for block in line_blocks(pileup_file.fetch(*region)):
+                    counts.add(block)
+    return counts
+
+
+def open_ended(regions, lengths):
+    # The pileup has lines past the end of a contig where reads run over
+    # it: the last region of each contig goes on to the end of its lines.
+    return [(contig, start, None if end == lengths[contig] else end) for contig, start, end in regions]
+
+
+def count_regions(o):
+    # The regions for --processes and --targets: the targets, or the
+    # contigs of the input, cut into pieces of o.chunk_size bases
+    import pysam
+    if o.inFile.endswith('.bam'):
+        with pysam.AlignmentFile(o.inFile, 'rb') as bam_file:
+            if not bam_file.has_index():
+                raise ValueError("--processes needs an index for %s (samtools index)" % o.inFile)
+            if o.targets == None:
+                return open_ended([region for region in genome_chunks(bam_file, o.chunk_size)
+                                   if region is not None], dict(zip(bam_file.references, bam_file.lengths)))
+            contigs = bam_file.references
+    else:
+        try:
+            with pysam.TabixFile(o.inFile) as pileup_file:
+                contigs = pileup_file.contigs
+        except (IOError, OSError):
+            raise ValueError("--processes needs a BAM file, or a pileup compressed with bgzip and indexed with "
+                             "'tabix -s 1 -b 2 -e 2': %s" % o.inFile)
+        if o.targets == None:
+            if o.ref == None:
+                return [(contig, None, None) for contig in contigs]
+            with pysam.FastaFile(o.ref) as fasta_file:
+                lengths = dict((contig, fasta_file.get_reference_length(contig)) for contig in contigs)
+            return open_ended(split_regions([(contig, 0, lengths[contig]) for contig in contigs], o.chunk_size),
+                              lengths)
+    regions = read_bed(o.targets)
+    if o.inFile.endswith('.bam'):
+        for contig, start, end in regions:
+            if contig not in contigs:
+                raise ValueError("%s, in %s, is not a contig of %s" % (contig, o.targets, o.inFile))
+    return list(split_regions(regions, o.chunk_size))
+
+
+def ParallelCountMutations(o, fOut):
+    # Count the regions of the input in o.processes worker processes, and
+    # report the sum of their counts
+    regions = count_regions(o)
+    counts = MutationCounts(o)
+    if o.processes > 1:
+        pool = Pool(o.processes)
+        for region_counts in pool.imap_unordered(count_region, [(o, region) for region in regions]):
+            counts.merge(region_counts)
+        pool.close()
+        pool.join()
+    else:
+        for region in regions:
+            counts.merge(count_region((o, region)))
+    counts.report(fOut)
+
+
+def Report(o, seq, muts, ins, dels, fOut):
+    totalseq = sum(seq.values())
+
+    totalptmut = sum(sum(alts.values()) for alts in muts.values())
     totalindel = sum(ins) + sum(dels)
 
     totalins = sum(ins[n] for n in ins.keys())
     totaldels = sum(dels[n] for n in dels.keys())
-    #mpFile.close() #ADDED
 
     print("\nMinimum depth: %s" % o.mindepth, file = fOut)
     print("Clonality: %s - %s" % (o.min_clonality, o.max_clonality), file = fOut)
@@ -196,26 +362,12 @@ def CountMutations(o, f, fOut):
         print('Position: %s - %s' % (o.start, o.end), file = fOut)
     if o.unique:
         print('Unique Counts', file = fOut)
-    print("\nA's sequenced: %s" % Aseq, file = fOut)
-    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
-    print(("A to T:\t%s" % AtoT) + ('\t%.2e\t%.2e\t%.2e' % Wilson(AtoT,  max(Aseq, 1))), file = fOut) #Output is in the form: Mutation type, number of times mutation is oberseved, frequency, 95% positive CI, 95% negative CI (Confidence Intervals are based on the Wilson Confidence Interval)
-    print(("A to C:\t%s" % AtoC) + ('\t%.2e\t%.2e\t%.2e' % Wilson(AtoC,  max(Aseq, 1))), file = fOut)
-    print(("A to G:\t%s" % AtoG) + ('\t%.2e\t%.2e\t%.2e' % Wilson(AtoG,  max(Aseq, 1))), file = fOut)
-    print("\nT's sequenced: %s" % Tseq, file = fOut)
-    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
-    print(("T to A:\t%s" % TtoA) + ('\t%.2e\t%.2e\t%.2e' % Wilson(TtoA,   max(Tseq, 1))), file = fOut)
-    print(("T to C:\t%s" % TtoC) + ('\t%.2e\t%.2e\t%.2e' % Wilson(TtoC,  max(Tseq, 1))), file = fOut)
-    print(("T to G:\t%s" % TtoG) + ('\t%.2e\t%.2e\t%.2e' % Wilson(TtoG,   max(Tseq, 1))), file = fOut)
-    print("\nC's sequenced: %s" % Cseq, file = fOut)
-    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
-    print(("C to A:\t%s" % CtoA) + ('\t%.2e\t%.2e\t%.2e' % Wilson(CtoA,  max(Cseq, 1))), file = fOut)
-    print(("C to T:\t%s" % CtoT) + ('\t%.2e\t%.2e\t%.2e' % Wilson(CtoT,   max(Cseq, 1))), file = fOut)
-    print(("C to G:\t%s" % CtoG) + ('\t%.2e\t%.2e\t%.2e' % Wilson(CtoG,   max(Cseq, 1))), file = fOut)
-    print("\nG's sequenced: %s" % Gseq, file = fOut)
-    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
-    print(("G to A:\t%s" % GtoA) + ('\t%.2e\t%.2e\t%.2e' % Wilson(GtoA,   max(Gseq, 1))), file = fOut)
-    print(("G to T:\t%s" % GtoT) + ('\t%.2e\t%.2e\t%.2e' % Wilson(GtoT,   max(Gseq, 1))), file = fOut)
-    print(("G to C:\t%s" % GtoC) + ('\t%.2e\t%.2e\t%.2e' % Wilson(GtoC,   max(Gseq, 1))), file = fOut)
+    #Output is in the form: Mutation type, number of times mutation is oberseved, frequency, 95% positive CI, 95% negative CI (Confidence Intervals are based on the Wilson Confidence Interval)
+    for ref, alts in MUTATIONS:
+        print("\n%s's sequenced: %s" % (ref, seq[ref]), file = fOut)
+        print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+        for alt in alts:
+            print(("%s to %s:\t%s" % (ref, alt, muts[ref][alt])) + ('\t%.2e\t%.2e\t%.2e' % Wilson(muts[ref][alt], max(seq[ref], 1))), file = fOut)
     print("\nTotal nucleotides sequenced: %s" % totalseq, file = fOut)
     print("Total point mutations: %s" % totalptmut, file = fOut)
     print("\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
@@ -239,7 +391,7 @@ def CountMutations(o, f, fOut):
 
 def main():
     parser = ArgumentParser()
-    parser.add_argument('-i', '--infile', action ='store', dest = 'inFile', help = 'An imput file. If None, defaults to stdin. [None]', default = None)
+    parser.add_argument('-i', '--infile', action ='store', dest = 'inFile', help = 'An imput file: a pileup, or a position-sorted BAM file with --ref. If None, a pileup from stdin. [None]', default = None)
     parser.add_argument('-o', '--outfile', action = 'store', dest = 'outFile', help = 'A filename for the output file.  If None, outputs to stdout.  [None]', default = None)
     parser.add_argument("-d", "--depth", action="store", type=int, dest="mindepth", 
                       help="Minimum depth for counting mutations at a site [%(default)s]", default=20)
@@ -254,17 +406,54 @@ def main():
     parser.add_argument("-e", "--end", action="store", type=int, dest="end",
                       help="Position at which to stop scoring for mutations. If set to 0, no position filtering will be performed [%(default)s]", default=0)
     parser.add_argument('-u', '--unique', action='store_true', dest='unique', help='Run countMutsUnique instead of countMuts')
+    parser.add_argument('-f', '--ref', action='store', dest='ref',
+                      help='The reference genome of a BAM --infile.  With a tabix-indexed pileup, its contig lengths '
+                           'are used to cut the contigs into regions for --processes [%(default)s]', default=None)
+    parser.add_argument('-Q', '--min_base_quality', action='store', type=int, dest='min_base_quality',
+                      help='Minimum base quality of a BAM --infile, as for samtools mpileup -Q [%(default)s]',
+                      default=MIN_BASE_QUALITY)
+    parser.add_argument('--processes', action='store', type=int, dest='processes',
+                      help='Number of worker processes.  With more than one, regions of the input, which must be an '
+                           'indexed BAM file or a pileup compressed with bgzip and indexed with tabix, are counted in '
+                           'parallel [%(default)s]', default=1)
+    parser.add_argument('--chunk_size', action='store', type=int, dest='chunk_size',
+                      help='Length of the regions given to each worker with --processes [%(default)s]',
+                      default=10000000)
+    parser.add_argument('--targets', action='store', dest='targets',
+                      help='A BED file of the regions to count; only the positions in them are scored.  Needs an '
+                           'indexed input, as for --processes [%(default)s]', default=None)
+    add_profile_arguments(parser, ['count'])
 
     o = parser.parse_args()
-    if o.inFile != None:
-        f = open(o.inFile, 'r')
-    else:
-        f = sys.stdin
+    bam = o.inFile != None and o.inFile.endswith('.bam')
+    if bam and o.ref == None:
+        parser.error('a BAM --infile needs --ref')
+    regional = o.processes > 1 or o.targets != None
+    if regional and o.inFile == None:
+        parser.error('--processes and --targets need an indexed --infile')
+    profiler = profiler_from_args(o, o.outFile if o.outFile != None else 'CountMuts')
+    profiler.start()
+    if bam and not regional:
+        import pysam
+        bam_file = pysam.AlignmentFile(o.inFile, 'rb')
+        fasta_file = pysam.FastaFile(o.ref)
+    elif o.inFile != None and not regional:
+        f = open(o.inFile, 'rb')
+    elif o.inFile == None:
+        f = sys.stdin.buffer
     if o.outFile != None:
         fOut = open(o.outFile, 'w')
     else:
         fOut = sys.stdout
-    CountMutations(o, f, fOut)
+    profiler.begin('count')
+    if regional:
+        ParallelCountMutations(o, fOut)
+    elif bam:
+        CountBamMutations(o, bam_file, fasta_file, fOut)
+    else:
+        CountMutations(o, f, fOut)
+    profiler.end('count')
+    profiler.stop()
 
 
 if __name__ == "__main__":
@@ -7,8 +7,8 @@ By Brendan Kohrn, Scott Kennedy(1), and Mike Schmitt(1)
 Based on work by Scott Kennedy, Mike Schmitt
 December 17, 2013
 
-Written for Python 2.7.3
-Required modules: Pysam, Samtools, BioPython
+Written for Python 2.7.3, updated for Python 3
+Required modules: Pysam, Samtools, NumPy
 
 Inputs:
     A position-sorted paired-end BAM file containing SSCSs
@@ -26,7 +26,8 @@ the run, any unpaired DCSs are written to a file ending in _UP.bam.
 usage: DuplexMaker.py [-h] [--infile INFILE] [--outfile OUTFILE]
                       [--Ncutoff NCUTOFF] [--readlength READ_LENGTH]
                       [--barcode_length BLENGTH] [--read_out ROUT]
-                      [--gzip-fqs]
+                      [--gzip-fqs] [--mate_buffer MATE_BUFFER]
+                      [--processes PROCESSES] [--chunk_size CHUNK_SIZE]
 
 optional arguments:
   -h, --help            show this help message and exit
@@ -40,17 +41,37 @@ optional arguments:
   --read_out ROUT       How often you want to be told what the program is
                         doing. [1000000]
   --gzip-fqs            Output gzipped fastqs [False]
+  --mate_buffer MATE_BUFFER
+                        Number of unpaired DCSs kept in memory while waiting for their mates; past that, some are
+                        kept in a temporary file next to the output. [1000000]
+  --processes PROCESSES
+                        Number of worker processes.  With more than one, regions of the input, which must be
+                        indexed, are processed in parallel. [1]
+  --chunk_size CHUNK_SIZE
+                        Length of the regions given to each worker with --processes. [10000000]
+
+With --processes N, the contigs are cut into regions of --chunk_size bases, and N worker processes make the DCSs for
+the SSCSs starting in each region.  The main process pairs the DCSs and writes them region by region, and makes the
+DCSs for the first and last positions of each region itself, so that the outputs and summary statistics are the same
+as without --processes.
 '''
 
+import os
 import sys
+import shutil
 import pysam
 import re
-import gzip
-from Bio.Seq import Seq
-from Bio.Alphabet import IUPAC
 from collections import defaultdict
+from itertools import chain
+from multiprocessing import Pool
 from argparse import ArgumentParser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.duplex import DuplexWriter, dcs_batch
+from dsutils.matebuffer import pack, unpack
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+from dsutils.regions import fetch_region, genome_chunks, region_reads
+
 
 def print_read(read_in):
 	sys.stderr.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (read_in.qname, read_in.flag, read_in.tid,
@@ -59,24 +80,148 @@ def print_read(read_in):
 																		read_in.seq, read_in.qual, read_in.tags))
 	return
 
-def dcs_maker(grouped_reads_list,  read_length):
-	# The Duplex maker substitutes an N if the two input sequences are not identical at a position.
-	consensus_read = ''
-	for i in xrange(read_length):  # rebuild consensus read taking into account the cutoff percentage
-		if grouped_reads_list[0][i] == grouped_reads_list[1][i]:
-			consensus_read += grouped_reads_list[0][i]
-		else:
-			consensus_read += "N"
-	return consensus_read
+def new_stats():
+	# Counters for the summary statistics.
+	return {'reads': 0, 'duplexes': 0, 'nC': 0}
 
 
-def fastq_open(outfile, gzip_fastq, end):
-	fn = outfile.replace('.bam', '') + "." + end + ".fq"
-	if gzip_fastq:
-		fn += ".gz"
-		return gzip.open(fn, 'wb')
-	else:
-		return open(fn, 'w')
+def position_groups(bam_entry):
+	# Yield lists of consecutive reads at the same position.  Only positions are compared, not contigs, as the loop 
+	# in main() always has.
+	group = []
+	for line in bam_entry:
+		if group and line.pos != group[0].pos:
+			yield group
+			group = []
+		group.append(line)
+	if group:
+		yield group
+
+
+def make_duplexes(reads, o, qual_score, cig_dum, stats):
+	# Make the DCSs for the reads at one position.  Returns a list of (tag, DCS).
+	read_dict = {}
+	for line in reads:
+		if line.is_unmapped is False:
+			tag = line.qname.split(":")[0]  # Extract the barcode
+			read_dict[tag] = [line.flag, line.rname, line.pos, line.mrnm, line.mpos, line.isize, line.seq]
+
+	# Pair each tag with the tag of the other strand, then make all the DCSs at this position at once.
+	pairs = []
+	for dict_tag in list(read_dict.keys()):
+		switch_tag = dict_tag[o.blength:] + dict_tag[:o.blength]
+		if (dict_tag in read_dict and switch_tag in read_dict and
+				len(read_dict[dict_tag][6]) >= o.read_length and len(read_dict[switch_tag][6]) >= o.read_length):
+			pairs.append((dict_tag, read_dict[dict_tag], read_dict[switch_tag][6]))
+			del read_dict[dict_tag]
+			read_dict.pop(switch_tag, None)
+	consensuses = dcs_batch([(tag_reads[6], switch_seq) for dict_tag, tag_reads, switch_seq in pairs],
+							o.read_length, [tag_reads[0] & 16 for dict_tag, tag_reads, switch_seq in pairs])
+
+	duplexes = []
+	for (dict_tag, tag_reads, switch_seq), consensus in zip(pairs, consensuses):
+		stats['duplexes'] += 1
+		# Filter out consensuses with too many Ns in them
+		if consensus.count("N")/float(len(consensus)) > o.Ncutoff:
+			stats['nC'] += 1
+		else:
+			# Reverse strand DCSs are already reverse complemented
+			a = pysam.AlignedRead()
+			a.qname = dict_tag
+			a.flag = tag_reads[0]
+			a.seq = consensus
+			a.rname = tag_reads[1]
+			a.pos = tag_reads[2]
+			a.mapq = 255
+			a.cigar = cig_dum
+			a.mrnm = tag_reads[3]
+			a.mpos = tag_reads[4]
+			a.isize = tag_reads[5]
+			a.qual = qual_score
+			duplexes.append((dict_tag, a))
+	return duplexes
+
+
+def write_duplexes(reads, o, qual_score, cig_dum, duplex_writer, stats):
+	# Make the DCSs for the reads at one position and write them to the output files in read pairs.
+	for dict_tag, a in make_duplexes(reads, o, qual_score, cig_dum, stats):
+		duplex_writer.write(dict_tag, a)
+
+
+def edge_group(reads):
+	# The reads at the first or last position of a region, sent back to the main process: their position, how 
+	# many there are, and the mapped ones.
+	return reads[0].pos, len(reads), [pack(line) for line in reads if line.is_unmapped is False]
+
+
+def duplex_chunk(job):
+	# Worker for --processes: make the DCSs for the reads starting in one region.  The reads at the first and the 
+	# last position of the region are sent back instead, as those positions may go on in the next or the previous 
+	# region (positions on different contigs are compared as they are); the DCSs of the positions in between are 
+	# written, unpaired, to prefix.bam in the order they are made.
+	o, region, prefix, qual_score, cig_dum = job
+	stats = new_stats()
+	in_bam = pysam.Samfile(o.infile, "rb")
+	dcs_file = pysam.Samfile(prefix + ".bam", "wb0", template=in_bam)
+
+	first = None
+	last = None
+	for reads in position_groups(region_reads(fetch_region(in_bam, region), region)):
+		stats['reads'] += len(reads)
+		if first is None:
+			first = reads
+			continue
+		if last is not None:
+			for dict_tag, a in make_duplexes(last, o, qual_score, cig_dum, stats):
+				dcs_file.write(a)
+		last = reads
+
+	in_bam.close()
+	dcs_file.close()
+	return {'prefix': prefix, 'stats': stats, 'first': None if first is None else edge_group(first),
+			'last': None if last is None else edge_group(last)}
+
+
+def parallel_duplex(o, in_bam, duplex_writer, qual_score, cig_dum, stats):
+	# Make the DCSs for the regions of the input in o.processes worker processes, and pair them in the main process 
+	# in file order.  Returns the reads at the last position of the file, which have not been used yet, as an 
+	# edge_group.
+	if not in_bam.has_index():
+		raise ValueError("--processes needs an index for %s (samtools index)" % o.infile)
+	chunk_dir = o.outfile.replace(".bam", ".chunks")
+	if not os.path.isdir(chunk_dir):
+		os.makedirs(chunk_dir)
+	jobs = [(o, region, os.path.join(chunk_dir, str(i)), qual_score, cig_dum)
+			for i, region in enumerate(genome_chunks(in_bam, o.chunk_size))]
+
+	pending = None  # Reads at the last position seen so far
+	pool = Pool(o.processes)
+	for result in pool.imap(duplex_chunk, jobs):
+		for key in stats:
+			stats[key] += result['stats'][key]
+		if result['first'] is not None:
+			pos, count, reads = result['first']
+			if pending is not None and pending[0] == pos:
+				# The position goes on from the previous region
+				pending = (pos, pending[1] + count, pending[2] + reads)
+			else:
+				if pending is not None:
+					write_duplexes([unpack(read) for read in pending[2]], o, qual_score, cig_dum, duplex_writer,
+									stats)
+				pending = result['first']
+		if result['last'] is not None:
+			write_duplexes([unpack(read) for read in pending[2]], o, qual_score, cig_dum, duplex_writer, stats)
+			dcs_file = pysam.Samfile(result['prefix'] + ".bam", "rb", check_sq=False)
+			for a in dcs_file.fetch(until_eof=True):
+				duplex_writer.write(a.qname, a)
+			dcs_file.close()
+			pending = result['last']
+		if stats['reads'] // o.rOut != (stats['reads'] - result['stats']['reads']) // o.rOut:
+			sys.stderr.write("%s reads processed\n" % stats['reads'])
+	pool.close()
+	pool.join()
+	shutil.rmtree(chunk_dir)
+	return pending
 
 
 def main():
@@ -94,163 +239,73 @@ def main():
 						help='How often you want to be told what the program is doing. [1000000]')
 	parser.add_argument('--gzip-fqs', action="store_true", default=False, dest='gzip_fastqs',
 						help='Output gzipped fastqs [False]')
+	parser.add_argument('--mate_buffer', type=int, default=1000000, dest='mate_buffer',
+						help="Number of unpaired DCSs kept in memory while waiting for their mates; past that, some "
+							"are kept in a temporary file next to the output. [1000000]")
+	parser.add_argument('--processes', type=int, default=1, dest='processes',
+						help="Number of worker processes.  With more than one, regions of the input, which must be "
+							"indexed, are processed in parallel. [1]")
+	parser.add_argument('--chunk_size', type=int, default=10000000, dest='chunk_size',
+						help="Length of the regions given to each worker with --processes. [10000000]")
+	add_profile_arguments(parser, ['duplex', 'unpaired'])
 	o = parser.parse_args()
+	profiler = profiler_from_args(o, o.outfile.replace(".bam", ""))
+	profiler.start()
 
 	# Initialization of all global variables, main input/output files, and main iterator and dictionaries.
 	in_bam = pysam.Samfile(o.infile, "rb")  # Open the input BAM file
-	out_bam = pysam.Samfile(o.outfile, "wb", template=in_bam)  # Open the output BAM file
-	fastq_file1 = fastq_open(o.outfile, o.gzip_fastqs, 'r1')
-	fastq_file2 = fastq_open(o.outfile, o.gzip_fastqs, 'r2')
-
-	read_num = 0
-	duplexes_made = 0
-	uP = 0
-	nC = 0
+	# Output BAM file and fastq files; DCSs waiting for their mates, past --mate_buffer of them, are kept in a 
+	# temporary file
+	duplex_writer = DuplexWriter(o.outfile, in_bam, o.gzip_fastqs, o.mate_buffer,
+								os.path.dirname(os.path.abspath(o.outfile)))
 
-	file_done = False  # Initialize end of file bool
-	finished = False
-	read_one = True
+	stats = new_stats()
 
 	bam_entry = in_bam.fetch(until_eof=True)  # Initialize the iterator
-	first_read = bam_entry.next()  # Get the first read
-	read_dict = {}  # Initialize the read dictionary
-	first_tag = first_read.qname.split(":")[0]
+	first_read = next(bam_entry)  # Get the first read
 	qual_score = first_read.qual  # Set a dummy quality score
-	consensus_dict = {}
 	cig_dum = first_read.cigar  # set a dummy cigar score
 
-	# Start going through the input BAM file, one position at a time.
-	for line in bam_entry:
-		# Reinitialize first line
-		read_num += 1
-		if read_one is True and first_read.is_unmapped is False:
+	# Start going through the input BAM file, one position at a time.  The reads at each position are only used 
+	# once the next position is found, so the reads at the last position are left over; they are not used if there 
+	# is only one of them, as has always been the case.
+	profiler.begin('duplex')
+	if o.processes > 1:
+		pos, count, reads = parallel_duplex(o, in_bam, duplex_writer, qual_score, cig_dum, stats)
+		last = [unpack(read) for read in reads]
+	else:
+		last = None
+		for reads in position_groups(chain([first_read], bam_entry)):
+			if last is not None:
+				write_duplexes(last, o, qual_score, cig_dum, duplex_writer, stats)
+			last = reads
+			count = len(reads)
+			stats['reads'] += count
+			if stats['reads'] // o.rOut != (stats['reads'] - count) // o.rOut:
+				sys.stderr.write("%s reads processed\n" % stats['reads'])
+	if count > 1:
+		write_duplexes(last, o, qual_score, cig_dum, duplex_writer, stats)
+	else:
+		stats['reads'] -= 1
 
-			read_dict[first_tag] = [first_read.flag, first_read.rname, first_read.pos, first_read.mrnm,
-									first_read.mpos, first_read.isize, first_read.seq]
-			read_one = False
-
-		while line.pos == first_read.pos and file_done is False:
-			tag = line.qname.split(":")[0]  # Extract the barcode
-			# Add the sequence to the read dictionary
-
-			if line.is_unmapped is False:
-				read_dict[tag] = [line.flag, line.rname, line.pos, line.mrnm, line.mpos, line.isize, line.seq]
-			try:  # Keep StopIteration error from happening
-				line = bam_entry.next()  # Iterate the line
-				read_num += 1
-			except:
-				file_done = True  # Tell the program that it has reached the end of the file
-				read_num += 1
-
-			if read_num % o.rOut == 0:
-				sys.stderr.write("%s reads processed\n" % read_num)
-		else:
-			# Send reads to dcs_maker
-			first_read = line  # Store the present line for the next group of lines
-			first_tag = first_read.qname.split(":")[0]
-			read_one = True
-			dict_keys = read_dict.keys()
-
-			for dict_tag in read_dict.keys():  # Extract sequences to send to the dcs_maker
-				switch_tag = dict_tag[o.blength:] + dict_tag[:o.blength]
-
-				try:
-					consensus = dcs_maker([read_dict[dict_tag][6], read_dict[switch_tag][6]],  o.read_length)
-					duplexes_made += 1
-					# Filter out consensuses with too many Ns in them
-					if consensus.count("N")/len(consensus) > o.Ncutoff:
-						nC += 1
-					else:
-						# Write a line to the consensus_dictionary
-						a = pysam.AlignedRead()
-						a.qname = dict_tag
-						a.flag = read_dict[dict_tag][0]
-
-						if a.is_reverse is True:
-							tmp_seq = Seq(consensus, IUPAC.unambiguous_dna)
-							a.seq = str(tmp_seq.reverse_complement())
-						else:
-							a.seq = consensus
-
-						a.rname = read_dict[dict_tag][1]
-						a.pos = read_dict[dict_tag][2]
-						a.mapq = 255
-						a.cigar = cig_dum
-						a.mrnm = read_dict[dict_tag][3]
-						a.mpos = read_dict[dict_tag][4]
-						a.isize = read_dict[dict_tag][5]
-						a.qual = qual_score
-
-			# Write DCSs to output BAM file in read pairs.
-						if dict_tag in consensus_dict:
-							if a.is_read1 is True:
-								fastq_file1.write('@:%s\n%s\n+\n%s\n' % (a.qname, a.seq, a.qual))
-								out_bam.write(a)
-								fastq_file2.write('@:%s\n%s\n+\n%s\n' % (consensus_dict[dict_tag].qname,
-																		consensus_dict[dict_tag].seq,
-																		consensus_dict[dict_tag].qual))
-								out_bam.write(consensus_dict.pop(dict_tag))
-							else:
-								fastq_file1.write('@:%s\n%s\n+\n%s\n' % (consensus_dict[dict_tag].qname,
-																		consensus_dict[dict_tag].seq,
-																		consensus_dict[dict_tag].qual))
-								out_bam.write(consensus_dict.pop(dict_tag))
-								fastq_file2.write('@:%s\n%s\n+\n%s\n' % (a.qname, a.seq, a.qual))
-								out_bam.write(a)
-						else:
-							consensus_dict[dict_tag] = a
-
-					del read_dict[dict_tag]
-					del read_dict[switch_tag]
-
-				except:
-					pass
-
-		read_dict = {}  # Reset the read dictionary
+	profiler.end('duplex')
 
 	# Close BAM files
 	in_bam.close()
 
 	# Write unpaired DCSs
-	for consTag in consensus_dict.keys():
-		a = pysam.AlignedRead()
-		a.qname = consTag
-		a.flag = 5
-		a.seq = '.' * o.read_length
-		a.rname = consensus_dict[consTag].rname
-		a.pos = consensus_dict[consTag].pos
-		a.mapq = 255
-		a.cigar = cig_dum
-		a.mrnm = consensus_dict[consTag].mrnm
-		a.mpos = consensus_dict[consTag].pos
-		a.isize = consensus_dict[consTag].isize
-		a.qual = qual_score
-
-		if consensus_dict[consTag].is_read1 is False:
-			fastq_file1.write('@:%s\n%s\n+\n%s\n' % (a.qname, a.seq, a.qual))
-			out_bam.write(a)
-			fastq_file2.write('@:%s\n%s\n+\n%s\n' % (consensus_dict[consTag].qname, consensus_dict[consTag].seq,
-													consensus_dict[consTag].qual))
-			out_bam.write(consensus_dict.pop(consTag))
-		else:
-			fastq_file1.write('@:%s\n%s\n+\n%s\n' % (consensus_dict[consTag].qname, consensus_dict[consTag].seq,
-													consensus_dict[consTag].qual))
-			out_bam.write(consensus_dict.pop(consTag))
-			fastq_file2.write('@:%s\n%s\n+\n%s\n' % (a.qname, a.seq, a.qual))
-			out_bam.write(a)
-
-		uP += 1
-
-	fastq_file1.close()
-	fastq_file2.close()
-	out_bam.close()
+	profiler.begin('unpaired')
+	uP = duplex_writer.write_unpaired(o.read_length, qual_score, cig_dum)
+	profiler.end('unpaired')
+	duplex_writer.close()
 
 	# Write summary statistics.  Duplexes made includes unpaired duplexes
 	sys.stderr.write("Summary Statistics: \n")
-	sys.stderr.write("Reads Processed: %s\n" % read_num)
-	sys.stderr.write("Duplexes Made: %s\n" % duplexes_made)
+	sys.stderr.write("Reads Processed: %s\n" % stats['reads'])
+	sys.stderr.write("Duplexes Made: %s\n" % stats['duplexes'])
 	sys.stderr.write("Unpaired Duplexes: %s\n" % uP)
-	sys.stderr.write("N-clipped Duplexes: %s\n" % nC)
+	sys.stderr.write("N-clipped Duplexes: %s\n" % stats['nC'])
+	profiler.stop()
 
 if __name__ == "__main__":
 	main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+'''
+Pileup Stats
+Version 1.0
+
+Written for Python 3
+Required modules: NumPy; Matplotlib for --read_positions
+Required modules: pysam, for BAM input
+Required programs: samtools, for BAM input with --read_positions
+
+Inputs:
+    A pileup file made by samtools mpileup, or stdin
+    or
+    A position-sorted BAM file of aligned DCSs and its reference genome (--ref).  Its pileup is counted straight
+    from the reads by dsutils/bampileup.py, with the counts of 'samtools mpileup -B -A -Q MIN_BASE_QUALITY -f REF'
+    (with no maximum depth).  muts_by_read_position.py needs the text of the pileup, so with --read_positions the
+    BAM file is piped through 'samtools mpileup -B -A -Q MIN_BASE_QUALITY -d MAX_DEPTH -f REF' instead.
+
+Outputs: any of
+    1: --countmuts: mutation frequencies, as from CountMuts.py
+    2: --mutpos: position-specific mutation frequencies, as from mut-position.py
+    3: --read_positions: mutations, indels and Ns by read position, as from muts_by_read_position.py: a graph, and the
+       counts in READ_POSITIONS.dat
+
+This program reads the pileup once and hands each block of it (parsed by dsutils/pileup.py, or counted from a
+BAM file by dsutils/bampileup.py) to CountMuts.py, mut-position.py and muts_by_read_position.py, so that PostDCSProcessing.sh no longer saves the whole pileup to
+disk to read it a second time.  Each output has its own filters, with the defaults of its own program, and is
+the same as that program would write from the same pileup.
+
+usage: PileupStats.py [-h] [-i INFILE] [--ref REF]
+                      [--min_base_quality MIN_BASE_QUALITY]
+                      [--max_depth MAX_DEPTH]
+                      [--countmuts COUNTMUTS] [--cm_depth CM_DEPTH]
+                      [--cm_min_clonality CM_MIN_CLONALITY]
+                      [--cm_max_clonality CM_MAX_CLONALITY]
+                      [--cm_n_cutoff CM_N_CUTOFF] [--cm_start CM_START]
+                      [--cm_end CM_END] [--cm_unique] [--mutpos MUTPOS]
+                      [--mp_depth MP_DEPTH]
+                      [--mp_min_clonality MP_MIN_CLONALITY]
+                      [--mp_max_clonality MP_MAX_CLONALITY]
+                      [--mp_num_muts MP_NUM_MUTS]
+                      [--read_positions READ_POSITIONS]
+                      [--rp_rlength RP_RLENGTH]
+                      [--rp_max_clonality RP_MAX_CLONALITY]
+'''
+
+import csv
+import importlib.util
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser, Namespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.bampileup import MIN_BASE_QUALITY, bam_blocks
+from dsutils.pileup import pileup_blocks
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+
+
+def load_program(name):
+    # Import one of the programs next to this one; mut-position.py cannot be
+    # imported by name.
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), name + '.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bam_pileup(bam, ref, min_base_quality, max_depth):
+    # samtools mpileup of a BAM file, for --read_positions
+    return subprocess.Popen(['samtools', 'mpileup', '-B', '-A', '-Q', str(min_base_quality), '-d', str(max_depth),
+                             '-f', ref, bam], stdout=subprocess.PIPE)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-i', '--infile', action='store', dest='inFile',
+                        help='A pileup file, or a BAM file with --ref. If None, a pileup from stdin. [%(default)s]',
+                        default=None)
+    parser.add_argument('--ref', action='store', dest='ref',
+                        help='The reference genome of a BAM --infile. [%(default)s]', default=None)
+    parser.add_argument('--min_base_quality', action='store', type=int, dest='min_base_quality',
+                        help='The minimum base quality in the pileup of a BAM --infile (samtools mpileup -Q). '
+                             '[%(default)s]', default=MIN_BASE_QUALITY)
+    parser.add_argument('--max_depth', action='store', type=int, dest='max_depth',
+                        help='The maximum depth of the pileup of a BAM --infile, with --read_positions '
+                             '(samtools mpileup -d). [%(default)s]', default=500000)
+    parser.add_argument('--countmuts', action='store', dest='countmuts',
+                        help='Write the output of CountMuts.py to this file. [%(default)s]', default=None)
+    parser.add_argument('--cm_depth', action='store', type=int, dest='cm_depth',
+                        help='CountMuts: Minimum depth for counting mutations at a site [%(default)s]', default=20)
+    parser.add_argument('--cm_min_clonality', action='store', type=float, dest='cm_min_clonality',
+                        help='CountMuts: Cutoff of mutant reads for scoring a clonal mutation [%(default)s]',
+                        default=0)
+    parser.add_argument('--cm_max_clonality', action='store', type=float, dest='cm_max_clonality',
+                        help='CountMuts: Cutoff of mutant reads for scoring a clonal mutation [%(default)s]',
+                        default=0.3)
+    parser.add_argument('--cm_n_cutoff', action='store', type=float, dest='cm_n_cutoff',
+                        help="CountMuts: Maximum fraction of N's allowed to score a position [%(default)s]",
+                        default=0.05)
+    parser.add_argument('--cm_start', action='store', type=int, dest='cm_start',
+                        help='CountMuts: Position at which to start scoring for mutations [%(default)s]', default=0)
+    parser.add_argument('--cm_end', action='store', type=int, dest='cm_end',
+                        help='CountMuts: Position at which to stop scoring for mutations. If set to 0, no position '
+                             'filtering will be performed [%(default)s]', default=0)
+    parser.add_argument('--cm_unique', action='store_true', dest='cm_unique',
+                        help='CountMuts: Count each mutation once per site [%(default)s]')
+    parser.add_argument('--mutpos', action='store', dest='mutpos',
+                        help='Write the output of mut-position.py to this file. [%(default)s]', default=None)
+    parser.add_argument('--mp_depth', action='store', type=int, dest='mp_depth',
+                        help='mut-position: Minimum depth for counting mutations at a site [%(default)s]', default=20)
+    parser.add_argument('--mp_min_clonality', action='store', type=float, dest='mp_min_clonality',
+                        help='mut-position: Cutoff of mutant reads for scoring a clonal mutation [%(default)s]',
+                        default=0)
+    parser.add_argument('--mp_max_clonality', action='store', type=float, dest='mp_max_clonality',
+                        help='mut-position: Cutoff of mutant reads for scoring a clonal mutation [%(default)s]',
+                        default=1)
+    parser.add_argument('--mp_num_muts', action='store', type=int, dest='mp_num_muts',
+                        help='mut-position: Minimum number of mutations for scoring a site [%(default)s]', default=0)
+    parser.add_argument('--read_positions', action='store', dest='read_positions',
+                        help='Write the graph of muts_by_read_position.py to this file, and its counts to '
+                             'READ_POSITIONS.dat. [%(default)s]', default=None)
+    parser.add_argument('--rp_rlength', action='store', type=int, dest='rp_rlength',
+                        help='muts_by_read_position: The length of a single read [%(default)s]', default=84)
+    parser.add_argument('--rp_max_clonality', action='store', type=float, dest='rp_max_clonality',
+                        help='muts_by_read_position: Maximum clonality to allow when considering a position '
+                             '[%(default)s]', default=0.1)
+    add_profile_arguments(parser, ['count'])
+    o = parser.parse_args()
+    if o.countmuts is None and o.mutpos is None and o.read_positions is None:
+        parser.error('nothing to do: give at least one of --countmuts, --mutpos and --read_positions')
+    bam = o.inFile is not None and o.inFile.endswith('.bam')
+    if bam and o.ref is None:
+        parser.error('a BAM --infile needs --ref')
+    profiler = profiler_from_args(o, os.path.splitext(o.countmuts or o.mutpos or o.read_positions)[0])
+    profiler.start()
+
+    counts = None
+    if o.countmuts is not None:
+        count_muts = load_program('CountMuts')
+        counts = count_muts.MutationCounts(Namespace(
+            mindepth=o.cm_depth, min_clonality=o.cm_min_clonality, max_clonality=o.cm_max_clonality,
+            n_cutoff=o.cm_n_cutoff, start=o.cm_start, end=o.cm_end, unique=o.cm_unique))
+    if o.mutpos is not None:
+        mut_position = load_program('mut-position')
+        mp_options = Namespace(mindepth=o.mp_depth, clonal_min=o.mp_min_clonality, clonal_max=o.mp_max_clonality,
+                               num_muts=o.mp_num_muts)
+        mutpos_file = open(o.mutpos, 'w')
+        mutpos_file.write(mut_position.HEADER)
+        mutpos_writer = csv.writer(mutpos_file, delimiter='\t')
+    counter = None
+    if o.read_positions is not None:
+        read_position = load_program('muts_by_read_position')
+        counter = read_position.myCounts(o.rp_rlength)
+        linenum = 0
+
+    samtools = None
+    if bam and counter is None:
+        import pysam
+        f = pysam.AlignmentFile(o.inFile, 'rb')
+        fasta_file = pysam.FastaFile(o.ref)
+        blocks = bam_blocks(f, fasta_file, min_base_quality=o.min_base_quality)
+    else:
+        if bam:
+            samtools = bam_pileup(o.inFile, o.ref, o.min_base_quality, o.max_depth)
+            f = samtools.stdout
+        elif o.inFile is not None:
+            f = open(o.inFile, 'rb')
+        else:
+            f = sys.stdin.buffer
+        blocks = pileup_blocks(f)
+
+    profiler.begin('count')
+    for block in blocks:
+        if counts is not None:
+            counts.add(block)
+        if o.mutpos is not None:
+            mutpos_writer.writerows(mut_position.MutPosRows(mp_options, block))
+        if counter is not None:
+            for line in block.text_lines():
+                linenum += 1
+                read_position.readLine(counter, line, o.rp_max_clonality, linenum)
+    profiler.end('count')
+    f.close()
+    if samtools is None and bam:
+        fasta_file.close()
+    if samtools is not None and samtools.wait() != 0:
+        sys.exit('samtools mpileup failed with status %d' % samtools.returncode)
+
+    if counts is not None:
+        with open(o.countmuts, 'w') as fOut:
+            counts.report(fOut)
+    if o.mutpos is not None:
+        mutpos_file.close()
+    if counter is not None:
+        read_position.writePositions(counter, o.rp_rlength, o.inFile, o.read_positions)
+    profiler.stop()
+
+
+if __name__ == "__main__":
+    main()
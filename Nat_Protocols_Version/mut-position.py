@@ -7,6 +7,9 @@
 """
 This script gives position-specific mutation frequencies from a tagcounts file given as stdin.
 
+It can also read a position-sorted BAM file of DCSs with its reference genome (-f), and count the pileup straight
+from the reads (dsutils/bampileup.py), as 'samtools mpileup -B -A -Q MIN_BASE_QUALITY -f REF' would give it.
+
 The output is tab-delimited and specifies:
 chromosome number, template base, nucleotide position, depth, mutations to T, C, G, A, insertions, deletions, N's
 
@@ -14,28 +17,23 @@ chromosome number, template base, nucleotide position, depth, mutations to T, C,
 """
 
 from argparse import ArgumentParser
+import os
 import sys
 import re
 import csv
 import string
 
-def MutPos(o, f, fOut):
-    lines = f.readlines()
-
-    chrom=[]
-    pos=[]
-    muts = []
-    depths = []
-    template =[]
-    Tcount=[]
-    Ccount=[]
-    Gcount=[]
-    Acount=[]
-    inscount=[]
-    delcount=[]
-    Ncount=[]
-    for i,line in enumerate( lines ):
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.bampileup import MIN_BASE_QUALITY, bam_blocks
+from dsutils.pileup import pileup_blocks
 
+HEADER = "Chrom\tTemplate\tPos\tDepths\tMuts\tTcount\tCcount\tGcount\tAcount\tinscount\tdelcount\tNcount\n"
+
+def MutPosLine(o, line):
+    # The output row for one line of the pileup, or None if the line is
+    # filtered out.
           linebins = line.split()
 
     #convert sequence information to uppercase
@@ -51,13 +49,13 @@ def MutPos(o, f, fOut):
           #linebins[4] = linebins[4].replace('N','')      
 
     #count and remove insertions
-          newIns = map(int, re.findall(r'\+\d+', linebins[4]))
+          newIns = list(map(int, re.findall(r'\+\d+', linebins[4])))
           for length in newIns:
               rmStr = r'\+' + str(length) + "."*length
               linebins[4] = re.sub(rmStr, '', linebins[4])
           
     #count and remove deletions
-          newDels = map(str, re.findall(r'-\d+', linebins[4]))
+          newDels = list(map(str, re.findall(r'-\d+', linebins[4])))
           for length in newDels:
               length = int(length[1:])
               rmStr = r'-' + str(length) + "."*length
@@ -77,35 +75,88 @@ def MutPos(o, f, fOut):
                 or    
                 (max(float(linebins[4].count('T')),float(linebins[4].count('C')),float(linebins[4].count('G')),float(linebins[4].count('A')),(max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0)) < o.num_muts)
                 ):
-                pass
-                                                        
-          else:
+                return None
 
     #count position-specific mutation frequency
                                                         
-                mut = linebins[4].count('T') + linebins[4].count('C') + linebins[4].count('G') + linebins[4].count('A')
-                Tcount.append(linebins[4].count('T'))
-                Ccount.append(linebins[4].count('C'))
-                Gcount.append(linebins[4].count('G'))
-                Acount.append(linebins[4].count('A'))
-                Ncount.append(linebins[4].count('N'))
-                inscount.append(len(newIns))
-                delcount.append(len(newDels))
-                chrom.append(linebins[0])
-                pos.append(linebins[1])
-                template.append(linebins[2])
-                depths.append(depth)
-                muts.append(mut)
-                                                      
-    script_output=zip(chrom, template, pos, depths, muts, Tcount, Ccount, Gcount, Acount, inscount, delcount, Ncount)
+          mut = linebins[4].count('T') + linebins[4].count('C') + linebins[4].count('G') + linebins[4].count('A')
+          return (linebins[0], linebins[2], linebins[1], depth, mut, linebins[4].count('T'), linebins[4].count('C'), linebins[4].count('G'), linebins[4].count('A'), len(newIns), len(newDels), linebins[4].count('N'))
+
+
+def MutPosBlock(o, block):
+    # The output rows for a block of lines parsed by dsutils.pileup (or
+    # counted by dsutils.bampileup), as
+    # MutPosLine would give them.  MutPosLine removed the read starts
+    # (with their mapping qualities) and the indels before counting.
+    counts = block.bases - block.dropped
+    depth = block.depth - counts[:, 4]
+    deep = ~(depth < o.mindepth)
+    # The clonality of MutPosLine divides by zero for these
+    irregular = block.irregular | (deep & (depth == 0))
+
+    most = counts[:, :4].max(axis=1)
+    for lengths in (block.ins, block.dels):
+        lines = []
+        repeats = []
+        for i, line_lengths in lengths.items():
+            lines.append(i)
+            repeats.append(1 if len(line_lengths) == 1 else
+                           max(map(line_lengths.count, line_lengths)))
+        numpy.maximum.at(most, lines, repeats)
+    clonality = most / numpy.where(depth == 0, 1, depth)
+    kept = (~irregular & deep & ~(clonality > o.clonal_max)
+            & ~(clonality < o.clonal_min) & ~(most < o.num_muts))
+
+    rows = []
+    counts = counts.tolist()
+    depth = depth.tolist()
+    irregular = irregular.tolist()
+    for i in numpy.flatnonzero(kept | irregular).tolist():
+        if irregular[i]:
+            row = MutPosLine(o, block.line(i))
+            if row is not None:
+                rows.append(row)
+            continue
+        chrom, pos, ref = block.site(i)
+        A, C, G, T, N = counts[i]
+        rows.append((chrom, ref, pos, depth[i], T + C + G + A, T, C, G, A,
+                     len(block.ins.get(i, ())), len(block.dels.get(i, ())),
+                     N))
+    return rows
+
+
+def MutPosRows(o, block):
+    # The output rows for a block from dsutils.pileup.pileup_blocks
+    if block.lines is None:
+        return MutPosBlock(o, block)
+    rows = []
+    for line in block.lines:
+        row = MutPosLine(o, line)
+        if row is not None:
+            rows.append(row)
+    return rows
+
 
+def MutPos(o, f, fOut):
+    rows = []
+    for block in pileup_blocks(f):
+        rows.extend(MutPosRows(o, block))
+
+    csv_writer = csv.writer(fOut, delimiter='\t')
+    csv_writer.writerows(rows)
+
+
+def BamMutPos(o, bam_file, fasta_file, fOut):
+    # The rows of the pileup of a BAM file, counted from its reads
     csv_writer = csv.writer(fOut, delimiter='\t')
-    csv_writer.writerows(script_output)
+    for block in bam_blocks(bam_file, fasta_file,
+                            min_base_quality=o.min_base_quality):
+        csv_writer.writerows(MutPosBlock(o, block))
 
 
 def main():
     parser = ArgumentParser()
-    parser.add_argument('-i', '--infile', action ='store', dest = 'inFile', help = 'An imput file. If None, defaults to stdin. [%(default)s]', default = None)
+    parser.add_argument('-i', '--infile', action ='store', dest = 'inFile', help = 'An imput file: a pileup, or a position-sorted BAM file with --ref. If None, defaults to stdin. [%(default)s]', default = None)
     parser.add_argument('-o', '--outfile', action = 'store', dest = 'outFile', help = 'A filename for the output file.  If None, outputs to stdout.  [%(default)s]', default = None)
     parser.add_argument("-d", "--depth", action="store", type=int, dest="mindepth", 
                       help="Minimum depth for counting mutations at a site [%(default)s]", default=20)
@@ -115,17 +166,32 @@ def main():
                       help="Cutoff of mutant reads for scoring a clonal mutation [%(default)s]", default=1)
     parser.add_argument("-n", "--num_muts", action="store", type=int, dest="num_muts",
                       help="Minimum number of mutations for scoring a site [%(default)s]", default=0)
+    parser.add_argument('-f', '--ref', action='store', dest='ref',
+                      help='The reference genome of a BAM --infile [%(default)s]', default=None)
+    parser.add_argument('-Q', '--min_base_quality', action='store', type=int, dest='min_base_quality',
+                      help='Minimum base quality of a BAM --infile, as for samtools mpileup -Q [%(default)s]',
+                      default=MIN_BASE_QUALITY)
     o = parser.parse_args()
-    if o.inFile != None:
-        f = open(o.inFile, 'r')
+    bam = o.inFile != None and o.inFile.endswith('.bam')
+    if bam and o.ref == None:
+        parser.error('a BAM --infile needs --ref')
+    if bam:
+        import pysam
+        bam_file = pysam.AlignmentFile(o.inFile, 'rb')
+        fasta_file = pysam.FastaFile(o.ref)
+    elif o.inFile != None:
+        f = open(o.inFile, 'rb')
     else:
-        f = sys.stdin
+        f = sys.stdin.buffer
     if o.outFile != None:
-        fOut = open(o.outFile, 'wb')
+        fOut = open(o.outFile, 'w')
     else:
         fOut = sys.stdout
-    fOut.write("Chrom\tTemplate\tPos\tDepths\tMuts\tTcount\tCcount\tGcount\tAcount\tinscount\tdelcount\tNcount\n")
-    MutPos(o, f, fOut)
+    fOut.write(HEADER)
+    if bam:
+        BamMutPos(o, bam_file, fasta_file, fOut)
+    else:
+        MutPos(o, f, fOut)
         
 
 
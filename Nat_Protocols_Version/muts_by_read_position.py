@@ -6,10 +6,14 @@ import matplotlib
 matplotlib.use('Agg')
 import pylab
 import numpy
+import os
 import sys
 import re
 from argparse import ArgumentParser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.pileup import column_reads, has_prefix
+
 # myRead defines what information about each read needs to be stored.  
 class myRead:
     def __init__(self, myStart, length):
@@ -56,7 +60,7 @@ class myCounts:
     
     def closeReads(self,readToClose = 0):
         closed = 0
-        for read in xrange(len(self.reads)):
+        for read in range(len(self.reads)):
             if self.reads[read-closed].closeMe == True:
                 self.counts += self.reads.pop(read-closed).close()
                 closed += 1
@@ -105,19 +109,199 @@ def linePrep(line, maxCln):
     linebin = re.sub(r'\^.n','u', linebin)
     
     #Convert insertions
-    newIns = map(int, re.findall(r'\+\d+', linebin))
+    newIns = list(map(int, re.findall(r'\+\d+', linebin)))
     for length in newIns:
         rmStr = r'\+' + str(length) + "."*length
         linebin = re.sub(rmStr, str(length), linebin)
     #Convert deletions
-    newDels = map(str, re.findall(r'-\d+', linebin))
+    newDels = list(map(str, re.findall(r'-\d+', linebin)))
     for length in newDels:
         length = int(length[1:])
         rmStr = r'-' + str(length) + "."*length
         linebin = re.sub(rmStr, 'D', linebin)
     linebin = linebin.replace('*', 'd')
     return(linebin)
-   
+
+# linePrep's start letters for each base after a '^', and for clonal lines
+STARTS = {'.': 'R', ',': 'r', 'N': 'U', 'n': 'u'}
+STARTS.update(dict.fromkeys('ACGT', 'M'))
+STARTS.update(dict.fromkeys('acgt', 'm'))
+CLONAL_STARTS = dict(STARTS)
+CLONAL_STARTS.update(dict.fromkeys('ACGTacgt', 'R'))
+# The other bases countLine accepts
+BASES = set('.,ACGTNacgtn*')
+
+# Count one line prepared by linePrep
+def countLine(counter, linebin, linenum):
+    readNum = 0
+    skips = 0
+    try:
+        while readNum < len(linebin):
+            # Check what the identity of a charecter is
+            if linebin[readNum] in ('M', 'R', 'U', 'm', 'r', 'u'):
+                # Start a new read
+                counter.newRead(linebin[readNum]) 
+            elif linebin[readNum] == 'E':
+                # Mark a read to be closed later
+                skips += 1
+                counter.reads[readNum - skips].closeMe = True
+            elif linebin[readNum] in ('A', 'G', 'C', 'T', 'a', 'g', 'c', 't'):
+                # Count a mutation
+                counter.reads[readNum-skips].addMut()
+            elif linebin[readNum] in ('1', '2', '3', '4', '5', '6', '7', '8', '9'):
+                # Count an indel
+                counter.reads[readNum-1-skips].addIndel()
+                # Scroll the read with the indel forward the length of the indel, and mark indel length charecters to be skipped
+                tst = 0
+                indelLength = ''
+                while readNum + tst < len(linebin) and linebin[readNum+tst] in ('0', '1', '2', '3', '4', '5', '6', '7', '8', '9'):
+                    indelLength += linebin[readNum + tst]
+                    skips += 1
+                    tst += 1
+                for x in range(int(indelLength)):
+                    counter.reads[readNum-1-skips+tst].advance()
+            elif linebin[readNum] == 'D':
+                counter.reads[readNum-skips-1].addIndel()
+                skips += 1
+            elif linebin[readNum] == 'd':
+                counter.reads[readNum-skips].skipMe = True
+            elif linebin[readNum] in ('N', 'n'):
+                # Count an N
+                counter.reads[readNum-skips].addN()
+            elif linebin[readNum] in ('.', ','):
+                pass
+            else:
+                raise ValueError("Not a valid pileup value at %s: %s" % (readNum, linebin[readNum]))
+            readNum += 1
+    except Exception:
+        print('%s[%s]: %s' % (linenum, readNum, linebin))
+        raise
+
+# The reads of a line, split by dsutils.pileup.column_reads, and whether the
+# line is clonal; the reads are None if the line does not split cleanly.
+def lineReads(line, maxCln):
+    linebins = line.split()
+    depth = max(int(linebins[3]) - linebins[4].count('N'),1)
+    clonality = (float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'),linebins[4].count('t'),linebins[4].count('c'),linebins[4].count('g'),linebins[4].count('a'))) / float(depth))
+    return(column_reads(linebins[4]), float(clonality) > float(maxCln))
+
+# Count the reads of one line as countLine counts the linePrep version of
+# the line.  Returns False, having counted nothing, for lines where
+# countLine would raise an error or count otherwise: read starts after a
+# '^' mapping quality, bases that are not pileup characters, reads that
+# are not there, positions past the end of the reads, insertions of 10 or
+# more bases and deletion lengths that start one another.
+def countReads(counter, reads, clonal):
+    starts = CLONAL_STARTS if clonal else STARTS
+    known = len(counter.reads)
+    size = known
+    dels = []
+    for j, (mapq, base, indel, end) in enumerate(reads):
+        if mapq:
+            if mapq == '^' or base not in starts:
+                return False
+            size += 1
+            counted = False
+        elif base in ('.', ','):
+            if not indel and not end:
+                continue
+            counted = False
+        elif base in BASES:
+            counted = base != '*' and not (clonal and base not in 'Nn')
+        else:
+            return False
+        if j >= size:
+            return False
+        if indel:
+            if indel[0] == '+':
+                if len(indel) > 2:
+                    return False
+            else:
+                dels.append(indel[1:])
+        if ((counted or indel) and j < known
+                and counter.reads[j].pos >= counter.myLen):
+            return False
+    if len(dels) > 1 and has_prefix(dels):
+        return False
+
+    for j, (mapq, base, indel, end) in enumerate(reads):
+        if mapq:
+            counter.newRead(starts[base])
+        elif base in ('.', ','):
+            if not indel and not end:
+                continue
+        elif base in ('N', 'n'):
+            counter.reads[j].addN()
+        elif base == '*':
+            counter.reads[j].skipMe = True
+        elif not clonal:
+            counter.reads[j].addMut()
+        if indel:
+            read = counter.reads[j]
+            read.addIndel()
+            if indel[0] == '+':
+                for x in range(int(indel[1:])):
+                    read.advance()
+        if end:
+            counter.reads[j].closeMe = True
+    return True
+
+# Count one line of a pileup, the linenum-th
+def readLine(counter, line, maxCln, linenum):
+    reads, clonal = lineReads(line, maxCln)
+    if linenum % 10000 == 0:
+        print('%s lines processed' % linenum)
+    if (counter.myLen < 1 or reads is None
+            or not countReads(counter, reads, clonal)):
+        countLine(counter, linePrep(line, maxCln), linenum)
+    # Close any reads marked for closing
+    counter.closeReads()
+    # Advance all reads
+    counter.advanceReads()
+
+# Count mutations, indels and Ns by their position in the reads of a pileup
+def readPositions(f, rlength, maxCln):
+    counter = myCounts(rlength)
+    linenum = 0
+
+    for line in f:
+        linenum += 1
+        readLine(counter, line, maxCln, linenum)
+    return(counter)
+
+# Save the graphs of the counts in outFile, and the counts in outFile.dat
+def writePositions(counter, rlength, inFile, outFile):
+    # Generate and save the graphs.
+    counter.totals()
+    myX = range(1, rlength + 1)
+    ax1 = pylab.subplot(3, 1, 1)
+    pylab.plot(myX, counter.counts[0, :], 'b', linewidth = 2)
+    pylab.title('Mutations by Position: %s' % inFile)
+    pylab.ylabel("% Mutations")
+    pylab.setp(ax1.get_xticklabels(), visible=False)
+    ax2 = pylab.subplot(3, 1, 2)
+    pylab.plot(myX, counter.counts[1, :], 'r', linewidth = 2)
+    pylab.title('Indels by Position: %s' % inFile)
+    pylab.ylabel("% Indels")
+    pylab.setp(ax2.get_xticklabels(), visible=False)
+    ax3 = pylab.subplot(3, 1, 3)
+    pylab.plot(myX, counter.counts[2, :], 'k', linewidth = 2)
+    pylab.title('Ns by Position: %s' % inFile)
+    pylab.ylabel("% Ns")
+    pylab.xlabel("Read Position")
+
+    pylab.savefig(outFile)
+    
+    # Generate and save the data file
+    outWrite = counter.counts.transpose()
+    datFile = open(outFile + '.dat', 'w')
+    for n in range(rlength):
+        outStr = ""
+        for m in range(3):
+            outStr += ' %s' % outWrite[n, m]
+        datFile.write(outStr + '\n')
+    datFile.close()
+
 def main():
     #Read in command-line arguments
     parser = ArgumentParser()
@@ -159,93 +343,9 @@ def main():
     else:
         f = sys.stdin
 
-    counter = myCounts(o.rlength)
-    linenum = 0
-    lineskips = 0
-
-    for line in f:
-        linebin = linePrep(line, o.max_clonality)
-        linenum += 1
-        readNum = 0
-        skips = 0
-        if linenum % 10000 == 0:
-            print('%s lines processed' % linenum)
-        try:
-            while readNum < len(linebin):
-                # Check what the identity of a charecter is
-                if linebin[readNum] in ('M', 'R', 'U', 'm', 'r', 'u'):
-                    # Start a new read
-                    counter.newRead(linebin[readNum]) 
-                elif linebin[readNum] == 'E':
-                    # Mark a read to be closed later
-                    skips += 1
-                    counter.reads[readNum - skips].closeMe = True
-                elif linebin[readNum] in ('A', 'G', 'C', 'T', 'a', 'g', 'c', 't'):
-                    # Count a mutation
-                    counter.reads[readNum-skips].addMut()
-                elif linebin[readNum] in ('1', '2', '3', '4', '5', '6', '7', '8', '9'):
-                    # Count an indel
-                    counter.reads[readNum-1-skips].addIndel()
-                    # Scroll the read with the indel forward the length of the indel, and mark indel length charecters to be skipped
-                    tst = 0
-                    indelLength = ''
-                    while readNum + tst < len(linebin) and linebin[readNum+tst] in ('0', '1', '2', '3', '4', '5', '6', '7', '8', '9'):
-                        indelLength += linebin[readNum + tst]
-                        skips += 1
-                        tst += 1
-                    for x in xrange(int(indelLength)):
-                        counter.reads[readNum-1-skips+tst].advance()
-                elif linebin[readNum] == 'D':
-                    counter.reads[readNum-skips-1].addIndel()
-                    skips += 1
-                elif linebin[readNum] == 'd':
-                    counter.reads[readNum-skips].skipMe = True
-                elif linebin[readNum] in ('N', 'n'):
-                    # Count an N
-                    counter.reads[readNum-skips].addN()
-                elif linebin[readNum] in ('.', ','):
-                    pass
-                else:
-                    raise ValueError("Not a valid pileup value at %s: %s" % (readNum, linebin[readNum]))
-                readNum += 1
-        except Exception:
-            print('%s[%s]: %s' % (linenum, readNum, linebin))
-            raise
-        # Close any reads marked for closing
-        counter.closeReads()
-        # Advance all reads
-        counter.advanceReads()
-    
-    # Generate and save the graphs.
-    counter.totals()
-    myX = range(1, o.rlength + 1)
-    ax1 = pylab.subplot(3, 1, 1)
-    pylab.plot(myX, counter.counts[0, :], 'b', linewidth = 2)
-    pylab.title('Mutations by Position: %s' % o.inFile)
-    pylab.ylabel("% Mutations")
-    pylab.setp(ax1.get_xticklabels(), visible=False)
-    ax2 = pylab.subplot(3, 1, 2)
-    pylab.plot(myX, counter.counts[1, :], 'r', linewidth = 2)
-    pylab.title('Indels by Position: %s' % o.inFile)
-    pylab.ylabel("% Indels")
-    pylab.setp(ax2.get_xticklabels(), visible=False)
-    ax3 = pylab.subplot(3, 1, 3)
-    pylab.plot(myX, counter.counts[2, :], 'k', linewidth = 2)
-    pylab.title('Ns by Position: %s' % o.inFile)
-    pylab.ylabel("% Ns")
-    pylab.xlabel("Read Position")
+    counter = readPositions(f, o.rlength, o.max_clonality)
 
-    pylab.savefig(o.outFile)
-    
-    # Generate and save the data file
-    outWrite = counter.counts.transpose()
-    outFile = open(o.outFile + '.dat', 'w')
-    for n in range(o.rlength):
-        outStr = ""
-        for m in range(3):
-            outStr += ' %s' % outWrite[n, m]
-        outFile.write(outStr + '\n')
-    outFile.close()
+    writePositions(counter, o.rlength, o.inFile, o.outFile)
     if o.inFile != None:
         f.close()
 
@@ -12,6 +12,10 @@
 #                        [--outfile1 OUTFILE1] [--outfile2 OUTFILE2]
 #                        [--taglen BLENGTH] [--spacerlen SLENGTH]
 #                        [--read_out ROUT] [--filt_spacer ADAPTERSEQ] --tagstats
+#                        [--processes PROCESSES] [--block_size BLOCK_SIZE]
+#                        [--name_format {auto,casava1.8,casava1.4,sra}]
+#                        [--sample_sheet SAMPLE_SHEET] [--index_mismatches INDEX_MISMATCHES]
+#                        [--undetermined UNDETERMINED]
 #
 # Optional arguments:
 #  -h, --help            		show this help message and exit
@@ -28,72 +32,56 @@
 #                        		   		  low quality scores.
 #  --tagstats 			 		Optional: Output tagstats file and make distribution plot of tag family sizes.
 #								   		  Requires matplotlib to be installed
+#  --processes PROCESSES		Number of worker processes tagging blocks of reads. [1]
+#  --block_size BLOCK_SIZE		Number of read pairs in each block. [10000]
+#  --name_format {auto,casava1.8,casava1.4,sra}
+#								Format of the read names.  auto: detect it from the first reads. [auto]
+#  --sample_sheet SAMPLE_SHEET	Optional: Demultiplex the reads: a file with the index sequence and output prefix of 
+#								each sample, which replaces --outprefix for that sample.
+#  --index_mismatches INDEX_MISMATCHES
+#								Mismatches allowed between a sample index and the sample sheet. [1]
+#  --undetermined UNDETERMINED	Optional: Output prefix for the reads whose index matches no sample; without it they 
+#								are dropped.
+#
+# The reads are taken in blocks of --block_size pairs.  With --processes N, N worker processes tag the blocks, and
+# the blocks are written out in their original order, so the outputs and counts are the same as with one process.
+# Progress is reported at the end of a block.
+#
+# The format of the read names is detected once, from the first reads of both files, and the names of all the 
+# reads are rewritten by a renaming function made for that format.  Formats are:
+#   casava1.8: @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG
+#              -> @EAS139:136:FC706VJ:2:2104:15343:197393|TAGS/1
+#   casava1.4: @HWUSI-EAS100R:6:73:941:1973#ATCGAT/1
+#              -> @HWUSI-EAS100R:6:73:941:1973#ATCGAT|TAGS/1
+#   sra:       @SRR1613972.1.1 1 length=101
+#              -> @SRR1613972.1.1:1:length=101:1:1|TAGS/1
+# Names of the sra format are renamed as TestData/SRAFixer.py followed by this program would, so SRA downloads do 
+# not need SRAFixer.py any more.  Other formats can be added to NAME_FORMATS.
+#
+# With --tagstats, the tags are counted as 2-bit packed integers in NumPy arrays (dsutils/barcodes.py), and the tags 
+# whose partner (tag2 + tag1) also makes an SSCS are found by binary search.  --reduce then reads the outputs back 
+# a block at a time and keeps the pairs with those tags.  Requires NumPy to be installed.
+#
+# With --sample_sheet, each read pair goes to the sample of the index on the name of read 1 (ATCACG in 
+# 1:Y:18:ATCACG, or in #ATCACG/1), as described in dsutils/samples.py.  Each sample gets its own outputs, counts, 
+# tagstats and reduced outputs, named by its prefix in the sheet, and <outprefix>_samples.txt has the counts of 
+# all the samples, including the undetermined pairs.  SRA read names have no index.
 
 
+import os
+import re
 import sys
 import gzip
 from argparse import ArgumentParser
-from collections import defaultdict
-
-
-def fastq_general_iterator(read1_fastq, read2_fastq):
-	read1_readline = read1_fastq.readline
-	read2_readline = read2_fastq.readline
-
-	while True:
-		read1_line = read1_readline()
-		read2_line = read2_readline()
-
-		if not read1_line and read2_line:
-			return
-		if read1_line[0] == '@' and read2_line[0] == '@':
-			break
-		if isinstance(read1_line[0], int) or isinstance(read2_line[0], int):
-			raise ValueError("FASTQ files may contain binary information or are compressed")
-
-	while read1_line and read2_line:
-
-		if read1_line[0] != '@' or read2_line[0] != '@':
-			print read1_line, read2_line
-			raise ValueError("Records in FASTQ files should start with a '@' character. Files may be malformed or out of synch.")
-
-		title_read1_line = read1_line[1:].rstrip()
-		title_read2_line = read2_line[1:].rstrip()
-
-		read1_seq_string = read1_readline().rstrip()
-		read2_seq_string = read2_readline().rstrip()
-
-		while True:
-			read1_line = read1_readline()
-			read2_line = read2_readline()
-
-			if not read1_line and read2_line:
-				raise ValueError("End of file without quality information. Files may be malformed or out of synch")
-			if read1_line[0] == '+' and read2_line[0] == '+':
-				break
-
-			read1_seq_string += read1_line.rstrip()
-			read2_seq_string += read2_line.rstrip()
-
-		read1_quality_string = read1_readline().rstrip()
-		read2_quality_string = read2_readline().rstrip()
-
-		while True:
-			read1_line = read1_readline()
-			read2_line = read2_readline()
-
-			if not read1_line or read2_line:
-				break  # end of file
-			if read1_line[0] == '@' and read2_line[0] == '@' and read1_line.isalpha() is not True \
-				and read2_line.isalpha() is not True:
-				break
+from collections import defaultdict, deque
+from itertools import chain, islice
+from multiprocessing import Pool
 
-			read1_quality_string += read1_line.rstrip()
-			read2_quality_string += read2_line.rstrip()
-
-		yield (title_read1_line, title_read2_line, read1_seq_string, read2_seq_string, read1_quality_string, read2_quality_string)
-
-	raise StopIteration
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.barcodes import BarcodeCounts, pack_tags
+from dsutils.fastq import fastq_input, paired_fastq_records
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+from dsutils.samples import SampleSheet, read_sample_sheet, write_sample_counts
 
 
 def tag_extract_fxn(read_seq, blen):
@@ -126,13 +114,159 @@ def hdr_rename_fxn(read_title, read1_tag, read2_tag):
 		raise ValueError("Unknown read name format: %s" % read_title)
 
 
-def tag_stats(barcode_counts, outfile):
+def casava18_renamer(read_num):
+	# @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG; the read number is taken from each name.
+	def rename(read_title, tags):
+		fields = read_title.split(" ", 2)
+		return fields[0] + "|" + tags + "/" + fields[1].split(":", 1)[0]
+	return rename
+
+
+def casava14_renamer(read_num):
+	# @HWUSI-EAS100R:6:73:941:1973#ATCGAT/1; the read number is taken from each name.
+	def rename(read_title, tags):
+		fields = read_title.replace(" ", "_").split("/", 2)
+		return fields[0] + "|" + tags + "/" + fields[1]
+	return rename
+
+
+def sra_renamer(read_num):
+	# @SRR1613972.1.1 1 length=101, renamed as by TestData/SRAFixer.py, with the spot number twice and the number of 
+	# the file the read is from.
+	suffix = "/" + read_num
+	def rename(read_title, tags):
+		spot = read_title.split(" ", 1)[0].split(".", 2)[1]
+		return read_title.replace(" ", ":") + ":" + spot + ":" + spot + "|" + tags + suffix
+	return rename
+
+
+def casava18_index(read_title):
+	# The sample index, ATCACG in @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG
+	return read_title.rsplit(":", 1)[1]
+
+
+def casava14_index(read_title):
+	# The sample index, ATCGAT in @HWUSI-EAS100R:6:73:941:1973#ATCGAT/1
+	return read_title.split("#", 1)[1].split("/", 1)[0]
+
+
+SRA_NAME = re.compile(r'[SED]RR\d+\.\d+\S* ')
+
+# Read name formats, in the order they are tried: a test for a read name in the format, a function that makes the 
+# renaming function for read 1 or read 2, rename(read_title, tag1 + tag2), and a function that gets the sample index 
+# from a read name, or None if the names have none.
+NAME_FORMATS = {
+	'casava1.8': (lambda read_title: " " in read_title and len(read_title.split(" ")[0].split(":")) == 7, 
+				casava18_renamer, casava18_index),
+	'casava1.4': (lambda read_title: "/" in read_title and len(read_title.split(" ")[0].split(":")) == 5, 
+				casava14_renamer, casava14_index),
+	'sra': (lambda read_title: SRA_NAME.match(read_title) is not None, sra_renamer, None),
+}
+
+
+def detect_name_format(read_titles):
+	# The first format of NAME_FORMATS that all of read_titles are in.
+	for name, (test, make_renamer, get_index) in NAME_FORMATS.items():
+		if all(test(read_title) for read_title in read_titles):
+			return name
+	raise ValueError("Unknown read name format: %s" % read_titles[0])
+
+
+def tag_block(records, o):
+	# Split a block of read pairs from paired_fastq_records between the samples of o.samples, by the sample index 
+	# of read 1, and tag the pairs of each sample with tag_records.  Returns a dictionary of the results of 
+	# tag_records for each output prefix: o.outfile, without a sample sheet.  Pairs of undetermined samples are 
+	# only counted, under None.
+	if o.samples is None:
+		return {o.outfile: tag_records(records, o)}
+	get_index = NAME_FORMATS[o.name_format][2]
+	sample_records = defaultdict(list)
+	for record in records:
+		sample_records[o.samples.sample(get_index(record[0]))].append(record)
+	results = {}
+	for prefix, records in sample_records.items():
+		if prefix is None:
+			results[prefix] = ('', '', (len(records), 0, 0, 0), pack_tags([], 2 * o.taglen))
+		else:
+			results[prefix] = tag_records(records, o)
+	return results
+
+
+def tag_records(records, o):
+	# Tag extraction, spacer filtering, bad-tag checks and header renaming for a list of read pairs.  Returns the 
+	# text of the pairs for the two output files, the counts of pairs, passing pairs, missing spacers and bad tags, 
+	# and, with --tagstats, the tags of the passing pairs packed by pack_tags.
+	read1_lines = []
+	read2_lines = []
+	nospacer = 0
+	goodreads = 0
+	badtag = 0
+	barcodes = []
+	trim = o.taglen + o.spclen
+	make_renamer = NAME_FORMATS[o.name_format][1]
+	rename1 = make_renamer("1")
+	rename2 = make_renamer("2")
+
+	for read1_title, read2_title, read1_seq, read2_seq, read1_qual, read2_qual in records:
+		if o.spacer_seq != None and (read1_seq[o.taglen:trim] != o.spacer_seq or read2_seq[o.taglen:trim] != o.spacer_seq):
+			nospacer += 1
+		else:
+			tag1, tag2 = tag_extract_fxn((read1_seq, read2_seq), o.taglen)
+
+			if (tag1.isalpha() and tag1.count('N') == 0) and (tag2.isalpha() and tag2.count('N') == 0):
+				tags = tag1 + tag2
+				read1_lines.append('@' + rename1(read1_title, tags) + '\n' + read1_seq[trim:] + '\n+\n' + 
+								read1_qual[trim:] + '\n')
+				read2_lines.append('@' + rename2(read2_title, tags) + '\n' + read2_seq[trim:] + '\n+\n' + 
+								read2_qual[trim:] + '\n')
+				goodreads += 1
+
+				if o.tagstats:
+					barcodes.append(tags)
+
+			else:
+				badtag += 1
+
+	return (''.join(read1_lines), ''.join(read2_lines), (len(records), goodreads, nospacer, badtag), 
+			pack_tags(barcodes, 2 * o.taglen))
+
+
+def fastq_blocks(records, block_size):
+	# The read pairs of paired_fastq_records, in lists of block_size.
+	while True:
+		block = list(islice(records, block_size))
+		if not block:
+			return
+		yield block
+
+
+def tagged_blocks(blocks, o):
+	# Run tag_block on each block, in o.processes worker processes if more than one, and yield the results in the 
+	# order of the blocks.  At most two blocks per process are waiting at any time.
+	if o.processes <= 1:
+		for block in blocks:
+			yield tag_block(block, o)
+		return
+	pool = Pool(o.processes)
+	pending = deque()
+	for block in blocks:
+		pending.append(pool.apply_async(tag_block, (block, o)))
+		if len(pending) > 2 * o.processes:
+			yield pending.popleft().get()
+	while pending:
+		yield pending.popleft().get()
+	pool.close()
+	pool.join()
+
+
+def tag_stats(family_sizes, outfile):
+	# family_sizes maps each family size to the number of tags with that many reads.
 	family_size_dict = defaultdict(lambda:0)
 	tagstat_file =  open(outfile + '.tagstats', 'w')
 	total_tags = 0
 
-	for value in barcode_counts:
-		family_size_dict[value] += 1
+	for family_size, tags in family_sizes.items():
+		family_size_dict[family_size] += tags
 
 	for family_size in family_size_dict.keys():
 		family_size_dict[family_size] *= int(family_size)
@@ -144,14 +278,78 @@ def tag_stats(barcode_counts, outfile):
 	tagstat_file.close()
 	return family_size_dict, total_tags
 
-def open_fastq(infile, outfile):
+def open_output(infile, outfile):
+    # The output, gzipped if the input is named .gz.
     if infile.endswith(".gz"):
-        in_fh = gzip.open(infile, 'rb')
-        out_fh = gzip.open(outfile + ".gz", 'wb')
-    else:
-        in_fh = open(infile, 'r')
-        out_fh = open(outfile, 'w')
-    return (in_fh, out_fh)
+        return gzip.open(outfile + ".gz", 'wt')
+    return open(outfile, 'w')
+
+def sample_tagstats(prefix, goodreads, barcode_counts):
+	# Write the tagstats, _data.txt and plots of one output prefix, and with --reduce its reduced outputs.
+	read_data_file = open(prefix + '_data.txt', 'w')
+	family_size_dict, total_tags = tag_stats(barcode_counts.family_size_counts(), prefix)
+
+	# Tags with at least 3 reads, and those of them whose partner (tag2 + tag1) also has at least 3
+	sscs_count, dcs_count = barcode_counts.duplexes(3)
+
+	read_data_file.write('# Passing Reads\t# SSCS Reads\t# DCS Reads\tSSCS:DCS\n%d\t%d\t%d\t%f\n'
+						 % (goodreads, sscs_count, dcs_count, 
+							float(sscs_count)/float(dcs_count) if dcs_count else float('nan')))
+	read_data_file.close()
+
+	try:
+		import matplotlib
+		matplotlib.use('Agg')
+		import matplotlib.pyplot as plt
+
+		x_value = []
+		y_value = []
+
+		for family_size in sorted(family_size_dict.keys()):
+			x_value.append(family_size)
+			y_value.append(float(family_size_dict[family_size]) / float(total_tags))
+
+		plt.bar(x_value, y_value)
+		plt.xlabel('Family Size')
+		plt.ylabel('Proportion of Total Reads')
+		plt.savefig(prefix + '.png', bbox_inches='tight')
+
+		plt.bar(x_value, y_value)
+		plt.xlabel('Family Size')
+		plt.ylabel('Proportion of Total Reads')
+		plt.xlim([0,40])
+		plt.savefig(prefix + '.zoom.png', bbox_inches='tight')
+		# Start the next sample's plots afresh
+		plt.close('all')
+
+	except ImportError:
+		sys.stderr.write('matplotlib not present. Only tagstats file will be generated.')
+
+def reduce_reads(prefix, barcode_counts, o):
+	# Write the pairs of one output prefix whose tags can make a DCS to its .reduced.fq files.
+	smi_suffix = '.smi.fq.gz' if o.infile1.endswith(".gz") else '.smi.fq'
+	read1_fastq = fastq_input(prefix + '.seq1' + smi_suffix)
+	read2_fastq = fastq_input(prefix + '.seq2' + smi_suffix)
+	read1_output = open(prefix + '.seq1.reduced.fq', 'w')
+	read2_output = open(prefix + '.seq2.reduced.fq', 'w')
+
+	# Keep the pairs whose tags can make a DCS, a block at a time.
+	for block in fastq_blocks(paired_fastq_records(read1_fastq, read2_fastq), 100000):
+		keep1 = barcode_counts.is_duplex([record[0].split('|')[1].split('/')[0] for record in block])
+		keep2 = barcode_counts.is_duplex([record[1].split('|')[1].split('/')[0] for record in block])
+		kept = [record for record, keep_read1, keep_read2 in zip(block, keep1, keep2) 
+				if keep_read1 and keep_read2]
+		read1_output.write(''.join(['@%s\n%s\n+\n%s\n' % (read1_title, read1_seq, read1_qual) for 
+									read1_title, read2_title, read1_seq, read2_seq, read1_qual, read2_qual 
+									in kept]))
+		read2_output.write(''.join(['@%s\n%s\n+\n%s\n' % (read2_title, read2_seq, read2_qual) for 
+									read1_title, read2_title, read1_seq, read2_seq, read1_qual, read2_qual 
+									in kept]))
+
+	read1_fastq.close()
+	read2_fastq.close()
+	read1_output.close()
+	read2_output.close()
 
 def main():
 	parser =  ArgumentParser()
@@ -172,43 +370,76 @@ def main():
 						Requires matplotlib to be installed.')
 	parser.add_argument('--reduce', dest='reduce', action="store_true", help='Optional: Only output reads that will make \
 						a final DCS read.  Will only work when the --tagstats option is invoked.')
+	parser.add_argument('--processes', dest='processes', type=int, default=1,
+						help='Number of worker processes tagging blocks of reads. [1]')
+	parser.add_argument('--block_size', dest='block_size', type=int, default=10000,
+						help='Number of read pairs in each block. [10000]')
+	parser.add_argument('--name_format', dest='name_format', choices=['auto'] + list(NAME_FORMATS), default='auto',
+						help='Format of the read names.  auto: detect it from the first reads. [auto]')
+	parser.add_argument('--sample_sheet', dest='sample_sheet', default=None,
+						help='Optional: Demultiplex the reads: a file with the index sequence and output prefix of each \
+						sample, which replaces --outprefix for that sample.')
+	parser.add_argument('--index_mismatches', dest='index_mismatches', type=int, default=1,
+						help='Mismatches allowed between a sample index and the sample sheet. [1]')
+	parser.add_argument('--undetermined', dest='undetermined', default=None,
+						help='Optional: Output prefix for the reads whose index matches no sample; without it they are \
+						dropped.')
+	add_profile_arguments(parser, ['tags', 'tagstats', 'reduce'])
 	o = parser.parse_args()
+	profiler = profiler_from_args(o, o.outfile)
+	profiler.start()
 
 	if o.reduce and not o.tagstats:
 		raise ValueError("--reduce option must be invoked with the --tagstats option.")
 
-	(read1_fastq, read1_output) = open_fastq(o.infile1, o.outfile + '.seq1.smi.fq')
-	(read2_fastq, read2_output) = open_fastq(o.infile2, o.outfile + '.seq2.smi.fq')
+	if o.sample_sheet is None:
+		o.samples = None
+		prefixes = [o.outfile]
+	else:
+		o.samples = SampleSheet(read_sample_sheet(o.sample_sheet), o.index_mismatches, o.undetermined)
+		prefixes = o.samples.prefixes
+
+	read1_fastq = fastq_input(o.infile1)
+	read2_fastq = fastq_input(o.infile2)
+	outputs = {}
+	for prefix in prefixes:
+		outputs[prefix] = (open_output(o.infile1, prefix + '.seq1.smi.fq'), 
+						   open_output(o.infile2, prefix + '.seq2.smi.fq'))
 
 	readctr = 0
 	nospacer = 0
 	goodreads = 0
 	badtag = 0
 	oldBad = 0
-	barcode_dict = defaultdict(lambda:0)
-
-	for read1_title, read2_title, read1_seq, read2_seq, read1_qual, read2_qual in fastq_general_iterator(read1_fastq, read2_fastq):
-		readctr += 1
-
-		if o.spacer_seq != None and (read1_seq[o.taglen:o.taglen + o.spclen] != o.spacer_seq or read2_seq[o.taglen:o.taglen + o.spclen] != o.spacer_seq):
-			nospacer += 1
-		else:
-			tag1, tag2 = tag_extract_fxn((read1_seq, read2_seq), o.taglen)
-
-			if (tag1.isalpha() and tag1.count('N') == 0) and (tag2.isalpha() and tag2.count('N') == 0):
-				renamed_read1_title =  hdr_rename_fxn(read1_title, tag1, tag2)
-				renamed_read2_title =  hdr_rename_fxn(read2_title, tag1, tag2)
-				read1_output.write('@%s\n%s\n+\n%s\n' % (renamed_read1_title, read1_seq[o.taglen+o.spclen:], read1_qual[o.taglen + o.spclen:]))
-				read2_output.write('@%s\n%s\n+\n%s\n' % (renamed_read2_title, read2_seq[o.taglen+o.spclen:], read2_qual[o.taglen + o.spclen:]))
-				goodreads += 1
-
-				if o.tagstats:
-					barcode_dict[tag1 + tag2] += 1
-
-			else:
-				badtag += 1
-
-		if readctr % o.readout is 0:
+	# Counts of pairs, passing pairs, missing spacers and bad tags, and tag counts with --tagstats, for each prefix
+	sample_counts = defaultdict(lambda: [0, 0, 0, 0])
+	barcode_counts = dict((prefix, BarcodeCounts(o.taglen)) for prefix in prefixes)
+
+	profiler.begin('tags')
+	records = paired_fastq_records(read1_fastq, read2_fastq)
+	if o.name_format == 'auto':
+		first_records = list(islice(records, 100))
+		if first_records:
+			o.name_format = detect_name_format([record[0] for record in first_records] + 
+											[record[1] for record in first_records])
+			sys.stderr.write("Read name format: %s\n" % o.name_format)
+		records = chain(first_records, records)
+	if o.samples is not None and o.name_format != 'auto' and NAME_FORMATS[o.name_format][2] is None:
+		raise ValueError("Read names of the %s format have no sample index." % o.name_format)
+	for block_results in tagged_blocks(fastq_blocks(records, o.block_size), o):
+		reads_before = readctr
+		for prefix, (read1_text, read2_text, counts, block_barcodes) in block_results.items():
+			if prefix is not None:
+				outputs[prefix][0].write(read1_text)
+				outputs[prefix][1].write(read2_text)
+				barcode_counts[prefix].add_packed(*block_barcodes)
+			readctr += counts[0]
+			goodreads += counts[1]
+			nospacer += counts[2]
+			badtag += counts[3]
+			sample_counts[prefix] = [total + count for total, count in zip(sample_counts[prefix], counts)]
+
+		if reads_before // o.readout != readctr // o.readout:
 			sys.stderr.write("Total sequences processed: %s\n" % readctr)
 			sys.stderr.write("Sequences with passing tags: %s\n" % goodreads)
 			sys.stderr.write("Missing spacers: %s\n" % nospacer)
@@ -219,80 +450,35 @@ def main():
 
 	read1_fastq.close()
 	read2_fastq.close()
-	read1_output.close()
-	read2_output.close()
+	for read1_output, read2_output in outputs.values():
+		read1_output.close()
+		read2_output.close()
+	profiler.end('tags')
 
 	sys.stderr.write("Total sequences processed: %s\n" % readctr)
 	sys.stderr.write("Sequences with passing tags: %s\n" % goodreads)
 	sys.stderr.write("Missing spacers: %s\n" % nospacer)
 	sys.stderr.write("Bad tags: %s\n" % badtag)
+	if o.samples is not None:
+		for prefix in prefixes + [None]:
+			if prefix in sample_counts:
+				sys.stderr.write("%s: %s sequences, %s with passing tags\n" % 
+								 (prefix or 'undetermined', sample_counts[prefix][0], sample_counts[prefix][1]))
+		write_sample_counts(o.outfile + '_samples.txt', prefixes, sample_counts, 
+							['pairs', 'passing', 'missing_spacer', 'bad_tag'])
 
 	if o.tagstats:
-		read_data_file = open(o.outfile + '_data.txt', 'w')
-		sscs_count = 0
-		dcs_count = 0
-		dcs_tags_list = []
-		family_size_dict, total_tags = tag_stats(barcode_dict.values(), o.outfile)
-
-		for tag in barcode_dict.keys():
-
-			if barcode_dict[tag] >= 3:
-				sscs_count += 1
-
-				if tag[o.taglen:] + tag[:o.taglen] in barcode_dict and barcode_dict[tag[o.taglen:] + tag[:o.taglen]] >= 3:
-					dcs_count += 1
-
-					if o.reduce and tag not in dcs_tags_list:
-						dcs_tags_list.append(tag)
-						dcs_tags_list.append(tag[o.taglen:] + tag[:o.taglen])
-
-		read_data_file.write('# Passing Reads\t# SSCS Reads\t# DCS Reads\tSSCS:DCS\n%d\t%d\t%d\t%f\n'
-							 % (goodreads, sscs_count, dcs_count, float(sscs_count)/float(dcs_count)))
-		read_data_file.close()
-
-		try:
-			import matplotlib
-			matplotlib.use('Agg')
-			import matplotlib.pyplot as plt
-
-			x_value = []
-			y_value = []
-
-			for family_size in sorted(family_size_dict.keys()):
-				x_value.append(family_size)
-				y_value.append(float(family_size_dict[family_size]) / float(total_tags))
-
-			plt.bar(x_value, y_value)
-			plt.xlabel('Family Size')
-			plt.ylabel('Proportion of Total Reads')
-			plt.savefig(o.outfile + '.png', bbox_inches='tight')
-
-			plt.bar(x_value, y_value)
-			plt.xlabel('Family Size')
-			plt.ylabel('Proportion of Total Reads')
-			plt.xlim([0,40])
-			plt.savefig(o.outfile + '.zoom.png', bbox_inches='tight')
-
-		except ImportError:
-			sys.stderr.write('matplotlib not present. Only tagstats file will be generated.')
-
-		if o.reduce:
-
-			read1_fastq = open(o.outfile + '.seq1.smi.fq', 'r')
-			read2_fastq = open(o.outfile + '.seq2.smi.fq', 'r')
-			read1_output = open(o.outfile + '.seq1.reduced.fq', 'w')
-			read2_output = open(o.outfile + '.seq2.reduced.fq', 'w')
-
-			for read1_title, read2_title, read1_seq, read2_seq, read1_qual, read2_qual in fastq_general_iterator(read1_fastq, read2_fastq):
+		for prefix in prefixes:
+			profiler.begin('tagstats')
+			sample_tagstats(prefix, sample_counts[prefix][1], barcode_counts[prefix])
+			profiler.end('tagstats')
 
-				if read1_title.split('|')[1].split('/')[0] in dcs_tags_list and read2_title.split('|')[1].split('/')[0] in dcs_tags_list:
-					read1_output.write('@%s\n%s\n+\n%s\n' % (read1_title, read1_seq, read1_qual))
-					read2_output.write('@%s\n%s\n+\n%s\n' % (read2_title, read2_seq, read2_qual))
+			if o.reduce:
+				profiler.begin('reduce')
+				reduce_reads(prefix, barcode_counts[prefix], o)
+				profiler.end('reduce')
 
-			read1_fastq.close()
-			read2_fastq.close()
-			read1_output.close()
-			read2_output.close()
+	profiler.stop()
 
 if __name__ == "__main__":
 	main()
@@ -22,40 +22,37 @@
 # @SRR1613972.1.1:1:length=101:1:1/1
 
 import sys
-import gzip
 import os.path
 from argparse import ArgumentParser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+from dsutils.fastq import fastq_input, fastq_records
+
 parser = ArgumentParser()
 parser.add_argument('--infile', dest = 'infile', 
-                    help = 'Input raw fastq file.  ', 
+                    help = 'Input raw fastq file, plain or gzipped.  ', 
                     required=True)
 parser.add_argument('--outfile', dest = 'outfile', 
                     help = 'Output fastq file.  ', 
                     required=True)
 o = parser.parse_args()
 
-if os.path.splitext(o.infile)[1] == ".gz":
-    infile = gzip.open(o.infile, 'r')
-else:
-    infile = open(o.infile, 'r')
+infile = fastq_input(o.infile)
 outfile = open(o.outfile, 'w')
 readsProcessed = 0
 pair=o.infile.split(".fastq")[0]
 pair=pair[len(pair)-1]
 
-for line in infile:
-    if '@' in line or '+' in line:
-        
-        readNum = line.split(' ')[0].split('.')[1]
-        repLine = "%s:%s:%s/%s\n" %(line.strip().replace(' ', ':'),readNum,readNum,pair)
-        outfile.write(repLine)
-        if '@' in line: 
-            readsProcessed += 1
-            if readsProcessed % 100000 == 0:
-                print("Reads Processed: %s" % readsProcessed)
-    else:
-        outfile.write(line)
+# Records are read whole, so quality lines starting with '@' or '+' are 
+# left alone.  The '+' line repeats the new name, as it repeats the old 
+# one in files from the SRA.
+for title, seq, qual in fastq_records(infile):
+    readNum = title.split(' ')[0].split('.')[1]
+    repName = "%s:%s:%s/%s" %(title.strip().replace(' ', ':'),readNum,readNum,pair)
+    outfile.write("@%s\n%s\n+%s\n%s\n" % (repName, seq, repName, qual))
+    readsProcessed += 1
+    if readsProcessed % 100000 == 0:
+        print("Reads Processed: %s" % readsProcessed)
     
 infile.close()
 outfile.close()
@@ -33,6 +33,11 @@ After this, further steps might include:
     Local realignment (such as with IndelRealigner from GATK 3.8)
     Variant calling
 
+--sample-sheet demultiplexes a multiplexed run while the tags are 
+    parsed: each read pair goes to the sample of the index in its BC 
+    tag (--index-tag), and every sample gets its own outputs, tagstats 
+    and checkpoint manifest, named by its prefix in the sheet.
+
 When doing variant calling, remember that, for Duplex Sequencing, 
     samples should not be considered diploid
 """
@@ -43,6 +48,10 @@ import pysam
 import gzip
 from argparse import ArgumentParser
 from collections import defaultdict
+from dsutils.checkpoint import (Manifest, GzipCommitWriter, fingerprints,
+                                resume_partial)
+from dsutils.profiling import add_profile_arguments, profiler_from_args
+from dsutils.samples import SampleSheet, read_sample_sheet, write_sample_counts
 
 class iteratorWrapper:
     def __init__(self, inIterator, finalValue):
@@ -120,145 +129,24 @@ def consensus_caller(input_reads, cutoff, tag, length_check):
 def qual_calc(qual_list):
     return [sum(qual_score) for qual_score in zip(*qual_list)]
 
-def main():
-    parser = ArgumentParser()
-    parser.add_argument(
-        '--input', 
-        dest = 'in_bam', 
-        required = True,
-        help = 'Path to unaligned, paired-end, bam file.'
-        )
-    parser.add_argument(
-        '--taglen', 
-        dest = 'tag_len', 
-        type = int, 
-        default = 12,
-        help = 'Length in bases of the duplex tag sequence.[12]'
-        )
-    parser.add_argument(
-        '--spacerlen', 
-        dest = 'spcr_len', 
-        type = int, 
-        default = 5,
-        help = (f'Length in bases of the spacer sequence between'
-                f'duplex tag and the start of target DNA. [5]'
-                )
-        )
-    parser.add_argument(
-        "--loclen", 
-        dest = 'loc_len', 
-        type = int, 
-        default = 0, 
-        action = "store",
-        help = (f"Number of base pairs to add to barcode for location "
-                f"specificity.  Bases are not removed from read.  [0]"
-                )
-        )
-    parser.add_argument(
-        "--tagstats", 
-        dest = 'tagstats', 
-        action = "store_true",
-        help = "Output tagstats file"
-        )
-    parser.add_argument(
-        '--minmem', 
-        dest = 'minmem', 
-        type = int, 
-        default = 3,
-        help = "Minimum number of reads allowed to comprise a consensus. [3]"
-        )
-    parser.add_argument(
-        '--maxmem', 
-        dest = 'maxmem', 
-        type = int, 
-        default = 200,
-        help = "Maximum number of reads allowed to comprise a consensus. [200]"
-                        )
-    parser.add_argument(
-        '--cutoff', 
-        dest = 'cutoff', 
-        type = float, 
-        default = .7,
-        help = (f"Percentage of nucleotides at a given position "
-                f"in a read that must be identical in order "
-                f"for a consensus to be called at that position. "
-                f"[0.7]"
-                )
-        )
-    parser.add_argument(
-        '--Ncutoff', 
-        dest = 'Ncutoff', 
-        type = float, 
-        default = 1,
-        help = (f"With --filt 'n', maximum fraction of Ns allowed in a "
-                f"consensus [1.0]"
-                )
-        )
-    parser.add_argument(
-        '--write-sscs', 
-        dest = 'write_sscs', 
-        action = "store_true",
-        help = "Print the SSCS reads to file in FASTQ format"
-        )
-    parser.add_argument(
-        '--without-dcs', 
-        dest = 'without_dcs', 
-        action = "store_true",
-        help = "Don't print final DCS reads"
-        )
-    parser.add_argument(
-        "--rep_filt", 
-        action = "store",  
-        type = int, 
-        dest = 'rep_filt',
-        default = 9,
-        help = (f"Remove tags with homomeric runs of nucleotides of length "
-                f"x. [9]"
-                )
-        )
-    parser.add_argument(
-        '--prefix', 
-        dest = 'prefix', 
-        type = str, 
-        required = True,
-        help = "Sample name to uniquely identify samples"
-        )
-    o = parser.parse_args()
-
-    dummy_header = {'HD': {'VN': '1.0'}, 
-                    'SQ': [{'LN': 1575, 'SN': 'chr1'}, 
-                           {'LN': 1584, 'SN': 'chr2'}
-                           ]
-                    }
-    in_bam_file = pysam.AlignmentFile(o.in_bam, "rb", check_sq=False)
-    temp_bam = pysam.AlignmentFile(f"{o.prefix}.temp.bam", 
-                                   'wb', 
-                                   header=dummy_header
-                                   )
-    paired_end_count = 1
 
-    if o.write_sscs is True:
-
-        read1_sscs_fq_file = gzip.open(f"{o.prefix}_read1_sscs.fq.gz", 'wt')
-        read2_sscs_fq_file = gzip.open(f"{o.prefix}_read2_sscs.fq.gz", 'wt')
-
-    if o.without_dcs is False:
-        read1_dcs_fq_file = gzip.open(f"{o.prefix}_read1_dcs.fq.gz", 'wt')
-        read2_dcs_fq_file = gzip.open(f"{o.prefix}_read2_dcs.fq.gz", 'wt')
-
-    '''This block of code takes an unaligned bam file, extracts the tag 
-    sequences from the reads, and converts them to to "ab/ba" format 
-    where 'a' and 'b' are the tag sequences from Read 1 and Read 2, 
-    respectively. Conversion occurs by putting the tag with the "lesser" 
-    value in front of the tag with the "higher" value. The original 
-    tag orientation is denoted by appending #ab or #ba to the end of 
-    the tag. After conversion, the resulting temporary bam file is then
-    sorted by read name.
+def parse_tags(o, temp_bams, sample_sheet=None):
+    '''Move the tags of the read pairs of the unaligned bam file to the 
+    read names, as described in main, and write them to temp_bams, which
+    maps each output prefix to a bam file.  Without a sample sheet all 
+    the pairs go to o.prefix; with one, each pair goes to the sample of 
+    the index of read 1 (in its o.index_tag tag), and the pairs of 
+    undetermined samples are dropped.  Returns, for each prefix (None 
+    for the dropped pairs), the number of pairs and the number of pairs
+    written.
     '''
     tl = o.tag_len
     sl = o.spcr_len
     ll = o.loc_len
-    print("Parsing tags...")
+    prefix = o.prefix
+    counts = defaultdict(lambda: [0, 0])
+    paired_end_count = 1
+    in_bam_file = pysam.AlignmentFile(o.in_bam, "rb", check_sq=False)
 
     for line in in_bam_file.fetch(until_eof=True):
 
@@ -268,11 +156,23 @@ def main():
             temp_read1_entry.query_name = line.query_name
             temp_read1_entry.query_sequence = line.query_alignment_sequence
             temp_read1_entry.query_qualities = line.query_alignment_qualities
+            if sample_sheet is not None:
+                index = (line.get_tag(o.index_tag)
+                         if line.has_tag(o.index_tag) else ''
+                         )
 
         if paired_end_count % 2 == 0:
 
+            if sample_sheet is not None:
+                prefix = sample_sheet.sample(index)
+            counts[prefix][0] += 1
+            if prefix is None:
+                # Undetermined sample
+                paired_end_count += 1
+                continue
+            temp_bam = temp_bams[prefix]
             temp_bam_entry = pysam.AlignedSegment()
-            
+        
             tag1 = (
                 f"{temp_read1_entry.query_sequence[: tl]}"
                 f"{temp_read1_entry.query_sequence[tl + sl : tl + sl + ll]}"
@@ -281,7 +181,7 @@ def main():
                 f"{line.query_sequence[: tl]}"
                 f"{line.query_sequence[tl + sl : tl + sl + ll]}"
                 )
-            
+        
             if tag1 > tag2:
                 temp_bam_entry.query_name = tag1 + tag2 + '#ab'
 
@@ -293,6 +193,7 @@ def main():
                 continue
 
             # Write entries for Read 1
+            counts[prefix][1] += 1
             temp_bam_entry.query_name += ":1"
             temp_bam_entry.query_sequence = (
                 f"{temp_read1_entry.query_sequence[o.tag_len + o.spcr_len:]}"
@@ -319,234 +220,362 @@ def main():
         paired_end_count += 1
 
     in_bam_file.close()
-    temp_bam.close()
+    return counts
 
-    print("Sorting reads on tag sequence...")
 
-    pysam.sort("-n", o.prefix + ".temp.bam", "-o", o.prefix + ".temp.sort.bam")
-    # Sort by read name, which will be the tag sequence in this case.
-    os.remove(o.prefix + ".temp.bam")
+def sample_consensuses(o, prefix, checkpoint, sort_done, profiler):
+    '''Sort the parsed reads of one sample (o.prefix, without a sample 
+    sheet) on their tags, make its consensus reads, and write its 
+    tagstats, all with that sample's checkpoint manifest.
+    '''
+    temp_bam_name = f"{prefix}.temp.bam"
+    sort_bam_name = f"{prefix}.temp.sort.bam"
+
+    if sort_done:
+        print("Reads already sorted on tag sequence; skipping.")
+    else:
+        print("Sorting reads on tag sequence...")
+        profiler.begin('sort')
+        checkpoint.start('sort', checkpoint.stage('tags').get('outputs', {}))
+
+        pysam.sort("-n", temp_bam_name,
+                   "-o", f"{sort_bam_name}.partial",
+                   "-O", "bam"
+                   )
+        # Sort by read name, which will be the tag sequence in this case.
+        os.replace(f"{sort_bam_name}.partial", sort_bam_name)
+        checkpoint.finish('sort', [sort_bam_name])
+        os.remove(temp_bam_name)
+        profiler.end('sort')
 
     '''Extracting tags and sorting based on tag sequence is complete. 
     This block of code now performs the consensus calling on the tag 
     families in the temporary name sorted bam file.
     '''
     
-    seq_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
-    qual_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
+    out_names = []
+    if o.write_sscs is True:
+        out_names += [f"{prefix}_read1_sscs.fq.gz",
+                      f"{prefix}_read2_sscs.fq.gz"
+                      ]
+    if o.without_dcs is False:
+        out_names += [f"{prefix}_read1_dcs.fq.gz",
+                      f"{prefix}_read2_dcs.fq.gz"
+                      ]
+    fam_size_name = f"{prefix}.checkpoint.famsizes.gz"
+    consensus_inputs = checkpoint.stage('sort').get('outputs', {})
+    consensus_done = (checkpoint.done('consensus', consensus_inputs)
+                      and checkpoint.outputs_intact('consensus')
+                      )
+    progress = {}
+    # A run that stopped before its first commit has no sizes: it starts
+    # consensus calling again from scratch.
+    saved_sizes = checkpoint.stage('consensus').get('sizes')
+    if (checkpoint.started('consensus', consensus_inputs)
+            and not checkpoint.stage('consensus')['done']
+            and saved_sizes is not None
+            and all(os.path.exists(f"{name}.partial")
+                    for name in saved_sizes
+                    )
+            ):
+        progress = checkpoint.stage('consensus')
+
     fam_size_x_axis = []
     fam_size_y_axis = []
-
-    read1_dcs_len = 0
-    read2_dcs_len = 0
-    in_bam_file = pysam.AlignmentFile(
-        f"{o.prefix}.temp.sort.bam", "rb", check_sq=False
-        )
-    first_line = next(in_bam_file)
-    
-    FinalValue = pysam.AlignedSegment()
-    FinalValue.query_name = "FinalValue#ab:1"
-    
-    seq_dict[first_line.query_name.split('#')[1]].append(
-        first_line.query_sequence
-        )
-    qual_dict[first_line.query_name.split('#')[1]].append(
-        list(first_line.query_qualities)
-        )
     tag_count_dict = defaultdict(lambda: 0)
 
-    print("Creating consensus reads...")
-
-    for line in iteratorWrapper(in_bam_file.fetch(until_eof=True), FinalValue):
-        tag = first_line.query_name.split('#')[0]
-        subtag_order = first_line.query_name.split('#')[1]
-        if line.query_name.split('#')[0] == tag:
-            seq_dict[line.query_name.split('#')[1]].append(
-                line.query_sequence
-                )
-            qual_dict[line.query_name.split('#')[1]].append(
-                list(line.query_qualities)
-                )
-
+    if consensus_done or progress:
+        # Pick up the counts for the tag families already done.
+        saved = checkpoint.stage('consensus')
+        for size, count in saved['tag_counts'].items():
+            tag_count_dict[int(size)] = count
+        if consensus_done:
+            fam_size_file = gzip.open(fam_size_name, 'rt')
+        else:
+            fam_size_file = resume_partial(fam_size_name,
+                                           saved['sizes'][fam_size_name]
+                                           )
+            fam_size_file.close()
+            fam_size_file = gzip.open(f"{fam_size_name}.partial", 'rt')
+        for fam_size_line in fam_size_file:
+            x_size, y_size = fam_size_line.split()
+            fam_size_x_axis.append(int(x_size))
+            fam_size_y_axis.append(int(y_size))
+        fam_size_file.close()
+
+    if consensus_done:
+        print("Consensus reads already made; skipping.")
+    else:
+        if progress:
+            sizes = progress['sizes']
+            families_done = progress['families']
         else:
+            sizes = {}
+            families_done = 0
+            checkpoint.start('consensus', consensus_inputs)
+        if o.checkpoint:
+            out_files = {name: GzipCommitWriter(name, sizes.get(name, 0))
+                         for name in out_names + [fam_size_name]
+                         }
+            fam_size_file = out_files[fam_size_name]
+        else:
+            out_files = {name: gzip.open(name, 'wt') for name in out_names}
+        if o.write_sscs is True:
+            read1_sscs_fq_file = out_files[f"{prefix}_read1_sscs.fq.gz"]
+            read2_sscs_fq_file = out_files[f"{prefix}_read2_sscs.fq.gz"]
+        if o.without_dcs is False:
+            read1_dcs_fq_file = out_files[f"{prefix}_read1_dcs.fq.gz"]
+            read2_dcs_fq_file = out_files[f"{prefix}_read2_dcs.fq.gz"]
+
+        seq_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
+        qual_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
+
+        read1_dcs_len = 0
+        read2_dcs_len = 0
+        in_bam_file = pysam.AlignmentFile(sort_bam_name, "rb", check_sq=False)
+        if progress:
+            print(f"Resuming after {families_done} tag families...")
+            in_bam_file.seek(progress['offset'])
+        first_line = next(in_bam_file)
+        line_offset = in_bam_file.tell()
+
+        FinalValue = pysam.AlignedSegment()
+        FinalValue.query_name = "FinalValue#ab:1"
+
+        seq_dict[first_line.query_name.split('#')[1]].append(
+            first_line.query_sequence
+            )
+        qual_dict[first_line.query_name.split('#')[1]].append(
+            list(first_line.query_qualities)
+            )
+
+        print("Creating consensus reads...")
+        profiler.begin('consensus')
+
+        for line in iteratorWrapper(in_bam_file.fetch(until_eof=True), FinalValue):
+            tag = first_line.query_name.split('#')[0]
+            subtag_order = first_line.query_name.split('#')[1]
+            if line.query_name.split('#')[0] == tag:
+                seq_dict[line.query_name.split('#')[1]].append(
+                    line.query_sequence
+                    )
+                qual_dict[line.query_name.split('#')[1]].append(
+                    list(line.query_qualities)
+                    )
 
-            if (len(seq_dict['ab:1']) != len(seq_dict['ab:2']) 
-                    or len(seq_dict['ba:1']) != len(seq_dict['ba:2'])
-                    ):
-                raise Exception(f'ERROR: Read counts for Read1 and Read 2 do '
-                                f'not match for tag {tag}'
-                                )
+            else:
 
-            for tag_subtype in seq_dict.keys():
-
-                if len(seq_dict[tag_subtype]) > 0:
-                    tag_count_dict[len(seq_dict[tag_subtype])] += 1
-
-                if len(seq_dict[tag_subtype]) < o.minmem:
-                    seq_dict[tag_subtype] = []
-                    qual_dict[tag_subtype] = []
-
-                elif o.minmem <= len(seq_dict[tag_subtype]) <= o.maxmem:  
-                    # Tag types w/o reads should not be submitted as long as 
-                    # minmem is > 0
-                    seq_dict[tag_subtype] = [
-                        consensus_caller(seq_dict[tag_subtype], 
-                                        o.cutoff, 
-                                        tag, 
-                                        True
-                                        ),
-                        str(len(seq_dict[tag_subtype]))
-                        ]
-                    qual_dict[tag_subtype] = qual_calc(qual_dict[tag_subtype])
-
-                elif len(seq_dict[tag_subtype]) > o.maxmem:
-                    seq_dict[tag_subtype] = [
-                        consensus_caller(seq_dict[tag_subtype][:o.maxmem], 
-                                         o.cutoff, 
-                                         tag, 
-                                         True
-                                         ),
-                        str(len(seq_dict[tag_subtype]))
-                        ]
-                    qual_dict[tag_subtype] = qual_calc(qual_dict[tag_subtype])
-
-            if o.write_sscs is True:
-
-                if len(seq_dict['ab:1']) != 0 and len(seq_dict['ab:2']) != 0:
-                    corrected_qual_score = map(
-                        lambda x: x if x < 41 else 41, qual_dict['ab:1']
-                        )
-                    corrQualStr = ''.join(
-                        chr(x + 33) for x in corrected_qual_score
-                        )
-                    read1_sscs_fq_file.write(f"@{tag}#ab/1\n"
-                                             f"{seq_dict['ab:1'][0]}\n"
-                                             f"+{seq_dict['ab:1'][1]}\n"
-                                             f"{corrQualStr}\n"
-                                             )
-
-                    corrected_qual_score = map(
-                        lambda x: x if x < 41 else 41, qual_dict['ab:2']
-                        )
-                    corrQualStr = ''.join(
-                        chr(x + 33) for x in corrected_qual_score
-                        )
-                    read2_sscs_fq_file.write(f"@{tag}#ab/2\n"
-                                             f"{seq_dict['ab:2'][0]}\n"
-                                             f"+{seq_dict['ab:2'][1]}\n"
-                                             f"{corrQualStr}\n"
-                                             )
-
-                if len(seq_dict['ba:1']) != 0 and len(seq_dict['ba:2']) != 0:
-                    corrected_qual_score = map(
-                        lambda x: x if x < 41 else 41, qual_dict['ba:1']
-                        )
-                    corrQualStr = ''.join(
-                        chr(x + 33) for x in corrected_qual_score
-                        )
-                    read1_sscs_fq_file.write(f"@{tag}#ba/1\n"
-                                             f"{seq_dict['ba:1'][0]}\n"
-                                             f"+{seq_dict['ba:1'][1]}\n"
-                                             f"{corrQualStr}\n"
-                                             )
-
-                    corrected_qual_score = map(
-                        lambda x: x if x < 41 else 41, qual_dict['ba:2']
-                        )
-                    corrQualStr = ''.join(
-                        chr(x + 33) for x in corrected_qual_score
-                        )
-                    read2_sscs_fq_file.write(f"@{tag}#ba/2\n"
-                                             f"{seq_dict['ba:2'][0]}\n"
-                                             f"+{seq_dict['ba:2'][1]}\n"
-                                             f"{corrQualStr}\n"
-                                             )
-
-            if o.without_dcs is False:
-
-                if len(seq_dict['ab:1']) != 0 and len(seq_dict['ba:2']) != 0:
-                    dcs_read_1 = [
-                        consensus_caller(
-                            [seq_dict['ab:1'][0], seq_dict['ba:2'][0]], 
-                            1, 
-                            tag, 
-                            False
-                            ),
-                        seq_dict['ab:1'][1], seq_dict['ba:2'][1]
-                        ]
-                    dcs_read_1_qual = map(
-                        lambda x: x if x < 41 else 41, 
-                        qual_calc([qual_dict['ab:1'], qual_dict['ba:2']])
-                        )
-                    read1_dcs_len = len(dcs_read_1)
-                    fam_size_x_axis.append(int(seq_dict['ab:1'][1]))
-                    fam_size_y_axis.append(int(seq_dict['ba:2'][1]))
-
-                    if dcs_read_1.count('N')/float(read1_dcs_len) > o.Ncutoff:
-                        dcs_read_1 = 'N' * read1_dcs_len
-                        dcs_read_1_qual = '!' * read1_dcs_len
-
-                if len(seq_dict['ba:1']) != 0 and len(seq_dict['ab:2']) != 0:
-                    dcs_read_2 = [
-                        consensus_caller(
-                            [seq_dict['ba:1'][0], seq_dict['ab:2'][0]], 
-                            1, 
-                            tag, 
-                            False
-                            ),
-                        seq_dict['ba:1'][1], seq_dict['ab:2'][1]
-                        ]
-                    dcs_read_2_qual = map(
-                        lambda x: x if x < 41 else 41, 
-                        qual_calc([qual_dict['ba:1'], qual_dict['ab:2']])
-                        )
-                    read2_dcs_len = len(dcs_read_2)
-
-                    if dcs_read_2.count('N')/float(read1_dcs_len) > o.Ncutoff:
-                        dcs_read_2 = 'N' * read1_dcs_len
-                        dcs_read_2_qual = '!' * read2_dcs_len
-
-                if (read1_dcs_len != 0 
-                        and read2_dcs_len != 0 
-                        and tag.count('N') == 0 
-                        and 'A' * o.rep_filt not in tag 
-                        and 'C' * o.rep_filt not in tag 
-                        and 'G' * o.rep_filt not in tag 
-                        and 'T' * o.rep_filt not in tag
+                if (len(seq_dict['ab:1']) != len(seq_dict['ab:2']) 
+                        or len(seq_dict['ba:1']) != len(seq_dict['ba:2'])
                         ):
-                    r1QualStr = ''.join(chr(x + 33) for x in dcs_read_1_qual)
-                    r2QualStr = ''.join(chr(x + 33) for x in dcs_read_2_qual)
-                    read1_dcs_fq_file.write(
-                        f"@{tag}/1\n{dcs_read_1[0]}\n"
-                        f"+{dcs_read_1[1]}:{dcs_read_1[2]}\n"
-                        f"{r1QualStr}\n"
-                        )
-                    read2_dcs_fq_file.write(
-                        f"@{tag}/2\n{dcs_read_2[0]}\n"
-                        f"+{dcs_read_2[1]}:{dcs_read_2[2]}\n"
-                        f"{r2QualStr}\n"
-                        )
+                    raise Exception(f'ERROR: Read counts for Read1 and Read 2 do '
+                                    f'not match for tag {tag}'
+                                    )
+
+                for tag_subtype in seq_dict.keys():
+
+                    if len(seq_dict[tag_subtype]) > 0:
+                        tag_count_dict[len(seq_dict[tag_subtype])] += 1
+
+                    if len(seq_dict[tag_subtype]) < o.minmem:
+                        seq_dict[tag_subtype] = []
+                        qual_dict[tag_subtype] = []
+
+                    elif o.minmem <= len(seq_dict[tag_subtype]) <= o.maxmem:  
+                        # Tag types w/o reads should not be submitted as long as 
+                        # minmem is > 0
+                        seq_dict[tag_subtype] = [
+                            consensus_caller(seq_dict[tag_subtype], 
+                                            o.cutoff, 
+                                            tag, 
+                                            True
+                                            ),
+                            str(len(seq_dict[tag_subtype]))
+                            ]
+                        qual_dict[tag_subtype] = qual_calc(qual_dict[tag_subtype])
+
+                    elif len(seq_dict[tag_subtype]) > o.maxmem:
+                        seq_dict[tag_subtype] = [
+                            consensus_caller(seq_dict[tag_subtype][:o.maxmem], 
+                                             o.cutoff, 
+                                             tag, 
+                                             True
+                                             ),
+                            str(len(seq_dict[tag_subtype]))
+                            ]
+                        qual_dict[tag_subtype] = qual_calc(qual_dict[tag_subtype])
+
+                if o.write_sscs is True:
+
+                    if len(seq_dict['ab:1']) != 0 and len(seq_dict['ab:2']) != 0:
+                        corrected_qual_score = map(
+                            lambda x: x if x < 41 else 41, qual_dict['ab:1']
+                            )
+                        corrQualStr = ''.join(
+                            chr(x + 33) for x in corrected_qual_score
+                            )
+                        read1_sscs_fq_file.write(f"@{tag}#ab/1\n"
+                                                 f"{seq_dict['ab:1'][0]}\n"
+                                                 f"+{seq_dict['ab:1'][1]}\n"
+                                                 f"{corrQualStr}\n"
+                                                 )
+
+                        corrected_qual_score = map(
+                            lambda x: x if x < 41 else 41, qual_dict['ab:2']
+                            )
+                        corrQualStr = ''.join(
+                            chr(x + 33) for x in corrected_qual_score
+                            )
+                        read2_sscs_fq_file.write(f"@{tag}#ab/2\n"
+                                                 f"{seq_dict['ab:2'][0]}\n"
+                                                 f"+{seq_dict['ab:2'][1]}\n"
+                                                 f"{corrQualStr}\n"
+                                                 )
+
+                    if len(seq_dict['ba:1']) != 0 and len(seq_dict['ba:2']) != 0:
+                        corrected_qual_score = map(
+                            lambda x: x if x < 41 else 41, qual_dict['ba:1']
+                            )
+                        corrQualStr = ''.join(
+                            chr(x + 33) for x in corrected_qual_score
+                            )
+                        read1_sscs_fq_file.write(f"@{tag}#ba/1\n"
+                                                 f"{seq_dict['ba:1'][0]}\n"
+                                                 f"+{seq_dict['ba:1'][1]}\n"
+                                                 f"{corrQualStr}\n"
+                                                 )
+
+                        corrected_qual_score = map(
+                            lambda x: x if x < 41 else 41, qual_dict['ba:2']
+                            )
+                        corrQualStr = ''.join(
+                            chr(x + 33) for x in corrected_qual_score
+                            )
+                        read2_sscs_fq_file.write(f"@{tag}#ba/2\n"
+                                                 f"{seq_dict['ba:2'][0]}\n"
+                                                 f"+{seq_dict['ba:2'][1]}\n"
+                                                 f"{corrQualStr}\n"
+                                                 )
+
+                if o.without_dcs is False:
+
+                    if len(seq_dict['ab:1']) != 0 and len(seq_dict['ba:2']) != 0:
+                        dcs_read_1 = [
+                            consensus_caller(
+                                [seq_dict['ab:1'][0], seq_dict['ba:2'][0]], 
+                                1, 
+                                tag, 
+                                False
+                                ),
+                            seq_dict['ab:1'][1], seq_dict['ba:2'][1]
+                            ]
+                        dcs_read_1_qual = map(
+                            lambda x: x if x < 41 else 41, 
+                            qual_calc([qual_dict['ab:1'], qual_dict['ba:2']])
+                            )
+                        read1_dcs_len = len(dcs_read_1)
+                        fam_size_x_axis.append(int(seq_dict['ab:1'][1]))
+                        fam_size_y_axis.append(int(seq_dict['ba:2'][1]))
+                        if o.checkpoint:
+                            fam_size_file.write(f"{seq_dict['ab:1'][1]}\t"
+                                                f"{seq_dict['ba:2'][1]}\n"
+                                                )
+
+                        if dcs_read_1.count('N')/float(read1_dcs_len) > o.Ncutoff:
+                            dcs_read_1 = 'N' * read1_dcs_len
+                            dcs_read_1_qual = '!' * read1_dcs_len
+
+                    if len(seq_dict['ba:1']) != 0 and len(seq_dict['ab:2']) != 0:
+                        dcs_read_2 = [
+                            consensus_caller(
+                                [seq_dict['ba:1'][0], seq_dict['ab:2'][0]], 
+                                1, 
+                                tag, 
+                                False
+                                ),
+                            seq_dict['ba:1'][1], seq_dict['ab:2'][1]
+                            ]
+                        dcs_read_2_qual = map(
+                            lambda x: x if x < 41 else 41, 
+                            qual_calc([qual_dict['ba:1'], qual_dict['ab:2']])
+                            )
+                        read2_dcs_len = len(dcs_read_2)
+
+                        if dcs_read_2.count('N')/float(read1_dcs_len) > o.Ncutoff:
+                            dcs_read_2 = 'N' * read1_dcs_len
+                            dcs_read_2_qual = '!' * read2_dcs_len
+
+                    if (read1_dcs_len != 0 
+                            and read2_dcs_len != 0 
+                            and tag.count('N') == 0 
+                            and 'A' * o.rep_filt not in tag 
+                            and 'C' * o.rep_filt not in tag 
+                            and 'G' * o.rep_filt not in tag 
+                            and 'T' * o.rep_filt not in tag
+                            ):
+                        r1QualStr = ''.join(chr(x + 33) for x in dcs_read_1_qual)
+                        r2QualStr = ''.join(chr(x + 33) for x in dcs_read_2_qual)
+                        read1_dcs_fq_file.write(
+                            f"@{tag}/1\n{dcs_read_1[0]}\n"
+                            f"+{dcs_read_1[1]}:{dcs_read_1[2]}\n"
+                            f"{r1QualStr}\n"
+                            )
+                        read2_dcs_fq_file.write(
+                            f"@{tag}/2\n{dcs_read_2[0]}\n"
+                            f"+{dcs_read_2[1]}:{dcs_read_2[2]}\n"
+                            f"{r2QualStr}\n"
+                            )
             
-            if line != FinalValue:
+                families_done += 1
+                if (o.checkpoint
+                        and line != FinalValue
+                        and families_done % o.checkpoint_every == 0
+                        ):
+                    # Everything up to this family is written; the next
+                    # family starts with line.
+                    checkpoint.commit(
+                        'consensus',
+                        families = families_done,
+                        offset = line_offset,
+                        sizes = {name: out_files[name].commit()
+                                 for name in out_files
+                                 },
+                        tag_counts = dict(tag_count_dict)
+                        )
+
+                if line != FinalValue:
                 
-                # reset conditions for next tag family
-                first_line = line
-                seq_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
-                qual_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
-                read1_dcs_len = 0
-                read2_dcs_len = 0
-                dcs_read_1 = ''
-                dcs_read_2 = ''
-
-                seq_dict[line.query_name.split('#')[1]].append(line.query_sequence)
-                # Now add initializing data for new tag
-                qual_dict[first_line.query_name.split('#')[1]].append(
-                    list(first_line.query_qualities)
-                    )
-    
+                    # reset conditions for next tag family
+                    first_line = line
+                    seq_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
+                    qual_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
+                    read1_dcs_len = 0
+                    read2_dcs_len = 0
+                    dcs_read_1 = ''
+                    dcs_read_2 = ''
+
+                    seq_dict[line.query_name.split('#')[1]].append(line.query_sequence)
+                    # Now add initializing data for new tag
+                    qual_dict[first_line.query_name.split('#')[1]].append(
+                        list(first_line.query_qualities)
+                        )
+            if o.checkpoint:
+                line_offset = in_bam_file.tell()
+
+        in_bam_file.close()
+        for out_file in out_files.values():
+            out_file.close()
+        checkpoint.finish('consensus',
+                          out_names + ([fam_size_name] if o.checkpoint else []),
+                          families = families_done,
+                          tag_counts = dict(tag_count_dict)
+                          )
+        profiler.end('consensus')
+
 # Try to plot the tag family sizes
     if o.tagstats is True:
-        tag_stats_file = open(o.prefix + ".tagstats.txt", 'w')
+        profiler.begin('tagstats')
+        tag_stats_file = open(prefix + ".tagstats.txt", 'w')
 
         x_value = []
         y_value = []
@@ -575,7 +604,7 @@ def main():
             plt.bar(x_value, y_value)
             plt.xlabel('Family Size')
             plt.ylabel('Proportion of Total Reads')
-            plt.savefig(f"{o.prefix}family_size.png", 
+            plt.savefig(f"{prefix}family_size.png", 
                         bbox_inches='tight'
                         )
             if len(fam_size_x_axis) != 0:
@@ -585,9 +614,11 @@ def main():
                 plt.ylabel('Family size for BA:2')
                 plt.xlim(0, max(fam_size_x_axis))
                 plt.ylim(0, max(fam_size_y_axis))
-                plt.savefig(f"{o.prefix}fam_size_relation.png", 
+                plt.savefig(f"{prefix}fam_size_relation.png", 
                             bbox_inches='tight'
                             )
+            # Start the next sample's plots afresh
+            plt.close('all')
 
         except ImportError:
             sys.stderr.write(
@@ -595,6 +626,267 @@ def main():
                 )
 
         tag_stats_file.close()
+        profiler.end('tagstats')
+
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument(
+        '--input', 
+        dest = 'in_bam', 
+        required = True,
+        help = 'Path to unaligned, paired-end, bam file.'
+        )
+    parser.add_argument(
+        '--taglen', 
+        dest = 'tag_len', 
+        type = int, 
+        default = 12,
+        help = 'Length in bases of the duplex tag sequence.[12]'
+        )
+    parser.add_argument(
+        '--spacerlen', 
+        dest = 'spcr_len', 
+        type = int, 
+        default = 5,
+        help = (f'Length in bases of the spacer sequence between'
+                f'duplex tag and the start of target DNA. [5]'
+                )
+        )
+    parser.add_argument(
+        "--loclen", 
+        dest = 'loc_len', 
+        type = int, 
+        default = 0, 
+        action = "store",
+        help = (f"Number of base pairs to add to barcode for location "
+                f"specificity.  Bases are not removed from read.  [0]"
+                )
+        )
+    parser.add_argument(
+        "--tagstats", 
+        dest = 'tagstats', 
+        action = "store_true",
+        help = "Output tagstats file"
+        )
+    parser.add_argument(
+        '--minmem', 
+        dest = 'minmem', 
+        type = int, 
+        default = 3,
+        help = "Minimum number of reads allowed to comprise a consensus. [3]"
+        )
+    parser.add_argument(
+        '--maxmem', 
+        dest = 'maxmem', 
+        type = int, 
+        default = 200,
+        help = "Maximum number of reads allowed to comprise a consensus. [200]"
+                        )
+    parser.add_argument(
+        '--cutoff', 
+        dest = 'cutoff', 
+        type = float, 
+        default = .7,
+        help = (f"Percentage of nucleotides at a given position "
+                f"in a read that must be identical in order "
+                f"for a consensus to be called at that position. "
+                f"[0.7]"
+                )
+        )
+    parser.add_argument(
+        '--Ncutoff', 
+        dest = 'Ncutoff', 
+        type = float, 
+        default = 1,
+        help = (f"With --filt 'n', maximum fraction of Ns allowed in a "
+                f"consensus [1.0]"
+                )
+        )
+    parser.add_argument(
+        '--write-sscs', 
+        dest = 'write_sscs', 
+        action = "store_true",
+        help = "Print the SSCS reads to file in FASTQ format"
+        )
+    parser.add_argument(
+        '--without-dcs', 
+        dest = 'without_dcs', 
+        action = "store_true",
+        help = "Don't print final DCS reads"
+        )
+    parser.add_argument(
+        "--rep_filt", 
+        action = "store",  
+        type = int, 
+        dest = 'rep_filt',
+        default = 9,
+        help = (f"Remove tags with homomeric runs of nucleotides of length "
+                f"x. [9]"
+                )
+        )
+    parser.add_argument(
+        '--prefix', 
+        dest = 'prefix', 
+        type = str, 
+        required = True,
+        help = "Sample name to uniquely identify samples"
+        )
+    parser.add_argument(
+        '--no-checkpoint',
+        dest = 'checkpoint',
+        action = "store_false",
+        help = (f"Don't record progress in PREFIX.checkpoint.json, "
+                f"and don't resume an interrupted run"
+                )
+        )
+    parser.add_argument(
+        '--checkpoint-every',
+        dest = 'checkpoint_every',
+        type = int,
+        default = 100000,
+        help = (f"Number of tag families between commits of the "
+                f"consensus stage. [100000]"
+                )
+        )
+    parser.add_argument(
+        '--sample-sheet',
+        dest = 'sample_sheet',
+        help = (f"Demultiplex the reads while parsing tags: a file with the "
+                f"index sequence and output prefix of each sample, which "
+                f"replaces --prefix for that sample's outputs.  Pair counts "
+                f"per sample go to PREFIX.samples.txt"
+                )
+        )
+    parser.add_argument(
+        '--index-tag',
+        dest = 'index_tag',
+        default = 'BC',
+        help = "Tag holding the sample index of each read. [BC]"
+        )
+    parser.add_argument(
+        '--index-mismatches',
+        dest = 'index_mismatches',
+        type = int,
+        default = 1,
+        help = "Mismatches allowed between an index and the sample sheet. [1]"
+        )
+    parser.add_argument(
+        '--undetermined',
+        dest = 'undetermined',
+        help = (f"Output prefix for the reads whose index matches no "
+                f"sample; without it they are dropped"
+                )
+        )
+    add_profile_arguments(parser, ['tags', 'sort', 'consensus', 'tagstats'])
+    o = parser.parse_args()
+    profiler = profiler_from_args(o, o.prefix)
+    profiler.start()
+
+    params = {key: getattr(o, key) for key in (
+        'tag_len', 'spcr_len', 'loc_len', 'minmem', 'maxmem', 'cutoff',
+        'Ncutoff', 'write_sscs', 'without_dcs', 'rep_filt'
+        )}
+    if o.sample_sheet is None:
+        sample_sheet = None
+        prefixes = [o.prefix]
+    else:
+        samples = read_sample_sheet(o.sample_sheet)
+        sample_sheet = SampleSheet(samples,
+                                   o.index_mismatches,
+                                   o.undetermined
+                                   )
+        prefixes = sample_sheet.prefixes
+        params.update(samples = [list(sample) for sample in samples],
+                      index_tag = o.index_tag,
+                      index_mismatches = o.index_mismatches,
+                      undetermined = o.undetermined
+                      )
+
+    '''Each stage records its input fingerprints, its outputs, and (for
+    consensus calling) the last committed tag family in the checkpoint
+    manifest.  Rerunning with the same input and parameters skips the
+    stages that finished and resumes consensus calling from the last
+    commit.  Outputs are written as .partial files and only renamed
+    when their stage finishes.  With a sample sheet each sample has its
+    own manifest, and the tags of all the samples are parsed again
+    unless that is done for every one of them.
+    '''
+    checkpoints = {}
+    tags_done = {}
+    sort_done = {}
+    tags_inputs = fingerprints([o.in_bam]) if o.checkpoint else {}
+    for prefix in prefixes:
+        checkpoint = checkpoints[prefix] = Manifest(
+            f"{prefix}.checkpoint.json",
+            params,
+            ['tags', 'sort', 'consensus'],
+            enabled = o.checkpoint
+            )
+        tags_done[prefix] = (checkpoint.done('tags', tags_inputs)
+                             and checkpoint.outputs_intact('tags')
+                             )
+        sort_done[prefix] = (checkpoint.done('tags', tags_inputs)
+                             and checkpoint.done(
+                                 'sort', checkpoint.stage('tags')['outputs']
+                                 )
+                             and checkpoint.outputs_intact('sort')
+                             )
+
+    dummy_header = {'HD': {'VN': '1.0'}, 
+                    'SQ': [{'LN': 1575, 'SN': 'chr1'}, 
+                           {'LN': 1584, 'SN': 'chr2'}
+                           ]
+                    }
+
+    '''This block of code takes an unaligned bam file, extracts the tag 
+    sequences from the reads, and converts them to to "ab/ba" format 
+    where 'a' and 'b' are the tag sequences from Read 1 and Read 2, 
+    respectively. Conversion occurs by putting the tag with the "lesser" 
+    value in front of the tag with the "higher" value. The original 
+    tag orientation is denoted by appending #ab or #ba to the end of 
+    the tag. After conversion, the resulting temporary bam file is then
+    sorted by read name.  With a sample sheet, the pairs of each sample 
+    go to a temporary bam file of their own, in the same pass.
+    '''
+    if all(tags_done[prefix] or sort_done[prefix] for prefix in prefixes):
+        print("Tags already parsed; skipping.")
+    else:
+        print("Parsing tags...")
+        profiler.begin('tags')
+        temp_bams = {}
+        for prefix in prefixes:
+            checkpoints[prefix].start('tags', tags_inputs)
+            sort_done[prefix] = False
+            temp_bams[prefix] = pysam.AlignmentFile(
+                f"{prefix}.temp.bam.partial",
+                'wb',
+                header=dummy_header
+                )
+
+        counts = parse_tags(o, temp_bams, sample_sheet)
+
+        for prefix in prefixes:
+            temp_bams[prefix].close()
+            os.replace(f"{prefix}.temp.bam.partial", f"{prefix}.temp.bam")
+            checkpoints[prefix].finish('tags', [f"{prefix}.temp.bam"])
+        if sample_sheet is not None:
+            write_sample_counts(f"{o.prefix}.samples.txt",
+                                prefixes,
+                                counts,
+                                ['pairs', 'tagged_pairs']
+                                )
+        profiler.end('tags')
+
+    for prefix in prefixes:
+        if sample_sheet is not None:
+            print(f"Sample {prefix}:")
+        sample_consensuses(o, prefix, checkpoints[prefix], sort_done[prefix],
+                           profiler
+                           )
+
+    profiler.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,45 @@
+"""benchmarks
+Synthetic data generators and repeatable benchmarks for the Duplex
+Sequencing programs.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.synthetic --prefix lib --molecules 5000
+    python -m benchmarks.consensus --out results.json
+
+See benchmarks/README.md for details.
+"""
+
+import importlib.util
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+NAT_PROTOCOLS = os.path.join(REPO_ROOT, 'Nat_Protocols_Version')
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def load_program(path, name=None):
+    """Import one of the repository's scripts as a module.
+
+    path is relative to the repository root.  This also works for the
+    scripts whose file names are not valid module names, such as
+    Nat_Protocols_Version/mut-position.py.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(REPO_ROOT, path)
+        )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
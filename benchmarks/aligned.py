@@ -0,0 +1,197 @@
+"""aligned.py
+Synthetic reference, aligned duplex library, and truth pileup for the
+Nat_Protocols_Version pipeline.
+
+AlignedLibrary places every molecule of a SyntheticLibrary on a random
+reference and plants point mutations at a fixed set of sites: each
+molecule covering a site carries that site's alternate base with
+probability mutant_fraction.  From it we can write:
+
+    write_reference      the reference FASTA, indexed
+    write_fastq          raw paired FASTQs, as from the sequencer
+    write_aligned_bam    the position-sorted, indexed BAM that bwa and
+                         samtools sort would make from the tag_to_header
+                         output (read names are <name>|<tag1><tag2>/<n>)
+    write_dcs_pileup     the samtools mpileup text of the DCSs that a
+                         perfect run of the pipeline would produce
+    expected_mutations   the point mutation counts in that pileup
+
+Sequencing errors are never placed on planted sites, so with the default
+ConsensusMaker settings the expected counts are exact.
+"""
+
+import os
+
+from benchmarks.synthetic import SyntheticLibrary, reverse_complement
+
+# Flags written by bwa sampe for the two strands of a proper pair.
+AB_FLAGS = (99, 147)
+BA_FLAGS = (83, 163)
+
+
+class AlignedLibrary(SyntheticLibrary):
+    def __init__(self, seed=1, contigs=2, contig_len=20000, insert_len=None,
+                 mutation_sites=40, mutant_fraction=0.1, rep_filt=9,
+                 **kwargs):
+        self.contig_count = contigs
+        self.contig_len = contig_len
+        self.mutation_sites = mutation_sites
+        self.mutant_fraction = mutant_fraction
+        self.reference = None
+        self.sites = None
+        kwargs.setdefault('family_size', 'poisson:8')
+        if not insert_len:
+            body_len = (kwargs.get('read_len', 101) - kwargs.get('tag_len', 12)
+                        - kwargs.get('spacer_len', 5))
+            insert_len = 2 * body_len + 50
+        SyntheticLibrary.__init__(self, seed=seed, insert_len=insert_len,
+                                  rep_filt=rep_filt, **kwargs)
+        if self.insert_len <= 2 * self.body_len:
+            # ConsensusMaker's overlap filter would drop the reads.
+            raise ValueError("insert_len must be more than twice the "
+                             "read length after the tag and spacer")
+
+    def _make_reference(self, rng):
+        self.reference = [
+            (f"chr{i + 1}", self._random_seq(rng, self.contig_len))
+            for i in range(self.contig_count)
+            ]
+        self.sites = {}
+        while len(self.sites) < self.mutation_sites:
+            contig = rng.randrange(self.contig_count)
+            pos = rng.randrange(self.contig_len)
+            ref_base = self.reference[contig][1][pos]
+            self.sites[contig, pos] = rng.choice(
+                'ACGT'.replace(ref_base, '')
+                )
+
+    def _make_insert(self, rng, molecule):
+        if self.reference is None:
+            self._make_reference(rng)
+        contig = rng.randrange(self.contig_count)
+        start = rng.randrange(self.contig_len - self.insert_len)
+        insert = list(self.reference[contig][1][start:start +
+                                                 self.insert_len])
+        for offset in range(self.insert_len):
+            alt = self.sites.get((contig, start + offset))
+            if alt is not None and rng.random() < self.mutant_fraction:
+                insert[offset] = alt
+                molecule.mutations[offset] = alt
+        molecule.insert = ''.join(insert)
+        molecule.contig = contig
+        molecule.start = start
+
+    def header(self):
+        return {'HD': {'VN': '1.5', 'SO': 'coordinate'},
+                'SQ': [{'SN': name, 'LN': len(seq)}
+                       for name, seq in self.reference]
+                }
+
+    def write_reference(self, path):
+        import pysam
+        with open(path, 'w') as out_file:
+            for name, seq in self.reference:
+                out_file.write(f">{name}\n")
+                for i in range(0, len(seq), 60):
+                    out_file.write(seq[i:i + 60] + '\n')
+        pysam.faidx(path)
+
+    def _pair_records(self, header, molecule, strand, name, read1, read2):
+        """Build the two aligned records for one read pair.
+
+        read1 and read2 are (sequence, quality) with the tag and spacer
+        removed, in sequencing orientation.
+        """
+        import pysam
+        left = molecule.start
+        right = molecule.start + self.insert_len - self.body_len
+        if strand == 'ab':
+            tags = molecule.alpha + molecule.beta
+            layout = ((1, read1, AB_FLAGS[0], left, right, self.insert_len),
+                      (2, read2, AB_FLAGS[1], right, left, -self.insert_len))
+        else:
+            tags = molecule.beta + molecule.alpha
+            layout = ((1, read1, BA_FLAGS[0], right, left, -self.insert_len),
+                      (2, read2, BA_FLAGS[1], left, right, self.insert_len))
+        records = []
+        for read_num, (seq, qual), flag, pos, mpos, isize in layout:
+            if flag & 16:
+                seq = reverse_complement(seq)
+                qual = qual[::-1]
+            a = pysam.AlignedSegment(header)
+            a.query_name = f"{name}|{tags}/{read_num}"
+            a.flag = flag
+            a.reference_id = molecule.contig
+            a.reference_start = pos
+            a.mapping_quality = 60
+            a.cigartuples = [(0, len(seq))]
+            a.next_reference_id = molecule.contig
+            a.next_reference_start = mpos
+            a.template_length = isize
+            a.query_sequence = seq
+            a.query_qualities = pysam.qualitystring_to_array(qual)
+            records.append(a)
+        return records
+
+    def write_aligned_bam(self, path):
+        import pysam
+        trim = self.tag_len + self.spacer_len
+        unsorted = path + '.unsorted.bam'
+        with pysam.AlignmentFile(unsorted, 'wb',
+                                 header=self.header()) as out_bam:
+            for name, seq1, qual1, seq2, qual2, molecule, strand \
+                    in self.read_pairs():
+                for a in self._pair_records(
+                        out_bam.header, molecule, strand, name,
+                        (seq1[trim:], qual1[trim:]),
+                        (seq2[trim:], qual2[trim:])):
+                    out_bam.write(a)
+        pysam.sort('-o', path, unsorted)
+        os.remove(unsorted)
+        pysam.index(path)
+
+    def dcs_molecules(self, minmem=3):
+        """Molecules with enough reads on both strands to make a DCS."""
+        return [m for m in self.molecules
+                if m.ab_reads >= minmem and m.ba_reads >= minmem]
+
+    def write_dcs_pileup(self, path, reference_path, minmem=3):
+        """Write the mpileup text of the expected DCS reads."""
+        import pysam
+        dcs_bam = path + '.dcs.bam'
+        unsorted = dcs_bam + '.unsorted.bam'
+        forward_qual = 'J' * self.body_len
+        with pysam.AlignmentFile(unsorted, 'wb',
+                                 header=self.header()) as out_bam:
+            for molecule in self.dcs_molecules(minmem):
+                read1 = (molecule.insert[:self.body_len], forward_qual)
+                read2 = (reverse_complement(molecule.insert)[:self.body_len],
+                         forward_qual)
+                for a in self._pair_records(out_bam.header, molecule, 'ab',
+                                            f"dcs{molecule.index}",
+                                            read1, read2):
+                    out_bam.write(a)
+        pysam.sort('-o', dcs_bam, unsorted)
+        os.remove(unsorted)
+        pysam.index(dcs_bam)
+        with open(path, 'w') as out_file:
+            out_file.write(pysam.mpileup('-B', '-A', '-d', '500000',
+                                         '-f', reference_path, dcs_bam))
+        return dcs_bam
+
+    def expected_mutations(self, minmem=3):
+        """Count planted point mutations seen in the expected DCSs.
+
+        Returns a dictionary keyed by (reference base, alternate base).
+        """
+        counts = {}
+        covered = set(range(self.body_len))
+        covered.update(range(self.insert_len - self.body_len,
+                             self.insert_len))
+        for molecule in self.dcs_molecules(minmem):
+            for offset, alt in molecule.mutations.items():
+                if offset in covered:
+                    ref_base = self.reference[molecule.contig][1][
+                        molecule.start + offset]
+                    counts[ref_base, alt] = counts.get((ref_base, alt), 0) + 1
+        return counts
@@ -0,0 +1,106 @@
+"""common.py
+Timing, environment capture, and JSON result handling shared by the
+benchmark suites.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import REPO_ROOT
+
+
+def time_call(fn, repeat=5, number=1, items=None):
+    """Time fn() and return a result dictionary.
+
+    fn is called number times per repeat; times are per call.  If items
+    is given, it is the number of items (reads, families, lines...) that
+    one call processes, and a throughput is reported as well.
+    """
+    fn()  # Warm up caches and lazy imports.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    result = {'best': min(times),
+              'median': statistics.median(times),
+              'mean': statistics.mean(times),
+              'repeat': repeat,
+              'number': number
+              }
+    if items:
+        result['items'] = items
+        result['items_per_sec'] = items / result['best']
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=REPO_ROOT,
+            stderr=subprocess.DEVNULL
+            ).decode().strip()
+        dirty = bool(subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=REPO_ROOT,
+            stderr=subprocess.DEVNULL
+            ).strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+        dirty = None
+    versions = {}
+    for module in ('pysam', 'numpy'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {'commit': commit,
+            'dirty': dirty,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'modules': versions
+            }
+
+
+def write_results(path, suite, params, benchmarks):
+    results = {'suite': suite,
+               'environment': environment(),
+               'params': params,
+               'benchmarks': benchmarks
+               }
+    with open(path, 'w') as out_file:
+        json.dump(results, out_file, indent=2, sort_keys=True)
+    return results
+
+
+def print_results(benchmarks, baseline=None, out_file=sys.stdout):
+    """Print a table of results, with speedups against baseline."""
+    base = baseline['benchmarks'] if baseline else {}
+    out_file.write(f"{'benchmark':<40}{'best (s)':>12}{'items/s':>14}"
+                   f"{'speedup':>10}\n")
+    for name in sorted(benchmarks):
+        result = benchmarks[name]
+        if 'skipped' in result:
+            out_file.write(f"{name:<40}{'skipped: ' + result['skipped']}\n")
+            continue
+        rate = result.get('items_per_sec')
+        rate = f"{rate:>14.1f}" if rate else f"{'':>14}"
+        speedup = ''
+        if name in base and 'best' in base[name]:
+            speedup = f"{base[name]['best'] / result['best']:.2f}x"
+        out_file.write(f"{name:<40}{result['best']:>12.6f}{rate}"
+                       f"{speedup:>10}\n")
+
+
+def load_results(path):
+    with open(path) as in_file:
+        return json.load(in_file)
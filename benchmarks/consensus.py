@@ -0,0 +1,356 @@
+"""consensus.py
+Micro and macro benchmarks for tag parsing, family grouping, SSCS and
+DCS calling, and output encoding.
+
+Every run builds the same synthetic library from --seed, times each
+benchmark --repeat times, and writes the results, together with the git
+commit and module versions, to --out as JSON.  Passing an earlier results
+file with --compare prints the speedup of every benchmark against it.
+
+usage: python -m benchmarks.consensus [--out results.json]
+                                      [--compare baseline.json]
+                                      [--only NAME] [--no-macro] [options]
+
+Benchmarks:
+    tag_parsing.tag_to_header   tag_extract_fxn + hdr_rename_fxn per pair
+    tag_parsing.renamers        tag_extract_fxn + the renaming functions
+                                for the detected name format
+    grouping.unified            name-sorted BAM -> tag families, as in
+                                UnifiedConsensusMaker
+    sscs.consensus_caller       UnifiedConsensusMaker SSCS calling
+    sscs.consensus_maker        ConsensusMaker SSCS calling
+    sscs.consensus_batch        ConsensusMaker SSCS calling, all the
+                                families at a position at once
+    sscs.qual_calc              UnifiedConsensusMaker quality sums
+    dcs.consensus_caller        UnifiedConsensusMaker DCS calling
+    dcs.dcs_maker               DuplexMaker DCS calling
+    dcs.dcs_batch               DuplexMaker DCS calling, several duplexes
+                                at once
+    encode.fastq                capped-quality FASTQ records
+    encode.bam                  SSCS AlignedSegment creation and writing
+    macro.unified               UnifiedConsensusMaker.py end to end
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks import REPO_ROOT, load_program
+from benchmarks.common import (time_call, write_results, print_results,
+                               load_results)
+from benchmarks.synthetic import add_library_arguments, library_from_args
+
+
+def build_families(library):
+    """Group the library's reads the way the consensus makers see them.
+
+    Returns a list of dictionaries keyed by 'ab:1', 'ab:2', 'ba:1' and
+    'ba:2', holding (sequences, qualities) with the tag and spacer
+    removed.
+    """
+    trim = library.tag_len + library.spacer_len
+    families = {}
+    for _, seq1, qual1, seq2, qual2, molecule, strand \
+            in library.read_pairs():
+        family = families.setdefault(
+            molecule.index,
+            {key: ([], []) for key in ('ab:1', 'ab:2', 'ba:1', 'ba:2')}
+            )
+        for read_num, seq, qual in ((1, seq1, qual1), (2, seq2, qual2)):
+            seqs, quals = family[f"{strand}:{read_num}"]
+            seqs.append(seq[trim:])
+            quals.append([ord(q) - 33 for q in qual[trim:]])
+    return [families[i] for i in sorted(families)]
+
+
+def sscs_inputs(families, minmem, maxmem):
+    return [family[key] for family in families for key in family
+            if len(family[key][0]) >= minmem
+            ]
+
+
+def add_micro_benchmarks(benchmarks, library, o, selected):
+    unified = load_program('UnifiedConsensusMaker.py')
+    families = build_families(library)
+    inputs = sscs_inputs(families, o.minmem, o.maxmem)
+    body_len = library.body_len
+
+    def run(name, fn, items):
+        if selected(name):
+            benchmarks[name] = time_call(fn, repeat=o.repeat, items=items)
+
+    # Tag parsing
+    try:
+        tag_to_header = load_program('Nat_Protocols_Version/tag_to_header.py')
+    except Exception as err:
+        for name in ('tag_parsing.tag_to_header', 'tag_parsing.renamers'):
+            if selected(name):
+                benchmarks[name] = {'skipped': repr(err)}
+    else:
+        pairs = [(f"{name} 1:N:0:{library.index}",
+                  f"{name} 2:N:0:{library.index}", seq1, seq2)
+                 for name, seq1, _, seq2, _, _, _ in library.read_pairs()]
+
+        def parse_tags():
+            for title1, title2, seq1, seq2 in pairs:
+                tag1, tag2 = tag_to_header.tag_extract_fxn((seq1, seq2),
+                                                           library.tag_len)
+                tag_to_header.hdr_rename_fxn(title1, tag1, tag2)
+                tag_to_header.hdr_rename_fxn(title2, tag1, tag2)
+        run('tag_parsing.tag_to_header', parse_tags, len(pairs))
+
+        make_renamer = tag_to_header.NAME_FORMATS[
+            tag_to_header.detect_name_format([pairs[0][0], pairs[0][1]])][1]
+        rename1 = make_renamer('1')
+        rename2 = make_renamer('2')
+
+        def rename_tags():
+            for title1, title2, seq1, seq2 in pairs:
+                tag1, tag2 = tag_to_header.tag_extract_fxn((seq1, seq2),
+                                                           library.tag_len)
+                tags = tag1 + tag2
+                rename1(title1, tags)
+                rename2(title2, tags)
+        run('tag_parsing.renamers', rename_tags, len(pairs))
+
+    # SSCS calling
+    def call_unified_sscs():
+        for seqs, _ in inputs:
+            unified.consensus_caller(seqs[:o.maxmem], o.cutoff, 'tag', True)
+    run('sscs.consensus_caller', call_unified_sscs, len(inputs))
+
+    def sum_quals():
+        for _, quals in inputs:
+            unified.qual_calc(quals)
+    run('sscs.qual_calc', sum_quals, len(inputs))
+
+    try:
+        nat_consensus = load_program(
+            'Nat_Protocols_Version/ConsensusMaker.py'
+            )
+    except Exception as err:
+        for name in ('sscs.consensus_maker', 'sscs.consensus_batch'):
+            if selected(name):
+                benchmarks[name] = {'skipped': repr(err)}
+    else:
+        def call_nat_sscs():
+            for seqs, _ in inputs:
+                nat_consensus.consensus_maker(seqs[:o.maxmem], o.cutoff,
+                                              body_len)
+        run('sscs.consensus_maker', call_nat_sscs, len(inputs))
+
+        def call_nat_batch():
+            # The four families of a molecule, as at one position.
+            for i in range(0, len(inputs), 4):
+                nat_consensus.consensus_batch(
+                    [seqs[:o.maxmem] for seqs, _ in inputs[i:i + 4]],
+                    o.cutoff, body_len)
+        run('sscs.consensus_batch', call_nat_batch, len(inputs))
+
+    # DCS calling
+    sscs = {}
+    for i, family in enumerate(families):
+        for key, (seqs, quals) in family.items():
+            if len(seqs) >= o.minmem:
+                sscs[i, key] = (
+                    unified.consensus_caller(seqs[:o.maxmem], o.cutoff,
+                                             'tag', True),
+                    unified.qual_calc(quals)
+                    )
+    duplexes = [(sscs[i, 'ab:1'], sscs[i, 'ba:2'])
+                for i in range(len(families))
+                if (i, 'ab:1') in sscs and (i, 'ba:2') in sscs
+                ]
+
+    def call_unified_dcs():
+        for (seq_a, _), (seq_b, _) in duplexes:
+            unified.consensus_caller([seq_a, seq_b], 1, 'tag', False)
+    run('dcs.consensus_caller', call_unified_dcs, len(duplexes))
+
+    try:
+        from dsutils.duplex import dcs_batch, dcs_maker
+    except Exception as err:
+        for name in ('dcs.dcs_maker', 'dcs.dcs_batch'):
+            if selected(name):
+                benchmarks[name] = {'skipped': repr(err)}
+    else:
+        def call_nat_dcs():
+            for (seq_a, _), (seq_b, _) in duplexes:
+                dcs_maker([seq_a, seq_b], body_len)
+        run('dcs.dcs_maker', call_nat_dcs, len(duplexes))
+
+        def call_nat_dcs_batch():
+            # Four duplexes at a time, as at one position.
+            for i in range(0, len(duplexes), 4):
+                dcs_batch([(seq_a, seq_b) for (seq_a, _), (seq_b, _)
+                           in duplexes[i:i + 4]], body_len)
+        run('dcs.dcs_batch', call_nat_dcs_batch, len(duplexes))
+
+    # Output encoding
+    encoded = [(seq, quals) for seq, quals in sscs.values()]
+
+    def encode_fastq():
+        for seq, quals in encoded:
+            qual_str = ''.join(chr(min(x, 41) + 33) for x in quals)
+            f"@tag#ab/1\n{seq}\n+3\n{qual_str}\n"
+    run('encode.fastq', encode_fastq, len(encoded))
+
+    def encode_bam():
+        import pysam
+        header = {'HD': {'VN': '1.0'},
+                  'SQ': [{'LN': 1000000, 'SN': 'chr1'}]
+                  }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with pysam.AlignmentFile(os.path.join(tmp_dir, 'sscs.bam'),
+                                     'wb', header=header) as out_bam:
+                quality_score = 'J' * body_len
+                for i, (seq, _) in enumerate(encoded):
+                    a = pysam.AlignedRead()
+                    a.qname = f"tag{i}:1:5"
+                    a.flag = 99
+                    a.seq = seq
+                    a.rname = 0
+                    a.pos = i
+                    a.mapq = 255
+                    a.cigar = [(0, len(seq))]
+                    a.mrnm = 0
+                    a.mpos = i + 100
+                    a.isize = 200
+                    a.qual = quality_score
+                    out_bam.write(a)
+    run('encode.bam', encode_bam, len(encoded))
+
+    # Grouping a name-sorted BAM into families
+    if selected('grouping.unified'):
+        import pysam
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sorted_bam = os.path.join(tmp_dir, 'temp.sort.bam')
+            header = {'HD': {'VN': '1.0'}}
+            with pysam.AlignmentFile(sorted_bam, 'wb',
+                                     header=header) as out_bam:
+                records = []
+                for i, family in enumerate(families):
+                    tag = f"{i:012d}{i:012d}"
+                    for key, (seqs, quals) in family.items():
+                        subtype, read_num = key.split(':')
+                        for seq, qual in zip(seqs, quals):
+                            records.append((f"{tag}#{subtype}:{read_num}",
+                                            seq, qual))
+                records.sort(key=lambda x: x[0])
+                for name, seq, qual in records:
+                    read = pysam.AlignedSegment()
+                    read.query_name = name
+                    read.flag = 4
+                    read.query_sequence = seq
+                    read.query_qualities = qual
+                    out_bam.write(read)
+
+            def group():
+                in_bam = pysam.AlignmentFile(sorted_bam, 'rb',
+                                             check_sq=False)
+                final = pysam.AlignedSegment()
+                final.query_name = "FinalValue#ab:1"
+                seq_dict = {'ab:1': [], 'ab:2': [], 'ba:1': [], 'ba:2': []}
+                current = None
+                for line in unified.iteratorWrapper(
+                        in_bam.fetch(until_eof=True), final):
+                    tag, subtype = line.query_name.split('#')
+                    if tag != current:
+                        current = tag
+                        seq_dict = {'ab:1': [], 'ab:2': [],
+                                    'ba:1': [], 'ba:2': []
+                                    }
+                    if line is not final:
+                        seq_dict[subtype].append(line.query_sequence)
+                        list(line.query_qualities)
+                in_bam.close()
+            benchmarks['grouping.unified'] = time_call(
+                group, repeat=o.repeat, items=len(records)
+                )
+
+
+def add_macro_benchmarks(benchmarks, library, o, selected):
+    if not selected('macro.unified'):
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_bam = os.path.join(tmp_dir, 'library.unaligned.bam')
+        library.write_unaligned_bam(in_bam)
+
+        def run_unified():
+            subprocess.run(
+                [sys.executable,
+                 os.path.join(REPO_ROOT, 'UnifiedConsensusMaker.py'),
+                 '--input', in_bam,
+                 '--prefix', os.path.join(tmp_dir, 'run'),
+                 '--taglen', str(library.tag_len),
+                 '--spacerlen', str(library.spacer_len),
+                 '--loclen', str(library.loc_len),
+                 '--minmem', str(o.minmem),
+                 '--maxmem', str(o.maxmem),
+                 '--cutoff', str(o.cutoff),
+                 '--write-sscs',
+                 '--no-checkpoint'
+                 ],
+                check=True,
+                stdout=subprocess.DEVNULL
+                )
+        benchmarks['macro.unified'] = time_call(
+            run_unified, repeat=o.macro_repeat, items=library.read_count()
+            )
+
+
+def main():
+    parser = ArgumentParser()
+    add_library_arguments(parser)
+    parser.set_defaults(molecules=2000)
+    parser.add_argument('--minmem', dest='minmem', type=int, default=3,
+                        help="Minimum family size for a SSCS. [%(default)s]")
+    parser.add_argument('--maxmem', dest='maxmem', type=int, default=200,
+                        help="Maximum family size for a SSCS. [%(default)s]")
+    parser.add_argument('--cutoff', dest='cutoff', type=float, default=0.7,
+                        help="SSCS consensus cutoff. [%(default)s]")
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5,
+                        help="Timed repeats of each micro benchmark. "
+                             "[%(default)s]")
+    parser.add_argument('--macro_repeat', dest='macro_repeat', type=int,
+                        default=3,
+                        help="Timed repeats of each macro benchmark. "
+                             "[%(default)s]")
+    parser.add_argument('--only', dest='only', action='append', default=None,
+                        help=("Only run benchmarks whose name starts with "
+                              "this; can be given more than once."))
+    parser.add_argument('--no-macro', dest='macro', action='store_false',
+                        help="Skip the end-to-end benchmarks.")
+    parser.add_argument('--out', dest='out', default=None,
+                        help="JSON file for the results. [None]")
+    parser.add_argument('--compare', dest='compare', default=None,
+                        help="Earlier results file to compare against.")
+    o = parser.parse_args()
+
+    def selected(name):
+        return o.only is None or any(name.startswith(x) for x in o.only)
+
+    start = time.perf_counter()
+    library = library_from_args(o)
+    sys.stderr.write(f"Library: {len(library.molecules)} molecules, "
+                     f"{library.read_count()} read pairs "
+                     f"({time.perf_counter() - start:.1f}s)\n")
+
+    benchmarks = {}
+    add_micro_benchmarks(benchmarks, library, o, selected)
+    if o.macro:
+        add_macro_benchmarks(benchmarks, library, o, selected)
+
+    params = {key: value for key, value in vars(o).items()
+              if key not in ('out', 'compare', 'only')}
+    if o.out:
+        write_results(o.out, 'consensus', params, benchmarks)
+    print_results(benchmarks,
+                  load_results(o.compare) if o.compare else None)
+
+
+if __name__ == "__main__":
+    main()
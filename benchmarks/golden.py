@@ -0,0 +1,594 @@
+"""golden.py
+Differential tests of fast implementations against the reference code.
+
+Every function listed below has a frozen pure-Python reference in
+reference.py.  Alternatives are registered under the function's name and
+run side by side with the reference on the same inputs:
+
+    consensus_caller   UnifiedConsensusMaker SSCS/DCS calling
+    consensus_maker    ConsensusMaker SSCS calling
+    dcs_maker          DuplexMaker DCS calling
+    CountMutations     CountMuts.py, whole .countmuts output
+    MutPos             mut-position.py, whole .mutpos output
+    readPositions      muts_by_read_position.py, counts by read position
+
+Inputs come from a synthetic library (real-looking families and a real
+samtools mpileup of planted mutations) and from seeded fuzzing, which
+mixes in Ns, odd characters, short reads, clonal sites, read start and
+end markers with arbitrary mapping qualities, and multi-digit indels.
+Exceptions are part of the result: an alternative must raise the same
+exception type and message as the reference does.
+
+The current code in the repository is registered as the 'tree'
+alternative of each function, and ConsensusMaker's consensus_batch,
+called on one family at a time, as the 'batch' alternative of
+consensus_maker; DuplexMaker's dcs_maker and dcs_batch (from
+dsutils/duplex.py) are the 'tree' and 'batch' alternatives of dcs_maker.
+The 'bam' alternatives of CountMutations and MutPos count the library
+pileup from its BAM file with dsutils/bampileup.py, and the 'regions'
+alternative of CountMutations counts it in regions and merges the
+counts, as CountMuts.py --processes does.
+Other alternatives register themselves:
+
+    from benchmarks.golden import register
+
+    @register('dcs_maker', 'numpy')
+    def dcs_maker(grouped_reads_list, read_length):
+        ...
+
+and are loaded with --module.  The first difference for each alternative
+is reported with its inputs and the surrounding output, and the program
+exits with status 1 if any alternative differs.
+
+usage: python -m benchmarks.golden [--function NAME] [--alternative NAME]
+                                   [--module MODULE] [--cases N] [--seed N]
+"""
+
+import contextlib
+import copy
+import difflib
+import importlib
+import io
+import random
+import sys
+from argparse import ArgumentParser, Namespace
+from collections import OrderedDict
+
+from benchmarks import load_program, reference
+
+# function name -> alternative name -> loader returning the callable
+ALTERNATIVES = OrderedDict((name, OrderedDict()) for name in (
+    'consensus_caller', 'consensus_maker', 'dcs_maker', 'CountMutations',
+    'MutPos', 'readPositions'))
+
+
+def register(function, name):
+    """Decorator registering an alternative implementation of function."""
+    def decorate(fn):
+        ALTERNATIVES[function][name] = lambda: fn
+        return fn
+    return decorate
+
+
+def register_program(function, name, path, attribute=None):
+    """Register a function of one of the repository's scripts.
+
+    The script is only imported when the alternative is run, so missing
+    optional modules make it skip rather than fail.
+    """
+    def load():
+        return getattr(load_program(path), attribute or function)
+    ALTERNATIVES[function][name] = load
+
+
+register_program('consensus_caller', 'tree', 'UnifiedConsensusMaker.py')
+register_program('consensus_maker', 'tree',
+                 'Nat_Protocols_Version/ConsensusMaker.py')
+register_program('CountMutations', 'tree',
+                 'Nat_Protocols_Version/CountMuts.py')
+register_program('MutPos', 'tree', 'Nat_Protocols_Version/mut-position.py')
+register_program('readPositions', 'tree',
+                 'Nat_Protocols_Version/muts_by_read_position.py')
+
+
+def _consensus_batch():
+    consensus_batch = load_program(
+        'Nat_Protocols_Version/ConsensusMaker.py').consensus_batch
+
+    def consensus_maker(grouped_reads_list, cut_off, read_length):
+        return (consensus_batch([grouped_reads_list], cut_off,
+                                read_length)[0],
+                len(grouped_reads_list))
+    return consensus_maker
+
+
+ALTERNATIVES['consensus_maker']['batch'] = _consensus_batch
+
+
+def _dcs_maker():
+    from dsutils.duplex import dcs_maker
+    return dcs_maker
+
+
+def _dcs_batch():
+    from dsutils.duplex import dcs_batch
+
+    def dcs_maker(grouped_reads_list, read_length):
+        return dcs_batch([grouped_reads_list], read_length)[0]
+    return dcs_maker
+
+
+ALTERNATIVES['dcs_maker']['tree'] = _dcs_maker
+ALTERNATIVES['dcs_maker']['batch'] = _dcs_batch
+
+
+def _from_bam(path, text_attribute, bam_attribute):
+    # The library pileup counted from its BAM file by dsutils.bampileup;
+    # the fuzzed pileups have no BAM file, and go to the text version.
+    def load():
+        program = load_program(path)
+        from_text = getattr(program, text_attribute)
+        from_bam = getattr(program, bam_attribute)
+
+        def run(o, f, fOut):
+            if f.getvalue() != library_pileup():
+                return from_text(o, f, fOut)
+            import pysam
+            o.min_base_quality = 13
+            with library_files() as (ref_path, bam_path, _), \
+                    pysam.AlignmentFile(bam_path) as bam_file, \
+                    pysam.FastaFile(ref_path) as fasta_file:
+                return from_bam(o, bam_file, fasta_file, fOut)
+        return run
+    return load
+
+
+ALTERNATIVES['CountMutations']['bam'] = _from_bam(
+    'Nat_Protocols_Version/CountMuts.py', 'CountMutations',
+    'CountBamMutations')
+ALTERNATIVES['MutPos']['bam'] = _from_bam(
+    'Nat_Protocols_Version/mut-position.py', 'MutPos', 'BamMutPos')
+
+
+def _count_regions():
+    # CountMuts.py --processes: the library BAM file counted in short
+    # regions (in this process), and the counts merged
+    program = load_program('Nat_Protocols_Version/CountMuts.py')
+
+    def count_mutations(o, f, fOut):
+        if f.getvalue() != library_pileup():
+            return program.CountMutations(o, f, fOut)
+        with library_files() as (ref_path, bam_path, _):
+            o.inFile = bam_path
+            o.ref = ref_path
+            o.min_base_quality = 13
+            o.targets = None
+            o.chunk_size = 700
+            o.processes = 1
+            return program.ParallelCountMutations(o, fOut)
+    return count_mutations
+
+
+ALTERNATIVES['CountMutations']['regions'] = _count_regions
+
+
+# Input generation
+
+ODD_BASES = 'Nn.-*RY'
+MAPQ_CHARS = ''.join(chr(c) for c in range(33, 127))
+
+
+def _mutate(rng, seq, rate, alphabet='ACGTN'):
+    return ''.join(rng.choice(alphabet) if rng.random() < rate else base
+                   for base in seq)
+
+
+def _fuzz_family(rng, equal_lengths):
+    length = rng.choice((1, 2, 5, 30, 84))
+    template = ''.join(rng.choice('ACGT') for _ in range(length))
+    rate = rng.choice((0, 0.01, 0.1, 0.5))
+    alphabet = 'ACGTN' if rng.random() < 0.8 else 'ACGTN' + ODD_BASES
+    reads = []
+    for _ in range(rng.choice((1, 2, 3, 4, 7, 20))):
+        read = _mutate(rng, template, rate, alphabet)
+        if not equal_lengths and rng.random() < 0.3:
+            read = read[:rng.randrange(length + 1)]
+        reads.append(read)
+    return reads, length
+
+
+CUTOFFS = (0.5, 2.0 / 3, 0.7, 0.75, 0.9, 1.0)
+
+
+def _library_families():
+    from benchmarks.consensus import build_families
+    from benchmarks.synthetic import SyntheticLibrary
+    library = SyntheticLibrary(seed=7, molecules=40, family_size='poisson:5',
+                               error_rate=0.03)
+    families = [family[key][0] for family in build_families(library)
+                for key in family if family[key][0]]
+    return families, library.body_len
+
+
+def consensus_caller_cases(rng, count):
+    families, _ = _library_families()
+    for i, reads in enumerate(families):
+        yield f"library family {i}", {'input_reads': reads, 'cutoff': 0.7,
+                                      'tag': f"family{i}",
+                                      'length_check': True}
+    for i in range(count):
+        equal = rng.random() < 0.7
+        reads, _ = _fuzz_family(rng, equal)
+        yield f"fuzz {i}", {'input_reads': reads,
+                            'cutoff': rng.choice(CUTOFFS),
+                            'tag': f"fuzz{i}",
+                            'length_check': equal or rng.random() < 0.5}
+
+
+def consensus_maker_cases(rng, count):
+    families, body_len = _library_families()
+    for i, reads in enumerate(families):
+        yield f"library family {i}", {'grouped_reads_list': reads,
+                                      'cut_off': 0.7,
+                                      'read_length': body_len}
+    for i in range(count):
+        reads, length = _fuzz_family(rng, rng.random() < 0.5)
+        yield f"fuzz {i}", {'grouped_reads_list': reads,
+                            'cut_off': rng.choice(CUTOFFS),
+                            'read_length': max(0, length +
+                                               rng.choice((0, 0, 0, -1, 1)))}
+
+
+def dcs_maker_cases(rng, count):
+    families, body_len = _library_families()
+    for i in range(0, len(families) - 1, 2):
+        pair = [families[i][0], _mutate(rng, families[i][0], 0.02)]
+        yield f"library pair {i // 2}", {'grouped_reads_list': pair,
+                                         'read_length': body_len}
+    for i in range(count):
+        reads, length = _fuzz_family(rng, rng.random() < 0.8)
+        pair = (reads * 2)[:2]
+        yield f"fuzz {i}", {'grouped_reads_list': pair,
+                            'read_length': max(0, length +
+                                               rng.choice((0, 0, 0, -1, 1)))}
+
+
+def _fuzz_pileup_read(rng, ref_base, mutant):
+    token = ''
+    if rng.random() < 0.1:
+        token += '^' + rng.choice(MAPQ_CHARS)
+    r = rng.random()
+    if r < 0.05:
+        token += rng.choice('Nn')
+    elif r < 0.08:
+        token += '*'
+    elif r < 0.15 or mutant:
+        token += rng.choice(('ACGT'.replace(ref_base, '') if rng.random() < 0.5
+                             else 'acgt'.replace(ref_base.lower(), '')))
+    else:
+        token += rng.choice('.,')
+    if rng.random() < 0.05:
+        length = rng.choice((1, 2, 3, 9, 10, 12))
+        token += rng.choice('+-') + str(length) + ''.join(
+            rng.choice('ACGTNacgtn') for _ in range(length))
+    if rng.random() < 0.1:
+        token += '$'
+    return token
+
+
+def fuzz_pileup(rng, lines):
+    """Return the text of a random pileup with the given number of lines."""
+    out = []
+    pos = rng.randrange(1, 1000)
+    for _ in range(lines):
+        ref_base = rng.choice('ACGT')
+        depth = rng.choice((1, 2, 5, 20, 30, 60))
+        clonal = rng.random() < 0.1
+        bases = ''.join(_fuzz_pileup_read(rng, ref_base,
+                                          clonal and rng.random() < 0.5)
+                        for _ in range(depth))
+        quals = ''.join(rng.choice(MAPQ_CHARS) for _ in range(depth))
+        out.append(f"chr1\t{pos}\t{ref_base}\t{depth}\t{bases}\t{quals}\n")
+        pos += rng.choice((1, 1, 1, 2, 50))
+    return ''.join(out)
+
+
+def fuzz_read_pileup(rng, lines, read_length):
+    """Return the text of a random pileup whose reads run from line to line.
+
+    Reads start with '^' and a mapping quality, end with '$', and are in
+    the same order on every line, new ones last; a deletion is followed
+    by '*' for the deleted bases.  A few reads run past read_length.
+    """
+    out = []
+    reads = []  # [bases left, deleted bases left, whether it starts here]
+    for pos in range(1, lines + 1):
+        ref_base = rng.choice('ACGT')
+        clonal = rng.random() < 0.05
+        for _ in range(rng.choice((0, 0, 0, 1, 2, 5))):
+            reads.append([rng.randint(1, read_length + rng.choice((0, 0, 2))),
+                          0, True])
+        if not reads:
+            continue
+        tokens = []
+        for read in reads:
+            token = ''
+            if read[2]:
+                token += '^' + rng.choice(MAPQ_CHARS)
+                read[2] = False
+            if read[1]:
+                token += '*'
+                read[1] -= 1
+            else:
+                r = rng.random()
+                if r < 0.03:
+                    token += rng.choice('Nn')
+                elif r < 0.06 or (clonal and r < 0.5):
+                    token += rng.choice('ACGTacgt')
+                elif r < 0.061:
+                    token += rng.choice(ODD_BASES)
+                else:
+                    token += rng.choice('.,')
+                read[0] -= 1
+            if read[0] > 0 and rng.random() < 0.02:
+                length = rng.choice((1, 1, 2, 3, 9, 10, 12))
+                sign = rng.choice('+-')
+                token += sign + str(length) + ''.join(
+                    rng.choice('ACGTNacgtn') for _ in range(length))
+                if sign == '+':
+                    read[0] -= length
+                else:
+                    read[1] = length
+            if read[0] <= 0:
+                token += '$'
+            tokens.append(token)
+        reads = [read for read in reads if read[0] > 0]
+        depth = len(tokens) + rng.choice((0, 0, 0, 0, 1, -1))
+        out.append(f"chr1\t{pos}\t{ref_base}\t{depth}\t{''.join(tokens)}\t"
+                   f"{'I' * len(tokens)}\n")
+    return ''.join(out)
+
+
+_library_pileup_text = None
+
+
+@contextlib.contextmanager
+def library_files():
+    """Write a small aligned synthetic library to a temporary directory.
+
+    Yields the paths of its reference, the BAM file of its DCSs and
+    their mpileup text.
+    """
+    import os
+    import tempfile
+    from benchmarks.aligned import AlignedLibrary
+    library = AlignedLibrary(seed=11, molecules=400, contig_len=5000,
+                             mutation_sites=60, mutant_fraction=0.3)
+    with tempfile.TemporaryDirectory() as workdir:
+        ref_path = os.path.join(workdir, 'ref.fa')
+        pileup_path = os.path.join(workdir, 'dcs.pileup')
+        library.write_reference(ref_path)
+        bam_path = library.write_dcs_pileup(pileup_path, ref_path)
+        yield ref_path, bam_path, pileup_path
+
+
+def library_pileup():
+    """Return the mpileup text of a small aligned synthetic library."""
+    global _library_pileup_text
+    if _library_pileup_text is None:
+        with library_files() as (_, _, pileup_path):
+            with open(pileup_path) as in_file:
+                _library_pileup_text = in_file.read()
+    return _library_pileup_text
+
+
+def _pileup_inputs(rng, count):
+    try:
+        yield "library pileup", library_pileup()
+    except ImportError:
+        pass
+    for i in range(count):
+        yield f"fuzz {i}", fuzz_pileup(rng, rng.choice((1, 5, 20)))
+
+
+def count_mutations_cases(rng, count):
+    for name, text in _pileup_inputs(rng, count):
+        o = Namespace(mindepth=rng.choice((1, 5, 20)),
+                      min_clonality=rng.choice((0, 0, 0.1)),
+                      max_clonality=rng.choice((0.3, 1, 0.05)),
+                      n_cutoff=rng.choice((0.05, 1)),
+                      start=0, end=0, unique=rng.random() < 0.3)
+        if rng.random() < 0.2:
+            o.start = rng.randrange(1000)
+            o.end = o.start + rng.randrange(500)
+        yield name, {'o': o, 'f': text}
+
+
+def mut_pos_cases(rng, count):
+    for name, text in _pileup_inputs(rng, count):
+        o = Namespace(mindepth=rng.choice((1, 5, 20)),
+                      clonal_min=rng.choice((0, 0, 0.1)),
+                      clonal_max=rng.choice((1, 0.3)),
+                      num_muts=rng.choice((0, 0, 1)))
+        yield name, {'o': o, 'f': text}
+
+
+def read_positions_cases(rng, count):
+    try:
+        yield "library pileup", {'f': library_pileup(), 'rlength': 84,
+                                 'maxCln': 0.1}
+    except ImportError:
+        pass
+    for i in range(count):
+        rlength = rng.choice((5, 30, 84))
+        if rng.random() < 0.1:
+            text = fuzz_pileup(rng, rng.choice((1, 5)))
+        else:
+            text = fuzz_read_pileup(rng, rng.choice((5, 50, 200)), rlength)
+        yield f"fuzz {i}", {'f': text, 'rlength': rlength,
+                            'maxCln': rng.choice((0.1, 0.3, 1))}
+
+
+def _call_direct(fn, args):
+    return fn(*copy.deepcopy(list(args.values())))
+
+
+def _call_with_files(fn, args):
+    out_file = io.StringIO()
+    fn(copy.deepcopy(args['o']), io.StringIO(args['f']), out_file)
+    return out_file.getvalue()
+
+
+def _call_read_positions(fn, args):
+    out_file = io.StringIO()
+    with contextlib.redirect_stdout(out_file):
+        counter = fn(io.StringIO(args['f']), args['rlength'], args['maxCln'])
+    return counter.counts.tolist(), out_file.getvalue()
+
+
+# function name -> (case generator, how to call an implementation)
+CASES = {
+    'consensus_caller': (consensus_caller_cases, _call_direct),
+    'consensus_maker': (consensus_maker_cases, _call_direct),
+    'dcs_maker': (dcs_maker_cases, _call_direct),
+    'CountMutations': (count_mutations_cases, _call_with_files),
+    'MutPos': (mut_pos_cases, _call_with_files),
+    'readPositions': (read_positions_cases, _call_read_positions),
+}
+
+
+# Comparison and reporting
+
+def outcome(call, fn, args):
+    try:
+        return ('returned', call(fn, args))
+    except Exception as err:
+        return ('raised', f"{type(err).__name__}: {err}")
+
+
+def cases(function, count=200, seed=1):
+    """Return a list of (case name, arguments) for function."""
+    generate, _ = CASES[function]
+    return list(generate(random.Random(seed), count))
+
+
+def compare(function, alternative, case_list):
+    """Run alternative against the reference on every case.
+
+    Returns None if all results agree, or (case name, arguments,
+    reference outcome, alternative outcome) for the first difference.
+    """
+    _, call = CASES[function]
+    reference_fn = getattr(reference, function)
+    for name, args in case_list:
+        expected = outcome(call, reference_fn, args)
+        got = outcome(call, alternative, args)
+        if got != expected:
+            return name, args, expected, got
+    return None
+
+
+def _show(value, limit):
+    lines = value.splitlines() if isinstance(value, str) else [repr(value)]
+    if len(lines) > limit:
+        lines = lines[:limit] + [f"... ({len(lines) - limit} more lines)"]
+    return lines
+
+
+def describe_difference(function, alternative, difference, limit=40,
+                        out_file=sys.stdout):
+    name, args, expected, got = difference
+    out_file.write(f"{function} [{alternative}] differs from the reference "
+                   f"on {name}\n  arguments:\n")
+    for key, value in args.items():
+        if isinstance(value, Namespace):
+            value = vars(value)
+        lines = _show(value, limit)
+        out_file.write(f"    {key} = {lines[0]}\n")
+        for line in lines[1:]:
+            out_file.write(f"        {line}\n")
+    for label, (kind, value) in (('reference', expected), (alternative, got)):
+        out_file.write(f"  {label} {kind}: {value!r}\n"
+                       if kind == 'raised' or not isinstance(value, str)
+                       or '\n' not in value
+                       else f"  {label} {kind} {len(value)} characters\n")
+    if expected[0] == got[0] == 'returned':
+        want, have = expected[1], got[1]
+        if isinstance(want, tuple) and isinstance(have, tuple):
+            want, have = want[0], have[0]
+        if isinstance(want, str) and isinstance(have, str):
+            if '\n' in want or '\n' in have:
+                diff = difflib.unified_diff(
+                    want.splitlines(), have.splitlines(),
+                    'reference', alternative, n=3, lineterm='')
+                for line in list(diff)[:limit]:
+                    out_file.write(f"    {line}\n")
+            else:
+                at = next((i for i, (a, b) in enumerate(zip(want, have))
+                           if a != b), min(len(want), len(have)))
+                start = max(0, at - 10)
+                out_file.write(f"  first difference at character {at}:\n"
+                               f"    reference    {want[start:at + 10]!r}\n"
+                               f"    {alternative:<12} "
+                               f"{have[start:at + 10]!r}\n")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--function', dest='functions', action='append',
+                        choices=list(ALTERNATIVES), default=None,
+                        help="Function to test; can be repeated. [all]")
+    parser.add_argument('--alternative', dest='alternatives',
+                        action='append', default=None,
+                        help="Alternative to test; can be repeated. [all]")
+    parser.add_argument('--module', dest='modules', action='append',
+                        default=[],
+                        help=("Module to import before testing, so that it "
+                              "can register alternatives; can be repeated."))
+    parser.add_argument('--cases', dest='cases', type=int, default=300,
+                        help="Number of fuzzed cases per function. "
+                             "[%(default)s]")
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help="Random seed for the fuzzed cases. "
+                             "[%(default)s]")
+    parser.add_argument('--context', dest='context', type=int, default=40,
+                        help="Lines of input and output to show for a "
+                             "difference. [%(default)s]")
+    parser.add_argument('--list', dest='list', action='store_true',
+                        help="List the registered alternatives and exit.")
+    o = parser.parse_args()
+    for module in o.modules:
+        importlib.import_module(module)
+
+    if o.list:
+        for function, alternatives in ALTERNATIVES.items():
+            print(f"{function}: {', '.join(alternatives)}")
+        return
+
+    status = 0
+    for function in o.functions or list(ALTERNATIVES):
+        case_list = None
+        for name, load in ALTERNATIVES[function].items():
+            if o.alternatives and name not in o.alternatives:
+                continue
+            try:
+                alternative = load()
+            except Exception as err:
+                print(f"{function} [{name}]: skipped, {err!r}")
+                continue
+            if case_list is None:
+                case_list = cases(function, o.cases, o.seed)
+            difference = compare(function, alternative, case_list)
+            if difference is None:
+                print(f"{function} [{name}]: {len(case_list)} cases agree")
+            else:
+                status = 1
+                describe_difference(function, name, difference, o.context)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    # Run the imported module's main, so that alternatives registered by
+    # --module modules go into the same registry.
+    from benchmarks.golden import main
+    main()
@@ -0,0 +1,350 @@
+"""pipeline.py
+End-to-end benchmark of the Nat_Protocols_Version pipeline on a synthetic
+aligned library with planted mutations.
+
+The harness writes a synthetic reference, raw FASTQs, and the aligned,
+position-sorted BAM that bwa would have made from them (see aligned.py),
+then runs each stage of the pipeline in its own process and records its
+wall time, peak memory (maximum resident set size) and throughput:
+
+    tag_to_header     tag_to_header.py on the raw FASTQs
+    consensus         ConsensusMaker.py on the aligned BAM
+    sort_sscs         samtools sort of the SSCSs
+    duplex            DuplexMaker.py on the sorted SSCSs
+    realign           place the DCSs back on the reference, sort and index
+    pileup            samtools mpileup of the DCSs
+    countmuts         CountMuts.py on the DCS pileup
+    countmuts_truth   CountMuts.py on the pileup of the expected DCSs
+    mutpos            mut-position.py on the DCS pileup
+    read_position     muts_by_read_position.py on the DCS pileup
+
+No aligner is needed: DCSs keep the coordinates of their SSCSs, so the
+realign stage only undoes the reverse complement DuplexMaker applies to
+reverse strand reads.  The point mutation counts from both CountMuts runs
+are checked against the planted truth, and the program exits with status
+1 if they differ or a stage fails.
+
+usage: python -m benchmarks.pipeline [--molecules N] [--out FILE] [options]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks import NAT_PROTOCOLS, REPO_ROOT
+from benchmarks.aligned import AlignedLibrary
+from benchmarks.common import load_results, print_results, write_results
+from benchmarks.synthetic import add_library_arguments, reverse_complement
+
+
+def peak_memory_kb(pid):
+    """Return the high-water resident set size of a live process, in kB."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def run_stage(command, items=None, stdout=None, interval=0.01):
+    """Run one stage as a child process and measure it.
+
+    Returns a result dictionary in the same form as common.time_call,
+    with the CPU time and peak memory of the child.  Peak memory is read
+    from /proc while the child runs, because the resource usage returned
+    by wait4 also counts the memory of this process at the time of the
+    fork.
+    """
+    start = time.perf_counter()
+    with open(os.devnull if stdout is None else stdout, 'w') as out_file:
+        proc = subprocess.Popen(command, stdout=out_file, cwd=REPO_ROOT)
+        peak = 0
+        while True:
+            peak = max(peak, peak_memory_kb(proc.pid))
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            time.sleep(interval)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        return {'skipped': f"failed with exit status {proc.returncode}"}
+    result = {'best': elapsed,
+              'median': elapsed,
+              'mean': elapsed,
+              'repeat': 1,
+              'number': 1,
+              'cpu': usage.ru_utime + usage.ru_stime,
+              'peak_rss_mb': peak / 1024.0
+              }
+    if items:
+        result['items'] = items
+        result['items_per_sec'] = items / elapsed
+    return result
+
+
+def helper(function, *args):
+    """Command line that runs a function of this module in a new process."""
+    return [sys.executable, '-c',
+            f"import sys; from benchmarks.pipeline import {function}; "
+            f"{function}(*sys.argv[1:])"] + list(args)
+
+
+def sort_bam(in_path, out_path):
+    import pysam
+    pysam.sort('-o', out_path, in_path)
+
+
+def nat_program(name):
+    return [sys.executable, os.path.join(NAT_PROTOCOLS, name)]
+
+
+def count_reads(bam_path):
+    import pysam
+    with pysam.AlignmentFile(bam_path, 'rb', check_sq=False) as in_bam:
+        return sum(1 for _ in in_bam.fetch(until_eof=True))
+
+
+def count_lines(path):
+    with open(path) as in_file:
+        return sum(1 for _ in in_file)
+
+
+def realign_dcs(in_path, out_path):
+    """Undo DuplexMaker's reverse complement of reverse strand DCSs.
+
+    DuplexMaker writes reverse strand DCSs in sequencing orientation (for
+    the FASTQs used to realign them) but keeps their SSCS coordinates, so
+    turning them back gives the BAM a perfect aligner would produce.
+    """
+    import pysam
+    unsorted = out_path + '.unsorted.bam'
+    with pysam.AlignmentFile(in_path, 'rb', check_sq=False) as in_bam, \
+            pysam.AlignmentFile(unsorted, 'wb', template=in_bam) as out_bam:
+        for read in in_bam.fetch(until_eof=True):
+            if read.is_reverse:
+                qual = read.qual
+                read.seq = reverse_complement(read.seq)
+                read.qual = qual[::-1]
+            out_bam.write(read)
+    pysam.sort('-o', out_path, unsorted)
+    os.remove(unsorted)
+    pysam.index(out_path)
+
+
+def write_pileup(bam_path, reference_path, out_path):
+    import pysam
+    with open(out_path, 'w') as out_file:
+        out_file.write(pysam.mpileup('-B', '-A', '-d', '500000',
+                                     '-f', reference_path, bam_path))
+
+
+def parse_countmuts(path):
+    """Read the point mutation counts from a .countmuts file."""
+    counts = {}
+    with open(path) as in_file:
+        for line in in_file:
+            fields = line.rstrip('\n').split('\t')
+            words = fields[0].split()
+            if len(words) == 3 and words[1] == 'to' and len(fields) > 1:
+                counts[words[0], words[2].rstrip(':')] = int(fields[1])
+    return counts
+
+
+def check_counts(name, observed, expected, out_file=sys.stdout):
+    """Compare point mutation counts; return True if they agree."""
+    bad = [(key, observed.get(key, 0), expected.get(key, 0))
+           for key in sorted(set(observed) | set(expected))
+           if observed.get(key, 0) != expected.get(key, 0)]
+    if not bad:
+        out_file.write(f"{name}: {sum(expected.values())} planted point "
+                       f"mutations found, as expected\n")
+        return True
+    out_file.write(f"{name}: counts differ from the planted truth\n")
+    for (ref_base, alt), seen, want in bad:
+        out_file.write(f"    {ref_base} to {alt}: {seen} found, "
+                       f"{want} planted\n")
+    return False
+
+
+def main():
+    parser = ArgumentParser()
+    add_library_arguments(parser)
+    parser.set_defaults(molecules=2000, family_size='poisson:8')
+    parser.add_argument('--contigs', dest='contigs', type=int, default=2,
+                        help="Number of reference contigs. [%(default)s]")
+    parser.add_argument('--contig_len', dest='contig_len', type=int,
+                        default=20000,
+                        help="Length of each contig. [%(default)s]")
+    parser.add_argument('--insert_len', dest='insert_len', type=int,
+                        default=None,
+                        help=("Insert length; must be more than twice the "
+                              "read length after the tag and spacer. "
+                              "[2 * that length + 50]"))
+    parser.add_argument('--mutation_sites', dest='mutation_sites', type=int,
+                        default=40,
+                        help="Number of sites with planted mutations. "
+                             "[%(default)s]")
+    parser.add_argument('--mutant_fraction', dest='mutant_fraction',
+                        type=float, default=0.1,
+                        help=("Fraction of molecules at a site that carry "
+                              "its mutation. [%(default)s]"))
+    parser.add_argument('--minmem', dest='minmem', type=int, default=3,
+                        help="Minimum family size for ConsensusMaker. "
+                             "[%(default)s]")
+    parser.add_argument('--workdir', dest='workdir', default=None,
+                        help=("Directory for the intermediate files; kept "
+                              "after the run.  [a temporary directory]"))
+    parser.add_argument('--out', dest='out', default=None,
+                        help="Write results as JSON to this file.")
+    parser.add_argument('--compare', dest='compare', default=None,
+                        help="Earlier results file to compare against.")
+    o = parser.parse_args()
+
+    library = AlignedLibrary(seed=o.seed,
+                             molecules=o.molecules,
+                             tag_len=o.tag_len,
+                             spacer_len=o.spacer_len,
+                             loc_len=o.loc_len,
+                             read_len=o.read_len,
+                             family_size=o.family_size,
+                             error_rate=o.error_rate,
+                             ab_fraction=o.ab_fraction,
+                             contigs=o.contigs,
+                             contig_len=o.contig_len,
+                             insert_len=o.insert_len,
+                             mutation_sites=o.mutation_sites,
+                             mutant_fraction=o.mutant_fraction
+                             )
+    workdir = o.workdir if o.workdir else tempfile.mkdtemp(prefix='dspipe.')
+    os.makedirs(workdir, exist_ok=True)
+
+    def path(name):
+        return os.path.join(workdir, name)
+
+    reference = path('ref.fa')
+    library.write_reference(reference)
+    library.write_fastq(path('raw.seq1.fq.gz'), path('raw.seq2.fq.gz'))
+    library.write_aligned_bam(path('aligned.bam'))
+    library.write_dcs_pileup(path('truth.pileup'), reference, o.minmem)
+    expected = library.expected_mutations(o.minmem)
+    pairs = library.read_count()
+    sys.stderr.write(f"{len(library.molecules)} molecules, {pairs} read "
+                     f"pairs, {len(library.dcs_molecules(o.minmem))} "
+                     f"expected duplexes in {workdir}\n")
+
+    countmuts_args = ['-d', '1', '-c', '0', '-C', '1', '-n', '1']
+    benchmarks = {}
+    failed = []
+
+    def stage(name, command, items=None, stdout=None, needs=()):
+        missing = [need for need in needs if not os.path.exists(need)]
+        if missing:
+            benchmarks[name] = {
+                'skipped': f"no {os.path.basename(missing[0])}"}
+        else:
+            sys.stderr.write(f"running {name}\n")
+            benchmarks[name] = run_stage(command, items, stdout)
+        if 'skipped' in benchmarks[name]:
+            failed.append(name)
+
+    stage('tag_to_header',
+          nat_program('tag_to_header.py') + [
+              '--infile1', path('raw.seq1.fq.gz'),
+              '--infile2', path('raw.seq2.fq.gz'),
+              '--outprefix', path('tags'),
+              '--taglen', str(o.tag_len),
+              '--spacerlen', str(o.spacer_len)],
+          items=pairs)
+    stage('consensus',
+          nat_program('ConsensusMaker.py') + [
+              '--infile', path('aligned.bam'),
+              '--tag_file', path('sscs.tagcounts'),
+              '--tag_stats', path('sscs.tagstats'),
+              '--outfile', path('sscs.bam'),
+              '--minmem', str(o.minmem),
+              '--read_length', str(library.body_len)],
+          items=2 * pairs)
+    stage('sort_sscs',
+          helper('sort_bam', path('sscs.bam'), path('sscs.sort.bam')),
+          needs=[path('sscs.bam')])
+    sscs_reads = count_reads(path('sscs.sort.bam')) \
+        if 'skipped' not in benchmarks['sort_sscs'] else None
+    stage('duplex',
+          nat_program('DuplexMaker.py') + [
+              '--infile', path('sscs.sort.bam'),
+              '--outfile', path('dcs.bam'),
+              '--readlength', str(library.body_len),
+              '--barcode_length', str(o.tag_len)],
+          items=sscs_reads,
+          needs=[path('sscs.sort.bam')])
+    stage('realign',
+          helper('realign_dcs', path('dcs.bam'), path('dcs.aln.sort.bam')),
+          needs=[path('dcs.bam')])
+    stage('pileup',
+          helper('write_pileup', path('dcs.aln.sort.bam'), reference,
+                 path('dcs.pileup')),
+          needs=[path('dcs.aln.sort.bam.bai')])
+
+    pileup_lines = count_lines(path('dcs.pileup')) \
+        if os.path.exists(path('dcs.pileup')) else None
+    stage('countmuts',
+          nat_program('CountMuts.py') + countmuts_args + [
+              '-i', path('dcs.pileup'),
+              '-o', path('dcs.countmuts')],
+          items=pileup_lines,
+          needs=[path('dcs.pileup')])
+    stage('countmuts_truth',
+          nat_program('CountMuts.py') + countmuts_args + [
+              '-i', path('truth.pileup'),
+              '-o', path('truth.countmuts')],
+          items=count_lines(path('truth.pileup')))
+    stage('mutpos',
+          nat_program('mut-position.py') + [
+              '-d', '1', '-i', path('dcs.pileup'),
+              '-o', path('dcs.mutpos')],
+          items=pileup_lines,
+          needs=[path('dcs.pileup')])
+    stage('read_position',
+          nat_program('muts_by_read_position.py') + [
+              '-i', path('dcs.pileup'),
+              '-o', path('dcs.readpos.png'),
+              '-l', str(library.body_len)],
+          items=pileup_lines,
+          needs=[path('dcs.pileup')])
+
+    correct = True
+    for name, countmuts in (('countmuts_truth', 'truth.countmuts'),
+                            ('countmuts', 'dcs.countmuts')):
+        if 'skipped' not in benchmarks[name]:
+            correct &= check_counts(name, parse_countmuts(path(countmuts)),
+                                    expected, sys.stderr)
+
+    params = vars(o).copy()
+    params['read_pairs'] = pairs
+    params['expected_mutations'] = sum(expected.values())
+    if o.out:
+        write_results(o.out, 'pipeline', params, benchmarks)
+    baseline = load_results(o.compare) if o.compare else None
+    print_results(benchmarks, baseline)
+    sys.stdout.write(f"\n{'stage':<40}{'peak RSS (MB)':>14}\n")
+    for name in benchmarks:
+        if 'peak_rss_mb' in benchmarks[name]:
+            sys.stdout.write(f"{name:<40}"
+                             f"{benchmarks[name]['peak_rss_mb']:>14.1f}\n")
+    if failed:
+        sys.stderr.write(f"stages not run: {', '.join(failed)}\n")
+    if not o.workdir:
+        shutil.rmtree(workdir)
+    sys.exit(0 if correct and not failed else 1)
+
+
+if __name__ == "__main__":
+    main()
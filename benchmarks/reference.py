@@ -0,0 +1,573 @@
+"""reference.py
+Frozen copies of the pure-Python implementations that the fast paths in
+this repository must reproduce exactly.
+
+The functions below are copied unchanged, apart from tabs being expanded,
+from the files named above each one, as they were before any
+optimization.  golden.py runs every registered alternative against them.
+Do not edit them to match a new implementation; if a behavior change is
+intended, it belongs in the program itself, and the differential test
+will say what changed.
+"""
+
+import csv
+import re
+from math import sqrt
+
+import numpy
+
+
+# From UnifiedConsensusMaker.py
+def consensus_caller(input_reads, cutoff, tag, length_check):
+
+    nuc_identity_list = [0, 0, 0, 0, 0, 0]
+    # In the order of T, C, G, A, N, Total
+    nuc_key_dict = {0: 'T', 1: 'C', 2: 'G', 3: 'A', 4: 'N'}
+    consensus_seq = ''
+
+    if length_check is True:
+
+        for read in input_reads[1:]:
+            if len(read) != len(input_reads[0]):
+                raise Exception((f"Read lengths for tag {tag} used for "
+                                 f"calculating the SSCS are not uniform!!!"
+                                 ))
+
+    for i in range(len(input_reads[0])):
+        # Count the types of nucleotides at a position in a read.
+        # i is the nucleotide index within a read in groupedReadsList
+        for j in range(len(input_reads)):
+        # Do this for every read that comprises a tag family.
+        # j is the read index within groupedReadsList
+            try:
+                if input_reads[j][i] == 'T':
+                    nuc_identity_list[0] += 1
+                elif input_reads[j][i] == 'C':
+                    nuc_identity_list[1] += 1
+                elif input_reads[j][i] == 'G':
+                    nuc_identity_list[2] += 1
+                elif input_reads[j][i] == 'A':
+                    nuc_identity_list[3] += 1
+                elif input_reads[j][i] == 'N':
+                    nuc_identity_list[4] += 1
+                else:
+                    nuc_identity_list[4] += 1
+                nuc_identity_list[5] += 1
+            except Exception:
+                break
+        try:
+            for j in [0, 1, 2, 3, 4]:
+                if (float(nuc_identity_list[j])
+                        /float(nuc_identity_list[5])
+                        ) >= cutoff:
+                    consensus_seq += nuc_key_dict[j]
+                    break
+                elif j == 4:
+                    consensus_seq += 'N'
+        except:
+            consensus_seq += 'N'
+        nuc_identity_list = [0, 0, 0, 0, 0, 0]
+        # Reset for the next nucleotide position
+
+    return consensus_seq
+
+
+# From Nat_Protocols_Version/ConsensusMaker.py
+def consensus_maker(grouped_reads_list,  cut_off,  read_length):
+    # The consensus maker uses a simple "majority rules" algorithm to qmake a consensus at each base position.  If no
+    # nucleotide majority reaches above the minimum theshold (--cut_off), the position is considered undefined and an 'N'
+    # is placed at that position in the read.'''
+    nuc_identity_list = [0, 0, 0, 0, 0, 0]  # In the order of T, C, G, A, N, Total
+    nuc_key_dict = {0: 'T', 1: 'C', 2: 'G', 3: 'A', 4: 'N'}
+    consensus_read = ''
+
+    for i in range(read_length):  # Count the types of nucleotides at a position in a read. i is the nucleotide index
+        # within a read in grouped_reads_list
+        for j in range(len(grouped_reads_list)):  # Do this for every read that comprises a SMI group. j is the read
+            # index within grouped_reads_list
+            try:
+                if grouped_reads_list[j][i] == 'T':
+                    nuc_identity_list[0] += 1
+                elif grouped_reads_list[j][i] == 'C':
+                    nuc_identity_list[1] += 1
+                elif grouped_reads_list[j][i] == 'G':
+                    nuc_identity_list[2] += 1
+                elif grouped_reads_list[j][i] == 'A':
+                    nuc_identity_list[3] += 1
+                elif grouped_reads_list[j][i] == 'N':
+                    nuc_identity_list[4] += 1
+                else:
+                    nuc_identity_list[4] += 1
+                nuc_identity_list[5] += 1
+            except:
+                break
+        try:
+            for j in [0, 1, 2, 3, 4]:
+                if float(nuc_identity_list[j])/float(nuc_identity_list[5]) > cut_off:
+                    consensus_read += nuc_key_dict[j]
+                    break
+                elif j == 4:
+                    consensus_read += 'N'
+        except:
+            consensus_read += 'N'
+        nuc_identity_list = [0, 0, 0, 0, 0, 0]  # Reset for the next nucleotide position
+    return consensus_read, len(grouped_reads_list)
+
+
+# From Nat_Protocols_Version/DuplexMaker.py
+def dcs_maker(grouped_reads_list,  read_length):
+    # The Duplex maker substitutes an N if the two input sequences are not identical at a position.
+    consensus_read = ''
+    for i in range(read_length):  # rebuild consensus read taking into account the cutoff percentage
+        if grouped_reads_list[0][i] == grouped_reads_list[1][i]:
+            consensus_read += grouped_reads_list[0][i]
+        else:
+            consensus_read += "N"
+    return consensus_read
+
+
+# From Nat_Protocols_Version/CountMuts.py
+def Wilson(positive,  total) :
+
+        if total == 0:
+            print("Hi")
+            return 0
+
+        freq = float(positive)/float(total)
+        z = 1.96 #1.96 = 95%
+        phat = float(positive) / total
+        positiveCI = (phat + z*z/(2*total) + z * sqrt((phat*(1-phat)+z*z/(4*total))/total))/(1+z*z/total)
+        negativeCI =  (phat + z*z/(2*total) - z * sqrt((phat*(1-phat)+z*z/(4*total))/total))/(1+z*z/total)
+
+        return  (phat, positiveCI , negativeCI )
+
+
+# From Nat_Protocols_Version/CountMuts.py
+def CountMutations(o, f, fOut):
+    depths = []
+
+    Aseq = 0
+    AtoT = 0
+    AtoC = 0
+    AtoG = 0
+
+    Tseq = 0
+    TtoA = 0
+    TtoC = 0
+    TtoG = 0
+
+    Cseq = 0
+    CtoA = 0
+    CtoT = 0
+    CtoG = 0
+
+    Gseq = 0
+    GtoA = 0
+    GtoT = 0
+    GtoC = 0
+
+    ins = {0:0}
+
+    dels = {0:0}
+
+    #mpFile = open("testMPfile.mutpos", "w") #ADDED
+    #mpFirst = True #ADDED
+    for line in f:
+          linebins = line.split()
+
+    #convert sequence information to uppercase
+          linebins[4] = linebins[4].replace('t','T')
+          linebins[4] = linebins[4].replace('c','C')
+          linebins[4] = linebins[4].replace('g','G')
+          linebins[4] = linebins[4].replace('a','A')
+          linebins[4] = linebins[4].replace('n','N')
+
+    #count depth
+          depth = int(linebins[3]) - linebins[4].count('N')
+
+      #count and remove insertions
+          newIns = list(map(int, re.findall(r'\+\d+', linebins[4])))
+          if o.unique:
+              newIns = list(set(newIns))
+          for length in newIns:
+              if length not in ins:
+                  ins[length] = 1
+              else:
+                  ins[length] += 1
+              rmStr = r'\+' + str(length) + "."*length
+              linebins[4] = re.sub(rmStr, '', linebins[4])
+
+#count and remove deletions
+          newDels = list(map(str, re.findall(r'-\d+', linebins[4])))
+          if o.unique:
+              newDels = list(set(newDels))
+          for length in newDels:
+              length = int(length[1:])
+              if length not in dels:
+                  dels[length] = 1
+              else:
+                  dels[length] += 1
+              rmStr = r'-' + str(length) + "."*length
+              linebins[4] = re.sub(rmStr, '', linebins[4])
+
+    #skip sites that fall outside of specified start/end ranges, that have insufficient depth or that have clonal mutations or excess frequency of N's:
+          if o.end !=0 and int(linebins[1]) < o.start:
+                pass
+          elif o.end !=0 and int(linebins[1]) > o.end:
+                pass
+          elif (float(linebins[4].count('N'))/(float(depth) + float(linebins[4].count('N')))) > o.n_cutoff:
+                pass
+          elif depth < o.mindepth:
+                pass
+          elif (float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'), (max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0))) / float(depth)) > o.max_clonality:
+                pass
+          elif (float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'), (max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0))) / float(depth)) < o.min_clonality:
+                pass
+          else:
+              #remove N entries
+                #linebins[4] = linebins[4].replace('N','')
+              #remove start line and end line markers
+                linebins[4] = re.sub('\$','',linebins[4])
+                linebins[4] = re.sub('\^.','',linebins[4])
+
+    #count point mutations
+
+                if linebins[2] == 'A':
+                      Aseq += depth
+                      if linebins[4].count('T') > 0: AtoT += (1 if o.unique else linebins[4].count('T'))
+                      if linebins[4].count('C') > 0: AtoC += (1 if o.unique else linebins[4].count('C'))
+                      if linebins[4].count('G') > 0: AtoG += (1 if o.unique else linebins[4].count('G'))
+
+                elif linebins[2] == 'T':
+                      Tseq += depth
+                      if linebins[4].count('A') > 0: TtoA += (1 if o.unique else linebins[4].count('A'))
+                      if linebins[4].count('C') > 0: TtoC += (1 if o.unique else linebins[4].count('C'))
+                      if linebins[4].count('G') > 0: TtoG += (1 if o.unique else linebins[4].count('G'))
+
+                elif linebins[2] == 'C':
+                      Cseq += depth
+                      if linebins[4].count('A') > 0: CtoA += (1 if o.unique else linebins[4].count('A'))
+                      if linebins[4].count('T') > 0: CtoT += (1 if o.unique else linebins[4].count('T'))
+                      if linebins[4].count('G') > 0: CtoG += (1 if o.unique else linebins[4].count('G'))
+
+                elif linebins[2] == 'G':
+                      Gseq += depth
+                      if linebins[4].count('A') > 0: GtoA += (1 if o.unique else linebins[4].count('A'))
+                      if linebins[4].count('T') > 0: GtoT += (1 if o.unique else linebins[4].count('T'))
+                      if linebins[4].count('C') > 0: GtoC += (1 if o.unique else linebins[4].count('C'))
+                #if mpFirst: #ADDED
+                    #mpFirst = False #ADDED
+                #else: #ADDED
+                    #mpFile.write("\n") #ADDED
+                #mpFile.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s" % (linebins[0],linebins[2], linebins[1], depth, linebins[4].count('T') + linebins[4].count('C') + linebins[4].count('G') + linebins[4].count('A'), linebins[4].count('T'), linebins[4].count('C'), linebins[4].count('G'), linebins[4].count('A'), len(newIns), len(newDels), linebins[4].count('N'))) #ADDED
+
+    totalseq = Aseq + Tseq + Cseq + Gseq
+
+    totalptmut = AtoT + AtoC + AtoG + TtoA + TtoC + TtoG + CtoA + CtoT + CtoG + GtoA + GtoT + GtoC
+    totalindel = sum(ins) + sum(dels)
+
+    totalins = sum(ins[n] for n in ins.keys())
+    totaldels = sum(dels[n] for n in dels.keys())
+    #mpFile.close() #ADDED
+
+    print("\nMinimum depth: %s" % o.mindepth, file = fOut)
+    print("Clonality: %s - %s" % (o.min_clonality, o.max_clonality), file = fOut)
+    if o.end != 0:
+        print('Position: %s - %s' % (o.start, o.end), file = fOut)
+    if o.unique:
+        print('Unique Counts', file = fOut)
+    print("\nA's sequenced: %s" % Aseq, file = fOut)
+    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print(("A to T:\t%s" % AtoT) + ('\t%.2e\t%.2e\t%.2e' % Wilson(AtoT,  max(Aseq, 1))), file = fOut) #Output is in the form: Mutation type, number of times mutation is oberseved, frequency, 95% positive CI, 95% negative CI (Confidence Intervals are based on the Wilson Confidence Interval)
+    print(("A to C:\t%s" % AtoC) + ('\t%.2e\t%.2e\t%.2e' % Wilson(AtoC,  max(Aseq, 1))), file = fOut)
+    print(("A to G:\t%s" % AtoG) + ('\t%.2e\t%.2e\t%.2e' % Wilson(AtoG,  max(Aseq, 1))), file = fOut)
+    print("\nT's sequenced: %s" % Tseq, file = fOut)
+    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print(("T to A:\t%s" % TtoA) + ('\t%.2e\t%.2e\t%.2e' % Wilson(TtoA,   max(Tseq, 1))), file = fOut)
+    print(("T to C:\t%s" % TtoC) + ('\t%.2e\t%.2e\t%.2e' % Wilson(TtoC,  max(Tseq, 1))), file = fOut)
+    print(("T to G:\t%s" % TtoG) + ('\t%.2e\t%.2e\t%.2e' % Wilson(TtoG,   max(Tseq, 1))), file = fOut)
+    print("\nC's sequenced: %s" % Cseq, file = fOut)
+    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print(("C to A:\t%s" % CtoA) + ('\t%.2e\t%.2e\t%.2e' % Wilson(CtoA,  max(Cseq, 1))), file = fOut)
+    print(("C to T:\t%s" % CtoT) + ('\t%.2e\t%.2e\t%.2e' % Wilson(CtoT,   max(Cseq, 1))), file = fOut)
+    print(("C to G:\t%s" % CtoG) + ('\t%.2e\t%.2e\t%.2e' % Wilson(CtoG,   max(Cseq, 1))), file = fOut)
+    print("\nG's sequenced: %s" % Gseq, file = fOut)
+    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print(("G to A:\t%s" % GtoA) + ('\t%.2e\t%.2e\t%.2e' % Wilson(GtoA,   max(Gseq, 1))), file = fOut)
+    print(("G to T:\t%s" % GtoT) + ('\t%.2e\t%.2e\t%.2e' % Wilson(GtoT,   max(Gseq, 1))), file = fOut)
+    print(("G to C:\t%s" % GtoC) + ('\t%.2e\t%.2e\t%.2e' % Wilson(GtoC,   max(Gseq, 1))), file = fOut)
+    print("\nTotal nucleotides sequenced: %s" % totalseq, file = fOut)
+    print("Total point mutations: %s" % totalptmut, file = fOut)
+    print("\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print('Overall point mutation frequency:\t%.2e\t%.2e\t%.2e\n' % Wilson(totalptmut, max(totalseq, 1)), file = fOut)
+
+    insKeys = sorted(ins.items(), key=lambda x: x[0])
+    print("Mutation type\t#\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    for n in insKeys:
+        print(('+%s insertions: %s' % (n[0], n[1])) + ('\t%.2e\t%.2e\t%.2e' % Wilson(n[1], max(totalseq,1))), file = fOut)
+    if dels != {}:
+        print('', file = fOut)
+    delsKeys = sorted(dels.items(), key=lambda x: x[0])
+    for n in delsKeys:
+        print(('-%s deletions: %s' % (n[0], n[1])) + ('\t%.2e\t%.2e\t%.2e' % Wilson(n[1], max(totalseq,1))), file = fOut)
+    print("\nTotal insertion events: %s" % totalins, file = fOut)
+    print("\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print("Overall insert frequency:\t%.2e\t%.2e\t%.2e" % Wilson(totalins, max(totalseq, 1)), file = fOut)
+    print("\nTotal deletion events: %s" % totaldels, file = fOut)
+    print("\tFrequency\t95% positive CI\t95% negative CI", file = fOut)
+    print("Overall deletion frequency:\t%.2e\t%.2e\t%.2e" % Wilson(totaldels, max(totalseq, 1)), file = fOut)
+
+
+# From Nat_Protocols_Version/mut-position.py
+def MutPos(o, f, fOut):
+    lines = f.readlines()
+
+    chrom=[]
+    pos=[]
+    muts = []
+    depths = []
+    template =[]
+    Tcount=[]
+    Ccount=[]
+    Gcount=[]
+    Acount=[]
+    inscount=[]
+    delcount=[]
+    Ncount=[]
+    for i,line in enumerate( lines ):
+
+          linebins = line.split()
+
+    #convert sequence information to uppercase
+          linebins[4] = linebins[4].replace('t','T')
+          linebins[4] = linebins[4].replace('c','C')
+          linebins[4] = linebins[4].replace('g','G')
+          linebins[4] = linebins[4].replace('a','A')
+          linebins[4] = linebins[4].replace('n','N')
+
+    #remove start line, end line, and N entries, as well as 1st and last nucleotide of a read.
+          linebins[4] = re.sub('\$','',linebins[4])
+          linebins[4] = re.sub('\^.','',linebins[4])
+          #linebins[4] = linebins[4].replace('N','')
+
+    #count and remove insertions
+          newIns = list(map(int, re.findall(r'\+\d+', linebins[4])))
+          for length in newIns:
+              rmStr = r'\+' + str(length) + "."*length
+              linebins[4] = re.sub(rmStr, '', linebins[4])
+
+    #count and remove deletions
+          newDels = list(map(str, re.findall(r'-\d+', linebins[4])))
+          for length in newDels:
+              length = int(length[1:])
+              rmStr = r'-' + str(length) + "."*length
+              linebins[4] = re.sub(rmStr, '', linebins[4])
+          linebins[4] = linebins[4].replace('*','')
+
+    #count depth
+          depth = int(linebins[3]) - linebins[4].count('N')
+
+    #skip lines that do not meet filtering criteria
+          if    (
+                depth < o.mindepth
+                or
+                ((float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'), (max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0))) / float(depth)) > o.clonal_max)
+                or
+                ((float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'), (max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0))) / float(depth)) < o.clonal_min)
+                or
+                (max(float(linebins[4].count('T')),float(linebins[4].count('C')),float(linebins[4].count('G')),float(linebins[4].count('A')),(max(newIns.count(n) for n in list(set(newIns))) if newIns != [] else 0), (max(newDels.count(m) for m in list(set(newDels))) if newDels != [] else 0)) < o.num_muts)
+                ):
+                pass
+
+          else:
+
+    #count position-specific mutation frequency
+
+                mut = linebins[4].count('T') + linebins[4].count('C') + linebins[4].count('G') + linebins[4].count('A')
+                Tcount.append(linebins[4].count('T'))
+                Ccount.append(linebins[4].count('C'))
+                Gcount.append(linebins[4].count('G'))
+                Acount.append(linebins[4].count('A'))
+                Ncount.append(linebins[4].count('N'))
+                inscount.append(len(newIns))
+                delcount.append(len(newDels))
+                chrom.append(linebins[0])
+                pos.append(linebins[1])
+                template.append(linebins[2])
+                depths.append(depth)
+                muts.append(mut)
+
+    script_output=zip(chrom, template, pos, depths, muts, Tcount, Ccount, Gcount, Acount, inscount, delcount, Ncount)
+
+    csv_writer = csv.writer(fOut, delimiter='\t')
+    csv_writer.writerows(script_output)
+
+
+# From Nat_Protocols_Version/muts_by_read_position.py, with the loop of
+# main() as a function of the input file, read length and clonality cutoff
+# myRead defines what information about each read needs to be stored.  
+class myRead:
+    def __init__(self, myStart, length):
+        self.counts = numpy.zeros((3, length), int)
+        self.fr = 'f' if myStart in ('R', 'M', 'U') else ('r' if myStart in ('r', 'm', 'u') else 'e')
+        if self.fr == 'e':
+            raise ValueError('first position is not a recognized pileup charecter')
+        if myStart.upper() == 'M': # First position is a mutation
+            self.counts[0, 0] += 1
+        elif myStart.upper() == 'U': # First position is an N
+            self.counts[2, 0] += 1
+        elif myStart.upper() == 'R': # First position is a reference
+            pass
+        self.skipMe = False
+        self.pos = 0
+        self.closeMe = False
+    
+    def addMut(self):
+        self.counts[0, self.pos] += 1
+    
+    def addIndel(self):
+        self.counts[1, self.pos] += 1
+    
+    def addN(self):
+        self.counts[2, self.pos] += 1
+    
+    def advance(self):
+        self.pos += 1
+    
+    def close(self):
+        if self.fr == 'r':
+            return(numpy.fliplr(self.counts))
+        else:
+            return(self.counts)
+# myCounts keeps track of the total counts so far and all current reads, as well as methods for manipulating them.
+class myCounts:
+    def __init__(self, length):
+        self.counts = numpy.zeros((3, length), float)
+        self.reads = []
+        self.myLen = length
+    
+    def newRead(self, myStart):
+        self.reads.append(myRead(myStart, self.myLen))
+    
+    def closeReads(self,readToClose = 0):
+        closed = 0
+        for read in range(len(self.reads)):
+            if self.reads[read-closed].closeMe == True:
+                self.counts += self.reads.pop(read-closed).close()
+                closed += 1
+    
+    def advanceReads(self):
+        for read in self.reads:
+            if read.skipMe == False:
+                read.advance()
+            else:
+                read.skipMe = False
+    
+    def muts(self):
+        return(self.counts[0, :])
+    
+    def indels(self):
+        return(self.counts[1, :])
+    def ns(self):
+        return(self.counts[2, :])
+    
+    def totals(self):
+        if self.counts[0, :].sum() != 0:
+            self.counts[0, :] /= self.counts[0, :].sum()
+        if self.counts[1, :].sum() != 0:
+            self.counts[1, :] /= self.counts[1, :].sum()
+        if self.counts[2, :].sum() != 0:
+            self.counts[2, :] /= self.counts[2, :].sum()
+
+# Prepare a line for processing
+def linePrep(line, maxCln):
+    linebins = line.split()
+    
+    # Remove lines with mutations that have clonality exceeding the cutoff
+    depth = max(int(linebins[3]) - linebins[4].count('N'),1)
+    clonality = (float(max(linebins[4].count('T'),linebins[4].count('C'),linebins[4].count('G'),linebins[4].count('A'),linebins[4].count('t'),linebins[4].count('c'),linebins[4].count('g'),linebins[4].count('a'))) / float(depth))
+    linebin = linebins[4]
+    if float(clonality) > float(maxCln):
+        linebin = re.sub(r'[tTcCgGaA]','.',linebin)
+    
+    #Convert start and end points
+    linebin = re.sub(r'\$','E',linebin)
+    linebin = re.sub(r'\^.\.','R', linebin)
+    linebin = re.sub(r'\^.[AGCT]','M', linebin)
+    linebin = re.sub(r'\^.N','U', linebin)
+    linebin = re.sub(r'\^.,', 'r', linebin)
+    linebin = re.sub(r'\^.[agct]','m', linebin)
+    linebin = re.sub(r'\^.n','u', linebin)
+    
+    #Convert insertions
+    newIns = list(map(int, re.findall(r'\+\d+', linebin)))
+    for length in newIns:
+        rmStr = r'\+' + str(length) + "."*length
+        linebin = re.sub(rmStr, str(length), linebin)
+    #Convert deletions
+    newDels = list(map(str, re.findall(r'-\d+', linebin)))
+    for length in newDels:
+        length = int(length[1:])
+        rmStr = r'-' + str(length) + "."*length
+        linebin = re.sub(rmStr, 'D', linebin)
+    linebin = linebin.replace('*', 'd')
+    return(linebin)
+
+def readPositions(f, rlength, maxCln):
+    counter = myCounts(rlength)
+    linenum = 0
+    lineskips = 0
+
+    for line in f:
+        linebin = linePrep(line, maxCln)
+        linenum += 1
+        readNum = 0
+        skips = 0
+        if linenum % 10000 == 0:
+            print('%s lines processed' % linenum)
+        try:
+            while readNum < len(linebin):
+                # Check what the identity of a charecter is
+                if linebin[readNum] in ('M', 'R', 'U', 'm', 'r', 'u'):
+                    # Start a new read
+                    counter.newRead(linebin[readNum]) 
+                elif linebin[readNum] == 'E':
+                    # Mark a read to be closed later
+                    skips += 1
+                    counter.reads[readNum - skips].closeMe = True
+                elif linebin[readNum] in ('A', 'G', 'C', 'T', 'a', 'g', 'c', 't'):
+                    # Count a mutation
+                    counter.reads[readNum-skips].addMut()
+                elif linebin[readNum] in ('1', '2', '3', '4', '5', '6', '7', '8', '9'):
+                    # Count an indel
+                    counter.reads[readNum-1-skips].addIndel()
+                    # Scroll the read with the indel forward the length of the indel, and mark indel length charecters to be skipped
+                    tst = 0
+                    indelLength = ''
+                    while readNum + tst < len(linebin) and linebin[readNum+tst] in ('0', '1', '2', '3', '4', '5', '6', '7', '8', '9'):
+                        indelLength += linebin[readNum + tst]
+                        skips += 1
+                        tst += 1
+                    for x in range(int(indelLength)):
+                        counter.reads[readNum-1-skips+tst].advance()
+                elif linebin[readNum] == 'D':
+                    counter.reads[readNum-skips-1].addIndel()
+                    skips += 1
+                elif linebin[readNum] == 'd':
+                    counter.reads[readNum-skips].skipMe = True
+                elif linebin[readNum] in ('N', 'n'):
+                    # Count an N
+                    counter.reads[readNum-skips].addN()
+                elif linebin[readNum] in ('.', ','):
+                    pass
+                else:
+                    raise ValueError("Not a valid pileup value at %s: %s" % (readNum, linebin[readNum]))
+                readNum += 1
+        except Exception:
+            print('%s[%s]: %s' % (linenum, readNum, linebin))
+            raise
+        # Close any reads marked for closing
+        counter.closeReads()
+        # Advance all reads
+        counter.advanceReads()
+    return counter
@@ -0,0 +1,137 @@
+"""resume.py
+Crash and resume checks of UnifiedConsensusMaker.py's checkpoints.
+
+Each check runs UnifiedConsensusMaker.py once on a small synthetic
+library, leaves its checkpoint manifest and .partial files the way a run
+that crashed at some point would, runs it again and compares the
+consensus FASTQs and tagstats with those of the first run.  The program
+exits with status 1 if any check fails.
+
+Checks:
+    before_first_commit   consensus calling started (the manifest has
+                          the stage, without any progress) and wrote
+                          part of its .partial files, but died before
+                          its first --checkpoint-every commit
+
+usage: python -m benchmarks.resume [--only NAME] [library options]
+"""
+
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+from benchmarks import REPO_ROOT
+from benchmarks.synthetic import add_library_arguments, library_from_args
+
+
+def run_unified(library, in_bam, prefix):
+    return subprocess.run(
+        [sys.executable,
+         os.path.join(REPO_ROOT, 'UnifiedConsensusMaker.py'),
+         '--input', in_bam,
+         '--prefix', prefix,
+         '--taglen', str(library.tag_len),
+         '--spacerlen', str(library.spacer_len),
+         '--loclen', str(library.loc_len),
+         '--write-sscs',
+         '--tagstats'
+         ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+        )
+
+
+def consensus_outputs(prefix):
+    """The text of the consensus outputs of a run, by file name suffix."""
+    outputs = {}
+    for suffix in ('_read1_sscs.fq.gz', '_read2_sscs.fq.gz',
+                   '_read1_dcs.fq.gz', '_read2_dcs.fq.gz'):
+        with gzip.open(prefix + suffix, 'rt') as in_file:
+            outputs[suffix] = in_file.read()
+    with open(prefix + '.tagstats.txt') as in_file:
+        outputs['.tagstats.txt'] = in_file.read()
+    return outputs
+
+
+def crash_before_first_commit(prefix):
+    # What Manifest.start('consensus', ...) leaves, and some output that
+    # was never committed.
+    manifest_path = prefix + '.checkpoint.json'
+    with open(manifest_path) as in_file:
+        manifest = json.load(in_file)
+    stages = manifest['stages']
+    stages['consensus'] = {'inputs': stages['sort']['outputs'],
+                           'done': False
+                           }
+    with open(manifest_path, 'w') as out_file:
+        json.dump(manifest, out_file)
+    for name in os.listdir(os.path.dirname(prefix)):
+        path = os.path.join(os.path.dirname(prefix), name)
+        if name.endswith('.fq.gz') or name.endswith('.famsizes.gz'):
+            with gzip.open(path) as in_file:
+                start = in_file.read(1000)
+            os.remove(path)
+            with gzip.open(path + '.partial', 'wb') as out_file:
+                out_file.write(start)
+
+
+CHECKS = {
+    'before_first_commit': crash_before_first_commit,
+}
+
+
+def check(name, crash, library, in_bam, expected, tmp_dir):
+    prefix = os.path.join(tmp_dir, name, 'run')
+    os.makedirs(os.path.dirname(prefix))
+    for attempt in ('first', 'resumed'):
+        result = run_unified(library, in_bam, prefix)
+        if result.returncode != 0:
+            print(f"{name}: the {attempt} run failed:\n{result.stderr}")
+            return False
+        if attempt == 'first':
+            crash(prefix)
+    outputs = consensus_outputs(prefix)
+    differ = sorted(suffix for suffix in expected
+                    if outputs[suffix] != expected[suffix]
+                    )
+    if differ:
+        print(f"{name}: the resumed run differs in {', '.join(differ)}")
+        return False
+    print(f"{name}: resumed run agrees")
+    return True
+
+
+def main():
+    parser = ArgumentParser()
+    add_library_arguments(parser)
+    parser.add_argument('--only', dest='only', action='append',
+                        choices=sorted(CHECKS),
+                        help="Run only this check (may be repeated).")
+    parser.set_defaults(molecules=300)
+    o = parser.parse_args()
+    library = library_from_args(o)
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_bam = os.path.join(tmp_dir, 'library.unaligned.bam')
+        library.write_unaligned_bam(in_bam)
+        prefix = os.path.join(tmp_dir, 'expected', 'run')
+        os.makedirs(os.path.dirname(prefix))
+        result = run_unified(library, in_bam, prefix)
+        if result.returncode != 0:
+            sys.exit(f"The uninterrupted run failed:\n{result.stderr}")
+        expected = consensus_outputs(prefix)
+        for name, crash in CHECKS.items():
+            if o.only and name not in o.only:
+                continue
+            ok &= check(name, crash, library, in_bam, expected, tmp_dir)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
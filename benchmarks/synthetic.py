@@ -0,0 +1,296 @@
+"""synthetic.py
+Seeded generator of synthetic Duplex Sequencing libraries.
+
+Each simulated molecule gets a random alpha and beta tag and a random
+insert.  Reads from the ab strand carry alpha on read 1 and beta on
+read 2; reads from the ba strand carry them the other way round, with
+read 1 and read 2 covering the opposite ends of the insert, as in a real
+duplex library:
+
+    ab read 1: alpha + spacer + insert
+    ab read 2: beta  + spacer + reverse_complement(insert)
+    ba read 1: beta  + spacer + reverse_complement(insert)
+    ba read 2: alpha + spacer + insert
+
+The number of reads per molecule is drawn from --family_size, split
+between the two strands with --ab_fraction, and every base is replaced by
+a sequencing error with probability --error_rate.  The same --seed always
+gives the same library.
+
+Family size distributions are given as <kind>:<parameters>:
+
+    fixed:N             every molecule has N reads
+    poisson:MEAN        1 + Poisson(MEAN - 1)
+    geometric:MEAN      geometric with the given mean (>= 1)
+    lognormal:MU,SIGMA  round(exp(Normal(MU, SIGMA))), at least 1
+
+Outputs are an unaligned, paired BAM file like the one made by Picard
+FastqToSam (input for UnifiedConsensusMaker.py) and/or a pair of FASTQ
+files with CASAVA 1.8 read names (input for tag_to_header.py).
+
+usage: python -m benchmarks.synthetic --prefix PREFIX [options]
+"""
+
+import gzip
+import math
+import random
+from argparse import ArgumentParser
+
+COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+HIGH_QUAL = 'I'
+ERROR_QUAL = '+'
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def family_size_sampler(spec, rng):
+    """Return a function that draws family sizes according to spec."""
+    kind, _, args = spec.partition(':')
+    if kind == 'fixed':
+        size = int(args)
+        return lambda: size
+    if kind == 'poisson':
+        mean = float(args) - 1
+
+        def poisson():
+            # Knuth's method; means used here are small.
+            limit = math.exp(-mean)
+            k = 0
+            p = rng.random()
+            while p > limit:
+                k += 1
+                p *= rng.random()
+            return k + 1
+        return poisson
+    if kind == 'geometric':
+        p = 1.0 / float(args)
+
+        def geometric():
+            if p >= 1:
+                return 1
+            return 1 + int(math.log(1.0 - rng.random()) / math.log(1.0 - p))
+        return geometric
+    if kind == 'lognormal':
+        mu, sigma = (float(x) for x in args.split(','))
+        return lambda: max(1, int(round(rng.lognormvariate(mu, sigma))))
+    raise ValueError(f"Unknown family size distribution: {spec}")
+
+
+class Molecule:
+    __slots__ = ('index', 'alpha', 'beta', 'insert', 'ab_reads', 'ba_reads',
+                 'contig', 'start', 'mutations')
+
+    def __init__(self, index, alpha, beta, insert, ab_reads, ba_reads):
+        self.index = index
+        self.alpha = alpha
+        self.beta = beta
+        self.insert = insert
+        self.ab_reads = ab_reads
+        self.ba_reads = ba_reads
+        # Set for molecules placed on a reference (see aligned.py);
+        # mutations maps insert offsets to planted alternate bases.
+        self.contig = None
+        self.start = None
+        self.mutations = {}
+
+
+class SyntheticLibrary:
+    def __init__(self, seed=1, molecules=1000, tag_len=12, spacer_len=5,
+                 loc_len=0, read_len=101, insert_len=None,
+                 family_size='poisson:6', error_rate=0.001, ab_fraction=0.5,
+                 index='ACGTAC', shuffle=True, rep_filt=None):
+        self.seed = seed
+        self.tag_len = tag_len
+        self.spacer_len = spacer_len
+        self.loc_len = loc_len
+        self.read_len = read_len
+        self.body_len = read_len - tag_len - spacer_len
+        if self.body_len <= loc_len:
+            raise ValueError("read_len is too short for the tag and spacer")
+        self.insert_len = insert_len if insert_len else 2 * self.body_len
+        self.family_size = family_size
+        self.error_rate = error_rate
+        self.ab_fraction = ab_fraction
+        self.index = index
+        self.shuffle = shuffle
+        # Avoid tags that ConsensusMaker's --rep_filt would throw away.
+        self.rep_filt = rep_filt
+
+        rng = random.Random(seed)
+        self.spacer = self._random_seq(rng, spacer_len)
+        draw_size = family_size_sampler(family_size, rng)
+        self.molecules = []
+        for i in range(molecules):
+            alpha = self._random_seq(rng, tag_len)
+            beta = self._random_seq(rng, tag_len)
+            while beta == alpha or self._repetitive(alpha, beta):
+                alpha = self._random_seq(rng, tag_len)
+                beta = self._random_seq(rng, tag_len)
+            size = draw_size()
+            ab_reads = sum(1 for _ in range(size) if rng.random() < ab_fraction)
+            molecule = Molecule(i, alpha, beta, None, ab_reads, size - ab_reads)
+            self._make_insert(rng, molecule)
+            self.molecules.append(molecule)
+
+    @staticmethod
+    def _random_seq(rng, length):
+        return ''.join(rng.choice('ACGT') for _ in range(length))
+
+    def _repetitive(self, alpha, beta):
+        if self.rep_filt is None:
+            return False
+        return any(base * self.rep_filt in tags
+                   for tags in (alpha + beta, beta + alpha)
+                   for base in 'ACGT'
+                   )
+
+    def _make_insert(self, rng, molecule):
+        molecule.insert = self._random_seq(rng, self.insert_len)
+
+    def read_count(self):
+        return sum(m.ab_reads + m.ba_reads for m in self.molecules)
+
+    def read_pairs(self):
+        """Yield (name, seq1, qual1, seq2, qual2, molecule, strand)."""
+        tickets = [(m.index, 'ab') for m in self.molecules
+                   for _ in range(m.ab_reads)]
+        tickets += [(m.index, 'ba') for m in self.molecules
+                    for _ in range(m.ba_reads)]
+        rng = random.Random(self.seed + 1)
+        if self.shuffle:
+            rng.shuffle(tickets)
+        for pair_num, (index, strand) in enumerate(tickets):
+            molecule = self.molecules[index]
+            forward = molecule.insert[:self.body_len]
+            reverse = reverse_complement(molecule.insert)[:self.body_len]
+            # Planted mutations are kept free of sequencing errors so
+            # that their expected counts are exact.
+            trim = self.tag_len + self.spacer_len
+            forward_protected = [trim + x for x in molecule.mutations
+                                 if x < self.body_len]
+            reverse_protected = [trim + self.insert_len - 1 - x
+                                 for x in molecule.mutations
+                                 if self.insert_len - 1 - x < self.body_len]
+            if strand == 'ab':
+                seq1, qual1 = self._add_errors(
+                    rng, molecule.alpha + self.spacer + forward,
+                    forward_protected)
+                seq2, qual2 = self._add_errors(
+                    rng, molecule.beta + self.spacer + reverse,
+                    reverse_protected)
+            else:
+                seq1, qual1 = self._add_errors(
+                    rng, molecule.beta + self.spacer + reverse,
+                    reverse_protected)
+                seq2, qual2 = self._add_errors(
+                    rng, molecule.alpha + self.spacer + forward,
+                    forward_protected)
+            name = f"SYN:1:FC0001:1:{1101 + pair_num // 1000000}:" \
+                   f"{pair_num % 1000000}:{index}"
+            yield name, seq1, qual1, seq2, qual2, molecule, strand
+
+    def _add_errors(self, rng, seq, protected=()):
+        if self.error_rate <= 0:
+            return seq, HIGH_QUAL * len(seq)
+        seq = list(seq)
+        qual = [HIGH_QUAL] * len(seq)
+        for i in range(len(seq)):
+            if rng.random() < self.error_rate and i not in protected:
+                seq[i] = rng.choice('ACGT'.replace(seq[i], ''))
+                qual[i] = ERROR_QUAL
+        return ''.join(seq), ''.join(qual)
+
+    def write_fastq(self, path1, path2):
+        def open_out(path):
+            return gzip.open(path, 'wt') if path.endswith('.gz') \
+                else open(path, 'w')
+        with open_out(path1) as out1, open_out(path2) as out2:
+            for name, seq1, qual1, seq2, qual2, _, _ in self.read_pairs():
+                out1.write(f"@{name} 1:N:0:{self.index}\n{seq1}\n+\n{qual1}\n")
+                out2.write(f"@{name} 2:N:0:{self.index}\n{seq2}\n+\n{qual2}\n")
+
+    def write_unaligned_bam(self, path):
+        import pysam
+        header = {'HD': {'VN': '1.5', 'SO': 'unsorted'},
+                  'RG': [{'ID': 'A', 'SM': 'synthetic', 'PL': 'illumina'}]
+                  }
+        with pysam.AlignmentFile(path, 'wb', header=header) as out_bam:
+            for name, seq1, qual1, seq2, qual2, _, _ in self.read_pairs():
+                for flag, seq, qual in ((77, seq1, qual1),
+                                        (141, seq2, qual2)):
+                    read = pysam.AlignedSegment(out_bam.header)
+                    read.query_name = name
+                    read.flag = flag
+                    read.query_sequence = seq
+                    read.query_qualities = pysam.qualitystring_to_array(qual)
+                    read.set_tag('RG', 'A', 'Z')
+                    out_bam.write(read)
+
+
+def add_library_arguments(parser):
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help="Random seed. [%(default)s]")
+    parser.add_argument('--molecules', dest='molecules', type=int,
+                        default=1000,
+                        help="Number of duplex molecules. [%(default)s]")
+    parser.add_argument('--taglen', dest='tag_len', type=int, default=12,
+                        help="Length of each duplex tag. [%(default)s]")
+    parser.add_argument('--spacerlen', dest='spacer_len', type=int,
+                        default=5,
+                        help="Length of the spacer. [%(default)s]")
+    parser.add_argument('--loclen', dest='loc_len', type=int, default=0,
+                        help=("Number of insert bases used for location "
+                              "specificity by the consensus makers. "
+                              "[%(default)s]"))
+    parser.add_argument('--readlen', dest='read_len', type=int, default=101,
+                        help="Raw read length. [%(default)s]")
+    parser.add_argument('--family_size', dest='family_size',
+                        default='poisson:6',
+                        help="Family size distribution. [%(default)s]")
+    parser.add_argument('--error_rate', dest='error_rate', type=float,
+                        default=0.001,
+                        help="Per-base sequencing error rate. [%(default)s]")
+    parser.add_argument('--ab_fraction', dest='ab_fraction', type=float,
+                        default=0.5,
+                        help=("Fraction of each family sequenced from the "
+                              "ab strand. [%(default)s]"))
+
+
+def library_from_args(o):
+    return SyntheticLibrary(seed=o.seed,
+                            molecules=o.molecules,
+                            tag_len=o.tag_len,
+                            spacer_len=o.spacer_len,
+                            loc_len=o.loc_len,
+                            read_len=o.read_len,
+                            family_size=o.family_size,
+                            error_rate=o.error_rate,
+                            ab_fraction=o.ab_fraction
+                            )
+
+
+def main():
+    parser = ArgumentParser()
+    add_library_arguments(parser)
+    parser.add_argument('--prefix', dest='prefix', required=True,
+                        help="Prefix for the output files.")
+    parser.add_argument('--format', dest='formats', action='append',
+                        choices=['bam', 'fastq'], default=None,
+                        help=("Output format; can be given more than once. "
+                              "[bam and fastq]"))
+    o = parser.parse_args()
+    formats = o.formats if o.formats else ['bam', 'fastq']
+
+    library = library_from_args(o)
+    if 'bam' in formats:
+        library.write_unaligned_bam(f"{o.prefix}.unaligned.bam")
+    if 'fastq' in formats:
+        library.write_fastq(f"{o.prefix}.seq1.fq.gz", f"{o.prefix}.seq2.fq.gz")
+    print(f"{len(library.molecules)} molecules, "
+          f"{library.read_count()} read pairs")
+
+
+if __name__ == "__main__":
+    main()
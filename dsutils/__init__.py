@@ -0,0 +1,8 @@
+"""dsutils
+Helper modules shared by UnifiedConsensusMaker.py and the programs in
+Nat_Protocols_Version.
+
+The programs in Nat_Protocols_Version add the repository root to
+sys.path before importing from here, so the package does not need to
+be installed.
+"""
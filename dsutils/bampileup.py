@@ -0,0 +1,749 @@
+"""bampileup.py
+The pileup of a position-sorted BAM file, counted straight from its
+reads, for CountMuts.py, mut-position.py and PileupStats.py.
+
+bam_blocks() yields blocks that the programs use as they would the
+dsutils.pileup blocks of 'samtools mpileup -B -A -f REF' text, but no
+text is made: the reads of a stretch of a contig are laid out in NumPy
+arrays, one entry per aligned base or deleted position, and the depth,
+base, mapping quality and indel counts of every position are added up
+from those.
+
+The counts are the ones the text of samtools mpileup (1.24) would give,
+which takes following it in these details:
+
+    Unmapped, secondary, QC-failed and duplicate reads, and reads that
+    start past the end of the reference, are left out.
+    A base with a base quality under min_base_quality is left out of its
+    line, together with the read start, indel and read end written with
+    it.  A deleted position goes by the quality of the base after the
+    deletion.
+    Where the two reads of a proper pair overlap, one of the two bases
+    is given quality 0.  If they agree, one read keeps the base, with
+    the sum of the two qualities (at most 200); which one depends on a
+    hash of the read name.  If they do not, the read with the higher
+    quality keeps it, at 0.8 of it, and the same hash breaks ties.
+    This is htslib's tweak_overlap_quality(), which also changes the
+    bases next to a deletion in one read as it steps over it, and which
+    runs when the later read is read: the lines made before then keep
+    the earlier read's own qualities.
+    A base matches the reference if their IUPAC codes are the same, in
+    either case, so an N read over an N is a match.
+    An insertion written after a base includes padding, and is followed
+    by the deletion after it, if there is one.
+    Every position covered by a read has a line, even if none of the
+    bases are left (a depth of 0).
+
+Unlike mpileup there is no maximum depth (-d), and base modifications
+(MM tags) are not shown.
+"""
+
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+import numpy
+
+from dsutils.pileup import CODES, count_table, has_prefix
+
+# mpileup's default --ff: unmapped, secondary, QC-failed and duplicate
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+MIN_BASE_QUALITY = 13
+
+# Aligned bases read before the counts of a block are made
+BLOCK_BASES = 1 << 22
+
+_MATCHES = (0, 7, 8)  # M, = and X
+_INS, _DEL, _REF_SKIP, _SOFT_CLIP, _PAD = 1, 2, 3, 4, 6
+
+# The 4-bit codes of htslib, which compare bases to the reference
+_NT16 = numpy.full(256, 15, numpy.uint8)
+for _code, _base in enumerate('=ACMGRSVTWYHKDBN'):
+    _NT16[ord(_base)] = _NT16[ord(_base.lower())] = _code
+
+
+class _Read:
+    # A read, laid out by its CIGAR.  matches holds (reference start,
+    # query start, length) of each run of aligned bases, gaps (reference
+    # start, length, query position of the next base, whether it is a
+    # reference skip) of each deletion and skip, and indels (reference
+    # position, query position of the base, insertion, deletion length)
+    # of each indel written after a base.  head is the query position
+    # of the first base, as for a gap if the read starts with one.
+    __slots__ = ('start', 'end', 'reverse', 'mapq', 'seq', 'qual', 'cigar',
+                 'matches', 'gaps', 'indels', 'head', 'head_match', 'mate',
+                 'name', 'tweaked_from', 'index')
+
+    def __init__(self, read, start, end, seq, qual):
+        self.start = start
+        self.end = end
+        self.reverse = read.flag & 16 != 0
+        self.mapq = read.mapping_quality
+        self.seq = seq
+        self.qual = qual
+        # For the later read of a pair: the earlier read, the name, and
+        # the first line made after their overlap was found
+        self.mate = None
+        self.name = None
+        self.tweaked_from = None
+        self.matches = []
+        self.gaps = []
+        self.indels = []
+        self.cigar = cigar = read.cigartuples
+        if len(cigar) == 1 and cigar[0][0] in _MATCHES:
+            # Most reads: one run of aligned bases
+            self.head = 0
+            self.head_match = True
+            self.matches.append((start, 0, end - start))
+            return
+        self.head = None
+        ref = start
+        query = 0
+        for k, (op, length) in enumerate(cigar):
+            if op in _MATCHES:
+                if self.head is None:
+                    self.head = query
+                    self.head_match = True
+                self.matches.append((ref, query, length))
+                ref += length
+                query += length
+                base = query - 1
+            elif op == _DEL or op == _REF_SKIP:
+                if self.head is None:
+                    self.head = query
+                    self.head_match = False
+                self.gaps.append((ref, length, query, op == _REF_SKIP))
+                ref += length
+                base = query
+            else:
+                if op == _INS or op == _SOFT_CLIP:
+                    query += length
+                continue
+            if k + 1 < len(cigar):
+                indel = _indel(cigar, k, query, seq)
+                if indel is not None:
+                    self.indels.append((ref - 1, base) + indel)
+
+
+def _indel(cigar, k, query, seq):
+    # The insertion and deletion length written after the last base of
+    # operation k, or None.
+    op, next_op = cigar[k][0], cigar[k + 1][0]
+    if next_op == _DEL:
+        if op == _DEL:
+            return None  # Part of the same deletion
+        length = 0
+        for op, op_length in cigar[k + 1:]:
+            if op != _DEL:
+                break
+            length += op_length
+        return b'', length
+    inserted = []
+    inserts = False
+    j = k + 1
+    while j < len(cigar) and cigar[j][0] in (_INS, _PAD):
+        op, length = cigar[j]
+        if op == _INS:
+            inserted.append(seq[query:query + length])
+            query += length
+            inserts = True
+        else:
+            inserted.append(b'*' * length)
+        j += 1
+    if not inserts:
+        return None
+    deletion = cigar[j][1] if j < len(cigar) and cigar[j][0] == _DEL else 0
+    return b''.join(inserted), deletion
+
+
+class BamBlock:
+    """The lines of the pileup of one stretch of a contig.
+
+    n, depth, pos, ref, bases, quals, indels, dropped, ins, dels and
+    irregular are set as for a dsutils.pileup.PileupBlock of the
+    mpileup text, and lines is None.  The only irregular lines are
+    those where the length of one insertion (or deletion) is a prefix
+    of another's; line() makes their text.
+    """
+
+    lines = None
+
+    def site(self, i):
+        """The chromosome, position and reference columns of line i."""
+        return self.contig, str(self.pos[i]), chr(self.ref[i])
+
+    def line(self, i):
+        """The first five columns of line i of the mpileup text."""
+        pos = int(self.pos[i]) - 1
+        ref = self._ref[pos - self._start:]
+        column = []
+        # The reads are in order of their starts.
+        first = bisect_left(self._starts, pos - self._longest + 1)
+        last = bisect_right(self._starts, pos)
+        for read, offset, tweaked in zip(self._reads[first:last],
+                                         self._offsets[first:last],
+                                         self._tweaked_from[first:last]):
+            if pos >= read.end:
+                continue
+            for start, query, length in read.matches:
+                if start <= pos < start + length:
+                    query += pos - start
+                    base = read.seq[query:query + 1]
+                    if base == b'=' or _NT16[base[0]] == _NT16[ref[0]]:
+                        base = b',' if read.reverse else b'.'
+                    break
+            else:
+                for start, length, query, skip in read.gaps:
+                    if start <= pos < start + length:
+                        base = b'*'
+                        if skip:
+                            base = b'<' if read.reverse else b'>'
+                        break
+            if query >= len(read.seq):
+                quality = 0
+            elif pos < tweaked:
+                quality = self._original[offset + query]
+            else:
+                quality = self._qual[offset + query]
+            if quality < self._min_base_quality:
+                continue
+            if pos == read.start:
+                column.append(b'^' + bytes([min(read.mapq, 93) + 33]))
+            text = [base]
+            for indel_pos, _, inserted, deletion in read.indels:
+                if indel_pos == pos:
+                    if inserted:
+                        text.append(b'+%d' % len(inserted) + inserted)
+                    if deletion:
+                        text.append(b'-%d' % deletion
+                                    + ref[1:1 + deletion].upper())
+            text = b''.join(text)
+            column.append(text.lower() if read.reverse else text)
+            if pos == read.end - 1:
+                column.append(b'$')
+        return '%s\t%d\t%s\t%d\t%s' % (
+            self.contig, pos + 1, chr(self.ref[i]), self.depth[i],
+            b''.join(column).decode('ascii') or '*')
+
+
+def _name_hashes(names):
+    # The parts of the hash of each read name that htslib uses to choose
+    # which of two overlapping reads keeps a base: __ac_X31_hash_string,
+    # then __ac_Wang_hash.
+    codes = numpy.array(names, 'S').view(numpy.uint8).reshape(len(names), -1)
+    key = codes[:, 0].astype(numpy.uint32)
+    for column in codes.T[1:]:
+        key = numpy.where(column != 0, key * numpy.uint32(31) + column, key)
+    key += ~(key << numpy.uint32(15))
+    key ^= key >> numpy.uint32(10)
+    key += key << numpy.uint32(3)
+    key ^= key >> numpy.uint32(6)
+    key += ~(key << numpy.uint32(11))
+    key ^= key >> numpy.uint32(16)
+    return key
+
+
+def _tweak_overlaps(seq, qual, first, second, first_kept):
+    # Give one base of each overlapping pair quality 0: first and second
+    # are where the bases of the earlier and the later read are, and
+    # first_kept whether the earlier read keeps the base if they agree.
+    kept = numpy.where(first_kept, first, second)
+    other = numpy.where(first_kept, second, first)
+    kept_qual = qual[kept].astype(numpy.intp)
+    other_qual = qual[other].astype(numpy.intp)
+    same = _NT16[seq[kept]] == _NT16[seq[other]]
+    stays = same | (kept_qual >= other_qual)
+    qual[kept] = numpy.where(
+        same, numpy.minimum(kept_qual + other_qual, 200),
+        numpy.where(stays, (0.8 * kept_qual).astype(numpy.intp), 0))
+    qual[other] = numpy.where(stays, 0, (0.8 * other_qual).astype(numpy.intp))
+
+
+class _Walk:
+    # A walk over the aligned bases of a read, as htslib makes it to
+    # find the overlap of a pair (cigar_iref2iseq_set and _next): iseq
+    # and iref are the query position and reference offset of the
+    # current base, k its operation and icig its place in it.
+    __slots__ = ('cigar', 'k', 'icig', 'iseq', 'iref', 'found')
+
+    def __init__(self, cigar, offset):
+        self.cigar = cigar
+        self.k = self.icig = self.iseq = self.iref = 0
+        self.found = False
+        if offset < 0:
+            return
+        while self.k < len(cigar):
+            op, length = cigar[self.k]
+            if op in _MATCHES:
+                offset -= length
+                if offset < 0:
+                    self.icig = length + offset
+                    self.iseq += self.icig
+                    self.iref += self.icig
+                    self.found = True
+                    return
+                self.iseq += length
+                self.iref += length
+            elif op == _DEL or op == _REF_SKIP:
+                offset = max(offset - length, 0)
+                self.iref += length
+            elif op == _INS or op == _SOFT_CLIP:
+                self.iseq += length
+            self.k += 1
+            self.icig = 0
+
+    def next(self):
+        """Step to the next aligned base; False past the last one."""
+        cigar = self.cigar
+        while self.k < len(cigar):
+            op, length = cigar[self.k]
+            if op in _MATCHES:
+                if self.icig < length - 1:
+                    self.iseq += 1
+                    self.icig += 1
+                    self.iref += 1
+                    return True
+            elif op == _DEL or op == _REF_SKIP:
+                self.iref += length
+            elif op == _INS or op == _SOFT_CLIP:
+                self.iseq += length
+            self.k += 1
+            self.icig = -1
+        return False
+
+    def after_deletion(self):
+        return self.k > 0 and self.cigar[self.k - 1][0] == _DEL
+
+
+def _tweak_gapped_pair(first, second, first_kept, seq, qual, offsets):
+    # _tweak_overlaps for a pair with deletions or reference skips,
+    # base by base, as htslib's tweak_overlap_quality() does it: where
+    # one read has a deletion, the bases of the other read over it lose
+    # their quality too (or keep 0.8 of it, in the read that keeps the
+    # bases).
+    a = _Walk(first.cigar, second.start - first.start)
+    b = _Walk(second.cigar, 0)
+    if not (a.found and b.found):
+        return
+    a_offset = offsets[first.index]
+    b_offset = offsets[second.index]
+    a_ok = b_ok = True
+    iref = second.start
+    while True:
+        while a_ok and a.iref < iref - first.start:
+            a_ok = a.next()
+        while a_ok and b_ok and b.iref < iref - second.start:
+            b_ok = b.next()
+        if not (a_ok and b_ok):
+            return
+        a_pos = a.iref + first.start
+        b_pos = b.iref + second.start
+        iref = max(iref, a_pos, b_pos) + 1
+        if a_pos < b_pos and b.after_deletion():
+            while a_pos < b_pos:
+                at = a_offset + a.iseq
+                qual[at] = int(0.8 * qual[at]) if first_kept else 0
+                if not a.next():
+                    return
+                a_pos = a.iref + first.start
+        elif a_pos != b_pos and a.after_deletion():
+            # Even if b is ahead: htslib steps b at least once.
+            while True:
+                at = b_offset + b.iseq
+                qual[at] = 0 if first_kept else int(0.8 * qual[at])
+                if not b.next():
+                    return
+                b_pos = b.iref + second.start
+                if b_pos >= a_pos:
+                    break
+        elif a_pos != b_pos:
+            continue  # A reference skip: catch up without a change
+        if a.iseq >= len(first.seq) or b.iseq >= len(second.seq):
+            return
+        a_at = a_offset + a.iseq
+        b_at = b_offset + b.iseq
+        a_qual = int(qual[a_at])
+        b_qual = int(qual[b_at])
+        if _NT16[seq[a_at]] == _NT16[seq[b_at]]:
+            both = min(a_qual + b_qual, 200)
+            qual[a_at] = both if first_kept else 0
+            qual[b_at] = 0 if first_kept else both
+        elif a_qual > b_qual or (a_qual == b_qual and first_kept):
+            qual[a_at] = int(0.8 * a_qual)
+            qual[b_at] = 0
+        else:
+            qual[b_at] = int(0.8 * b_qual)
+            qual[a_at] = 0
+
+
+def _expand(starts, lengths):
+    # Every position of the runs of lengths from starts
+    within = numpy.arange(int(lengths.sum())) - numpy.repeat(
+        numpy.cumsum(lengths) - lengths, lengths)
+    return numpy.repeat(starts, lengths) + within
+
+
+class _Pileup:
+    # The reads of one contig that are still to be counted, from
+    # position start on
+    def __init__(self, contig, fasta_file, start, min_base_quality,
+                 block_bases):
+        self.contig = contig
+        self.fasta_file = fasta_file
+        self.length = fasta_file.get_reference_length(contig)
+        self.start = start
+        self.min_base_quality = min_base_quality
+        self.block_bases = block_bases
+        self.reads = []
+        self.bases = 0  # Bases covered by the reads added since the last block
+        self.last_start = -1
+        # Reads whose mates are still to come, by name
+        self.waiting = {}
+
+    def add(self, read):
+        """Add a read, in file order; returns a BamBlock or None."""
+        start = read.reference_start
+        if start < self.last_start:
+            raise ValueError("%s is not sorted by position"
+                             % read.query_name)
+        end = read.reference_end
+        if start >= self.length or end is None or end <= start:
+            return None
+        # mpileup has made the lines before the previous read's start,
+        # and no more until this read is added.
+        made = self.last_start
+        block = None
+        if self.bases >= self.block_bases and made > self.start:
+            block = self.count(made)
+        self.last_start = start
+
+        seq = read.query_sequence
+        if seq is None:
+            # No bases: the read only covers its positions.
+            length = read.infer_query_length()
+            seq = b'N' * length
+            qual = bytes(length)
+        else:
+            seq = seq.encode('ascii')
+            qual = read.query_qualities
+            qual = b'\xff' * len(seq) if qual is None else qual.tobytes()
+        this = _Read(read, start, end, seq, qual)
+        self.reads.append(this)
+        self.bases += end - start
+
+        # Mates, as htslib pairs them up to find their overlaps
+        flag = read.flag
+        if flag & 3 == 3 and not flag & 8:
+            mate_tid = read.next_reference_id
+            mate_start = read.next_reference_start
+            if not ((mate_tid >= 0 and mate_tid != read.reference_id)
+                    or (abs(read.template_length) >= 2 * len(seq)
+                        and mate_start >= end)):
+                name = read.query_name
+                mate = self.waiting.pop(name, None)
+                if mate is not None:
+                    this.mate = mate
+                    this.name = name
+                    this.tweaked_from = made
+                elif mate_start >= start or mate_start == -1:
+                    self.waiting[name] = this
+        return block
+
+    def count(self, end=None):
+        """The BamBlock of the lines before end, or None if there are
+        none.  If end is None, all the lines of the reads so far."""
+        reads = self.reads
+        lo = self.start
+        if not reads:
+            if end is not None:
+                self.start = end
+            return None
+        for index, read in enumerate(reads):
+            read.index = index
+        n_reads = len(reads)
+        starts = numpy.fromiter((read.start for read in reads), numpy.intp,
+                                n_reads)
+        ends = numpy.fromiter((read.end for read in reads), numpy.intp,
+                              n_reads)
+        hi = int(ends.max()) if end is None else end
+        ref_end = int(ends.max())
+        lengths = numpy.fromiter((len(read.seq) for read in reads),
+                                 numpy.intp, n_reads)
+        offsets = numpy.cumsum(lengths) - lengths
+        seq = numpy.frombuffer(b''.join([read.seq for read in reads]),
+                               numpy.uint8)
+        original = numpy.frombuffer(
+            b''.join([read.qual for read in reads]) + b'\0', numpy.uint8)
+        qual = original.copy()
+        missing = len(qual) - 1  # Quality 0, past the end of a read
+        ref = self.fasta_file.fetch(self.contig, lo, min(
+            ref_end, self.length)).encode('ascii')
+        ref += b'N' * (ref_end - lo - len(ref))
+        ref_codes = numpy.frombuffer(ref, numpy.uint8)
+
+        self.reads = [read for read in reads if read.end > hi]
+        self.start = hi
+        self.bases = 0
+        self.waiting = dict((name, read) for name, read
+                            in self.waiting.items() if read.end > hi)
+
+        # The lines: the positions covered by the reads, in runs
+        span_starts = numpy.maximum(starts, lo)
+        span_ends = numpy.minimum(ends, hi)
+        spanning = span_ends > span_starts
+        span_starts = span_starts[spanning]
+        span_ends = span_ends[spanning]
+        if not len(span_starts):
+            return None
+        reach = numpy.maximum.accumulate(span_ends)
+        new_run = numpy.ones(len(span_starts), bool)
+        new_run[1:] = span_starts[1:] > reach[:-1]
+        run_starts = span_starts[new_run]
+        run_lengths = numpy.maximum.reduceat(
+            span_ends, numpy.flatnonzero(new_run)) - run_starts
+        run_lines = numpy.cumsum(run_lengths) - run_lengths
+        n = int(run_lengths.sum())
+        positions = _expand(run_starts, run_lengths)
+
+        def line_of(pos):
+            run = numpy.maximum(
+                numpy.searchsorted(run_starts, pos, 'right') - 1, 0)
+            return run_lines[run] + pos - run_starts[run]
+
+        # Aligned bases, from lo on (past hi too, for the overlaps)
+        matches = numpy.array(list(chain.from_iterable(
+            read.matches for read in reads)), numpy.intp).reshape(-1, 3)
+        match_reads = numpy.repeat(numpy.arange(n_reads), [
+            len(read.matches) for read in reads])
+        cut = numpy.maximum(lo - matches[:, 0], 0)
+        match_lengths = matches[:, 2] - cut
+        kept = match_lengths > 0
+        match_lengths = match_lengths[kept]
+        match_reads = match_reads[kept]
+        match_starts = matches[kept, 0] + cut[kept]
+        entry_pos = _expand(match_starts, match_lengths)
+        entry_query = _expand(matches[kept, 1] + cut[kept]
+                              + offsets[match_reads], match_lengths)
+        entry_lines = _expand(line_of(match_starts), match_lengths)
+
+        # The pairs whose later read has come: htslib changes the
+        # qualities of their overlap once, when it reads the later read,
+        # so the lines before tweaked_from go by the earlier read's
+        # original qualities.
+        later = [read for read in reads if read.mate is not None]
+        tweaked_from = numpy.full(n_reads, lo, numpy.intp)
+        for read in later:
+            tweaked_from[read.mate.index] = read.tweaked_from
+
+        def quality(query, pos, read_index):
+            return numpy.where(pos < tweaked_from[read_index],
+                               original[query], qual[query])
+
+        if later:
+            first_kept = _name_hashes([read.name for read in later]) & 1 != 0
+            plain = numpy.ones(len(later), bool)
+            for i, read in enumerate(later):
+                if read.gaps or read.mate.gaps:
+                    _tweak_gapped_pair(read.mate, read, first_kept[i], seq,
+                                       qual, offsets)
+                    plain[i] = False
+            plain = numpy.flatnonzero(plain)
+            pair = numpy.full(n_reads, -1, numpy.intp)
+            first = numpy.fromiter((later[i].mate.index for i in plain),
+                                   numpy.intp, len(plain))
+            second = numpy.fromiter((later[i].index for i in plain),
+                                    numpy.intp, len(plain))
+            pair[first] = pair[second] = numpy.arange(len(plain))
+            is_second = numpy.zeros(n_reads, bool)
+            is_second[second] = True
+            entry_reads = numpy.repeat(match_reads, match_lengths)
+            paired = numpy.flatnonzero(pair[entry_reads] >= 0)
+            keys = (pair[entry_reads[paired]] * (ref_end - lo)
+                    + entry_pos[paired] - lo)
+            seconds = is_second[entry_reads[paired]]
+            _, first_at, second_at = numpy.intersect1d(
+                keys[~seconds], keys[seconds], assume_unique=True,
+                return_indices=True)
+            _tweak_overlaps(seq, qual,
+                            entry_query[paired[~seconds]][first_at],
+                            entry_query[paired[seconds]][second_at],
+                            first_kept[plain][keys[seconds][second_at]
+                                              // (ref_end - lo)])
+            # The reads that go on to the next block keep the changes.
+            for read in later:
+                for changed in (read.mate, read):
+                    if changed.end > hi:
+                        at = offsets[changed.index]
+                        changed.qual = qual[at:at + len(changed.seq)].tobytes()
+                read.mate = None
+
+        passed = numpy.flatnonzero((entry_pos < hi) & (
+            qual[entry_query] >= self.min_base_quality))
+        passed_lines = entry_lines[passed]
+        depth = numpy.bincount(passed_lines, minlength=n)
+        letters = seq[entry_query[passed]]
+        differ = (letters != 61) & (  # 61 is '='
+            _NT16[letters] != _NT16[ref_codes[entry_pos[passed] - lo]])
+        bases = count_table(passed_lines[differ], CODES[letters[differ]], n)
+
+        # Deletions and reference skips, which go by the next base
+        gaps = numpy.array(list(chain.from_iterable(
+            read.gaps for read in reads)), numpy.intp).reshape(-1, 4)
+        if len(gaps):
+            gap_reads = numpy.repeat(numpy.arange(n_reads), [
+                len(read.gaps) for read in reads])
+            gap_starts = numpy.maximum(gaps[:, 0], lo)
+            gap_lengths = numpy.minimum(gaps[:, 0] + gaps[:, 1],
+                                        hi) - gap_starts
+            gap_query = numpy.where(gaps[:, 2] < lengths[gap_reads],
+                                    offsets[gap_reads] + gaps[:, 2], missing)
+            # The part of each gap before tweaked_from, and the rest
+            split = numpy.clip(tweaked_from[gap_reads], gap_starts,
+                               gap_starts + numpy.maximum(gap_lengths, 0))
+            for part_starts, part_lengths, part_qual in (
+                    (gap_starts, split - gap_starts, original),
+                    (split, gap_starts + gap_lengths - split, qual)):
+                kept = (part_lengths > 0) & (
+                    part_qual[gap_query] >= self.min_base_quality)
+                depth += numpy.bincount(_expand(
+                    line_of(part_starts[kept]), part_lengths[kept]),
+                    minlength=n)
+
+        # Read starts, with their mapping qualities
+        heads = numpy.flatnonzero((starts >= lo) & (starts < hi))
+        head_reads = [reads[i] for i in heads.tolist()]
+        head_query = numpy.fromiter((read.head for read in head_reads),
+                                    numpy.intp, len(heads))
+        head_query = numpy.where(head_query < lengths[heads],
+                                 offsets[heads] + head_query, missing)
+        kept = quality(head_query, starts[heads],
+                       heads) >= self.min_base_quality
+        heads = heads[kept]
+        head_query = head_query[kept]
+        head_lines = line_of(starts[heads])
+        mapq = numpy.fromiter((min(read.mapq, 93) + 33
+                               for read in head_reads), numpy.uint8,
+                              len(head_reads))[kept]
+        quals = count_table(head_lines, CODES[mapq], n)
+        # The programs drop the base after a '$' mapping quality.
+        dollar = (mapq == 36) & numpy.fromiter(
+            (read.head_match for read in head_reads), bool,
+            len(head_reads))[kept]
+        letters = seq[head_query[dollar]]
+        differ = (letters != 61) & (
+            _NT16[letters] != _NT16[ref_codes[starts[heads[dollar]] - lo]])
+        dropped = count_table(head_lines[dollar][differ],
+                              CODES[letters[differ]], n)
+
+        # Indels
+        ins = {}
+        dels = {}
+        indel_lines = []
+        indel_bases = []
+        for read, offset, tweaked in zip(reads, offsets.tolist(),
+                                         tweaked_from.tolist()):
+            for pos, query, inserted, deletion in read.indels:
+                if not lo <= pos < hi or query >= len(read.seq):
+                    continue
+                if ((original if pos < tweaked else qual)[offset + query]
+                        < self.min_base_quality):
+                    continue
+                line = int(line_of(pos))
+                if inserted:
+                    ins.setdefault(line, []).append(len(inserted))
+                    indel_bases.append(inserted)
+                    indel_lines.append(numpy.full(len(inserted), line))
+                if deletion:
+                    dels.setdefault(line, []).append(deletion)
+                    indel_bases.append(
+                        ref[pos + 1 - lo:pos + 1 + deletion - lo])
+                    indel_lines.append(numpy.full(deletion, line))
+        indel_bases = numpy.frombuffer(b''.join(indel_bases), numpy.uint8)
+        indels = count_table(
+            numpy.concatenate(indel_lines or [numpy.zeros(0, numpy.intp)]),
+            CODES[indel_bases], n)
+        irregular = numpy.zeros(n, bool)
+        for table in (ins, dels):
+            irregular[[line for line, lengths in table.items()
+                       if len(lengths) > 1 and max(lengths) > 9
+                       and has_prefix(lengths)]] = True
+
+        block = BamBlock()
+        block.contig = self.contig
+        block.n = n
+        block.pos = positions + 1
+        block.ref = ref_codes[positions - lo]
+        block.depth = depth
+        block.bases = bases
+        block.quals = quals
+        block.indels = indels
+        block.dropped = dropped
+        block.ins = ins
+        block.dels = dels
+        block.irregular = irregular
+        block._reads = reads
+        block._starts = starts.tolist()
+        block._longest = int((ends - starts).max())
+        block._offsets = offsets.tolist()
+        block._qual = qual
+        block._original = original
+        block._tweaked_from = tweaked_from.tolist()
+        block._ref = ref
+        block._start = lo
+        block._min_base_quality = self.min_base_quality
+        return block
+
+
+def bam_blocks(bam_file, fasta_file, region=None,
+               min_base_quality=MIN_BASE_QUALITY, block_bases=BLOCK_BASES):
+    """Yield a BamBlock for each stretch of the pileup of a BAM file.
+
+    bam_file is a pysam AlignmentFile, sorted by position, and
+    fasta_file the pysam FastaFile of its reference.  region is
+    (contig, start, end), 0-based, for the lines of the positions from
+    start to end (or to the end of the contig's lines if end is None),
+    which needs an index; if it is None, the whole file is read in
+    order.
+
+    The lines of a region are those of the pileup of the whole file,
+    so that the lines of regions that cover a contig are the lines of
+    the contig.  They can differ from 'samtools mpileup -r', which
+    leaves out the earlier mates of the reads that cross the start of
+    the region, and the first read that starts after the region (which
+    mpileup reads before it makes the last lines of the region).  Their
+    overlaps with their mates can change the qualities in the region.
+    """
+    if region is None:
+        reads = bam_file.fetch(until_eof=True)
+        start = 0
+        end = None
+    else:
+        contig, start, end = region
+        first = start
+        for read in bam_file.fetch(contig, start, start + 1):
+            if (read.flag & 3 == 3 and read.reference_start < start
+                    and read.next_reference_id == read.reference_id
+                    and 0 <= read.next_reference_start < first):
+                first = read.next_reference_start
+        reads = bam_file.fetch(contig, first)
+    pileup = None
+    for read in reads:
+        if read.flag & SKIP_FLAGS or read.reference_id < 0:
+            continue
+        if (end is not None and pileup is not None
+                and pileup.last_start >= end):
+            break
+        if pileup is None or read.reference_id != pileup.tid:
+            if pileup is not None:
+                block = pileup.count(end)
+                if block is not None:
+                    yield block
+            pileup = _Pileup(read.reference_name, fasta_file, start,
+                             min_base_quality, block_bases)
+            pileup.tid = read.reference_id
+        block = pileup.add(read)
+        if block is not None:
+            yield block
+    if pileup is not None:
+        block = pileup.count(end)
+        if block is not None:
+            yield block
@@ -0,0 +1,163 @@
+"""barcodes.py
+Counting duplex tags in 2-bit packed form, for the --tagstats and
+--reduce options of tag_to_header.py.
+
+A duplex tag (tag1 + tag2, the tags of read 1 and read 2) of up to 32
+bases is packed into one unsigned 64-bit integer, two bits per base,
+tag1 in the high bits.  The other strand of the same molecule has tag
+tag2 + tag1, whose key is found by swapping the two halves of the
+integer, so partner tags are looked up by binary search in the sorted
+array of keys instead of by building strings.
+
+BarcodeCounts keeps the distinct keys and their counts in sorted NumPy
+arrays.  Keys are added a block at a time and merged into the counts
+once enough are waiting.  Tags that cannot be packed (with letters other
+than A, C, G and T, of another length, or longer than 32 bases) are
+counted as strings in a dictionary on the side, as before; they can
+only be partners of each other.
+"""
+
+from collections import defaultdict
+
+import numpy
+
+# Codes for pack_tags: A, C, G and T are 0 to 3, anything else is 4.
+BASE_CODES = numpy.full(256, 4, numpy.uint8)
+BASE_CODES[numpy.frombuffer(b'ACGT', numpy.uint8)] = numpy.arange(4)
+
+_EMPTY_KEYS = numpy.zeros(0, numpy.uint64)
+
+
+def pack_tags(tags, length):
+    """Pack a list of tags of length bases.
+
+    Returns the keys of the tags that can be packed, in order, and the
+    list of the other tags.
+    """
+    if not tags:
+        return _EMPTY_KEYS, []
+    if length > 32:
+        return _EMPTY_KEYS, list(tags)
+    if set(map(len, tags)) != {length}:
+        # Tags of other lengths: pack the others on their own.
+        packable = [tag for tag in tags if len(tag) == length]
+        keys, other = pack_tags(packable, length)
+        return keys, other + [tag for tag in tags if len(tag) != length]
+    joined = ''.join(tags).encode('latin-1')
+    codes = BASE_CODES[numpy.frombuffer(joined, numpy.uint8)].reshape(
+        len(tags), length)
+    keys = numpy.zeros(len(tags), numpy.uint64)
+    for column in range(length):
+        keys <<= numpy.uint64(2)
+        keys |= codes[:, column]
+    bad = (codes == 4).any(axis=1)
+    if bad.any():
+        return keys[~bad], [tags[i] for i in numpy.flatnonzero(bad)]
+    return keys, []
+
+
+def swap_halves(keys, taglen):
+    """The keys of tag2 + tag1 for the keys of tag1 + tag2."""
+    shift = numpy.uint64(2 * taglen)
+    low = (numpy.uint64(1) << shift) - numpy.uint64(1)
+    return ((keys & low) << shift) | (keys >> shift)
+
+
+class BarcodeCounts:
+    def __init__(self, taglen, limit=1 << 22):
+        self.taglen = taglen
+        self.length = 2 * taglen
+        self.limit = limit
+        self.keys = _EMPTY_KEYS  # Sorted, distinct
+        self.counts = numpy.zeros(0, numpy.int64)
+        self.pending = []
+        self.pending_size = 0
+        self.other = defaultdict(lambda: 0)
+
+    def add(self, tags):
+        """Count a list of duplex tags (tag1 + tag2 strings)."""
+        self.add_packed(*pack_tags(tags, self.length))
+
+    def add_packed(self, keys, other):
+        """Count tags packed by pack_tags(), maybe in another process."""
+        for tag in other:
+            self.other[tag] += 1
+        if len(keys):
+            self.pending.append(keys)
+            self.pending_size += len(keys)
+            if self.pending_size >= self.limit:
+                self._merge()
+
+    def _merge(self):
+        if not self.pending:
+            return
+        keys = numpy.concatenate([self.keys] + self.pending)
+        counts = numpy.concatenate(
+            [self.counts, numpy.ones(self.pending_size, numpy.int64)])
+        self.keys, inverse = numpy.unique(keys, return_inverse=True)
+        self.counts = numpy.bincount(inverse.ravel(), weights=counts,
+                                     minlength=len(self.keys)).astype(
+                                         numpy.int64)
+        self.pending = []
+        self.pending_size = 0
+
+    def family_size_counts(self):
+        """A dictionary of family size -> number of tags of that size."""
+        self._merge()
+        sizes, numbers = numpy.unique(self.counts, return_counts=True)
+        family_sizes = defaultdict(lambda: 0)
+        for size, number in zip(sizes.tolist(), numbers.tolist()):
+            family_sizes[size] += number
+        for size in self.other.values():
+            family_sizes[size] += 1
+        return family_sizes
+
+    def duplexes(self, min_size=3):
+        """Find the tags that can make SSCSs and DCSs.
+
+        Returns the number of tags with at least min_size reads, and the
+        number of those whose partner (tag2 + tag1) also has; the tags
+        of the second kind are kept for is_duplex().
+        """
+        self._merge()
+        sscs = self.counts >= min_size
+        partners = swap_halves(self.keys, self.taglen)
+        index = numpy.searchsorted(self.keys, partners)
+        index[index == len(self.keys)] = 0
+        dcs = sscs & (self.keys[index] == partners) & (
+            self.counts[index] >= min_size)
+        self.duplex_keys = self.keys[dcs]
+
+        sscs_count = int(sscs.sum())
+        dcs_count = int(dcs.sum())
+        self.duplex_other = set()
+        for tag, count in self.other.items():
+            if count >= min_size:
+                sscs_count += 1
+                partner = tag[self.taglen:] + tag[:self.taglen]
+                if self.other.get(partner, 0) >= min_size:
+                    dcs_count += 1
+                    # Both, as for tags of another length the partner of
+                    # the partner is not the tag itself.
+                    self.duplex_other.update((tag, partner))
+        return sscs_count, dcs_count
+
+    def is_duplex(self, tags):
+        """For a list of tags, whether each can make a DCS.
+
+        duplexes() must have been called first.
+        """
+        keys, other = pack_tags(tags, self.length)
+        if len(self.duplex_keys):
+            index = numpy.searchsorted(self.duplex_keys, keys)
+            index[index == len(self.duplex_keys)] = 0
+            found = (self.duplex_keys[index] == keys).tolist()
+        else:
+            found = [False] * len(keys)
+        if not other:
+            return found
+        # pack_tags keeps the packed tags in order
+        other = set(other)
+        found = iter(found)
+        return [tag in self.duplex_other if tag in other else next(found)
+                for tag in tags]
@@ -0,0 +1,173 @@
+"""checkpoint.py
+Stage manifests and resumable outputs for long-running programs.
+
+A Manifest is a small JSON file recording, for each stage of a run, the
+fingerprints of the stage's inputs and outputs and, for a stage that is
+still running, how far it has got.  A rerun with the same parameters and
+inputs can then skip the stages that finished and pick up an unfinished
+stage from its last commit.  The manifest is rewritten atomically
+(written to a temporary file, then renamed), so a crash leaves either
+the old or the new version, never a mix.
+
+Fingerprints are the file size and a SHA-1 of the first and last MiB,
+so checking even very large files is cheap.
+
+Outputs written while a stage is running go to <name>.partial and are
+only renamed to <name> when the stage finishes.  GzipCommitWriter ends a
+gzip member at every commit, so the partial file, cut back to the size
+recorded at the last commit, is always a complete (multi-member) gzip
+file, and can simply be appended to after a restart.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+
+def fingerprint(path, block=1 << 20):
+    """Return a cheap fingerprint of the file at path."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as in_file:
+        digest.update(in_file.read(block))
+        if size > block:
+            in_file.seek(max(block, size - block))
+            digest.update(in_file.read(block))
+    return {'size': size, 'sha1': digest.hexdigest()}
+
+
+def fingerprints(paths):
+    return dict((path, fingerprint(path)) for path in paths)
+
+
+def atomic_write(path, text):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as out_file:
+        out_file.write(text)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.replace(temp_path, path)
+
+
+class Manifest:
+    """Progress of the stages of one run.
+
+    stages lists the stage names in the order they run; restarting a
+    stage forgets every stage after it.  With enabled=False nothing is
+    read or written, and no stage is ever reported as done.
+    """
+
+    def __init__(self, path, params, stages, enabled=True):
+        self.path = path
+        self.params = params
+        self.order = list(stages)
+        self.enabled = enabled
+        self.stages = {}
+        if enabled and os.path.exists(path):
+            try:
+                with open(path) as in_file:
+                    saved = json.load(in_file)
+            except ValueError:
+                saved = {}
+            if (saved.get('version') == MANIFEST_VERSION
+                    and saved.get('params') == params):
+                self.stages = saved['stages']
+
+    def save(self):
+        if self.enabled:
+            atomic_write(self.path, json.dumps(
+                {'version': MANIFEST_VERSION,
+                 'params': self.params,
+                 'stages': self.stages
+                 },
+                indent=1,
+                sort_keys=True
+                ))
+
+    def stage(self, name):
+        return self.stages.get(name, {})
+
+    def started(self, name, inputs):
+        """True if stage name was started on exactly these inputs."""
+        return (self.enabled and name in self.stages
+                and self.stages[name]['inputs'] == inputs)
+
+    def done(self, name, inputs):
+        """True if stage name finished on exactly these inputs."""
+        return self.started(name, inputs) and self.stages[name]['done']
+
+    def outputs_intact(self, name):
+        """True if the recorded outputs of stage name are unchanged."""
+        outputs = self.stage(name).get('outputs', {})
+        for path, saved in outputs.items():
+            if not os.path.exists(path) or fingerprint(path) != saved:
+                return False
+        return True
+
+    def start(self, name, inputs, **state):
+        """Record that stage name is starting from scratch."""
+        for later in self.order[self.order.index(name):]:
+            self.stages.pop(later, None)
+        self.stages[name] = dict(state, inputs=inputs, done=False)
+        self.save()
+
+    def commit(self, name, **state):
+        """Record the progress of stage name."""
+        self.stages[name].update(state)
+        self.save()
+
+    def finish(self, name, outputs, **state):
+        """Record that stage name finished, with its output files."""
+        self.stages[name].update(state)
+        self.stages[name]['outputs'] = \
+            fingerprints(outputs) if self.enabled else {}
+        self.stages[name]['done'] = True
+        self.save()
+
+
+def resume_partial(path, size):
+    """Open path + '.partial' for appending, cut back to size bytes."""
+    partial = path + '.partial'
+    if size:
+        out_file = open(partial, 'r+b')
+        out_file.truncate(size)
+        out_file.seek(size)
+    else:
+        out_file = open(partial, 'wb')
+    return out_file
+
+
+class GzipCommitWriter:
+    """Text output to a gzip file that can be committed and resumed.
+
+    Text goes to path + '.partial'; commit() ends the current gzip
+    member, syncs the file, and returns its size, which can be given back
+    as size to continue after a restart.  close() commits and renames the
+    file to path.
+    """
+
+    def __init__(self, path, size=0):
+        self.path = path
+        self.raw = resume_partial(path, size)
+        self.member = None
+
+    def write(self, text):
+        if self.member is None:
+            self.member = gzip.GzipFile(fileobj=self.raw, mode='wb', mtime=0)
+        self.member.write(text.encode())
+
+    def commit(self):
+        if self.member is not None:
+            self.member.close()
+            self.member = None
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        return self.raw.tell()
+
+    def close(self):
+        self.commit()
+        self.raw.close()
+        os.replace(self.path + '.partial', self.path)
@@ -0,0 +1,129 @@
+"""duplex.py
+Making and writing duplex consensus sequences (DCSs), shared by
+DuplexMaker.py and the --duplex mode of ConsensusMaker.py.
+
+A DuplexWriter takes DCSs in file order and writes them in read pairs,
+read 1 first, to the DCS BAM file and to the pair of FASTQ files used
+for realigning.  DCSs wait for their mates in a MateBuffer; at the end,
+those still unpaired are written with a placeholder mate (flag 5, a
+sequence of dots) so that the FASTQ files stay in step.
+"""
+
+import gzip
+
+import numpy
+import pysam
+
+from dsutils.matebuffer import MateBuffer
+
+COMPLEMENT = bytes.maketrans(b'ACGTNacgtn', b'TGCANtgcan')
+COMPLEMENT_CODES = numpy.frombuffer(COMPLEMENT, numpy.uint8)
+N_CODE = ord('N')
+
+
+def dcs_maker(grouped_reads_list, read_length):
+    # The Duplex maker substitutes an N if the two input sequences are not
+    # identical at a position.
+    consensus_read = ''
+    for i in range(read_length):
+        if grouped_reads_list[0][i] == grouped_reads_list[1][i]:
+            consensus_read += grouped_reads_list[0][i]
+        else:
+            consensus_read += "N"
+    return consensus_read
+
+
+def dcs_batch(pairs, read_length, reverse=None):
+    """Make the DCSs for a list of pairs of SSCS sequences at once.
+
+    Gives the same DCSs as dcs_maker; the DCSs of the pairs for which
+    reverse is true are reverse complemented.  Every sequence must be at
+    least read_length long.
+    """
+    if not pairs:
+        return []
+    if any(len(seq) < read_length for pair in pairs for seq in pair):
+        raise IndexError("string index out of range")
+    first = numpy.frombuffer(''.join(
+        pair[0][:read_length] for pair in pairs).encode('ascii'),
+        numpy.uint8).reshape(len(pairs), read_length)
+    second = numpy.frombuffer(''.join(
+        pair[1][:read_length] for pair in pairs).encode('ascii'),
+        numpy.uint8).reshape(len(pairs), read_length)
+    consensuses = numpy.where(first == second, first, N_CODE).astype(
+        numpy.uint8)
+    if reverse is not None and any(reverse):
+        rows = numpy.flatnonzero(reverse)
+        consensuses[rows] = COMPLEMENT_CODES[consensuses[rows, ::-1]]
+    text = consensuses.tobytes().decode('ascii')
+    return [text[i * read_length:(i + 1) * read_length]
+            for i in range(len(pairs))]
+
+
+def fastq_open(outfile, gzip_fastq, end):
+    fn = outfile.replace('.bam', '') + "." + end + ".fq"
+    if gzip_fastq:
+        fn += ".gz"
+        return gzip.open(fn, 'wt')
+    else:
+        return open(fn, 'w')
+
+
+class DuplexWriter:
+    def __init__(self, outfile, template, gzip_fastqs=False,
+                 mate_buffer=1000000, directory=None):
+        self.out_bam = pysam.Samfile(outfile, "wb", template=template)
+        self.fastq_file1 = fastq_open(outfile, gzip_fastqs, 'r1')
+        self.fastq_file2 = fastq_open(outfile, gzip_fastqs, 'r2')
+        # DCSs waiting for their mates; past mate_buffer of them, some are
+        # kept in a temporary file
+        self.consensus_dict = MateBuffer(mate_buffer, directory)
+        self.unpaired = 0
+
+    def write_pair(self, read1, read2):
+        self.fastq_file1.write('@:%s\n%s\n+\n%s\n' % (read1.qname, read1.seq,
+                                                      read1.qual))
+        self.out_bam.write(read1)
+        self.fastq_file2.write('@:%s\n%s\n+\n%s\n' % (read2.qname, read2.seq,
+                                                      read2.qual))
+        self.out_bam.write(read2)
+
+    def write(self, tag, a):
+        """Write a DCS and its mate, or keep it until the mate comes."""
+        if tag in self.consensus_dict:
+            mate = self.consensus_dict.pop(tag)
+            if a.is_read1 is True:
+                self.write_pair(a, mate)
+            else:
+                self.write_pair(mate, a)
+        else:
+            self.consensus_dict[tag] = a
+
+    def write_unpaired(self, read_length, qual_score, cig_dum):
+        """Write the DCSs that never found a mate; returns how many."""
+        for consTag, unpaired in self.consensus_dict.pop_all():
+            a = pysam.AlignedRead()
+            a.qname = consTag
+            a.flag = 5
+            a.seq = '.' * read_length
+            a.rname = unpaired.rname
+            a.pos = unpaired.pos
+            a.mapq = 255
+            a.cigar = cig_dum
+            a.mrnm = unpaired.mrnm
+            a.mpos = unpaired.pos
+            a.isize = unpaired.isize
+            a.qual = qual_score
+
+            if unpaired.is_read1 is False:
+                self.write_pair(a, unpaired)
+            else:
+                self.write_pair(unpaired, a)
+            self.unpaired += 1
+        return self.unpaired
+
+    def close(self):
+        self.consensus_dict.close()
+        self.fastq_file1.close()
+        self.fastq_file2.close()
+        self.out_bam.close()
@@ -0,0 +1,227 @@
+"""fastq.py
+Reading FASTQ files, single or paired, plain or gzipped, in bulk.
+
+fastq_records() reads a file in large blocks, decodes each block once
+and splits it into lines.  A block of standard 4-line records (title,
+sequence, '+', quality of the same length) is checked as a whole and
+its records are handed out directly.  Only when that check fails are
+the records of the block parsed one at a time, which also handles
+sequences and qualities wrapped over several lines: the sequence runs
+to the '+' line, and the quality to as many characters as the sequence
+(so a quality line may start with '@').  Windows line ends and blank
+lines between records are accepted.
+
+paired_fastq_records() reads the two files of a pair in step and checks
+that each pair of records has the same name, up to the first space, but
+for the read number: the names may differ only where read 1 has a 1 and
+read 2 a 2 (as in name/1 and name/2, or SRR1613972.1.1 and
+SRR1613972.1.2).  Files that are out of step are caught by the first
+pair whose names differ in any other way.
+
+Gzipped files are recognized by their first bytes, whatever their name.
+"""
+
+import gzip
+from itertools import repeat
+from operator import itemgetter
+
+# Larger blocks are slower: they no longer fit in the cache
+BUFFER_SIZE = 1 << 18
+
+_first = itemgetter(0)
+_head = itemgetter(slice(0, 1))
+_title = itemgetter(slice(1, None))
+_AT = {'@'}
+_PLUS = {'+'}
+
+
+def fastq_input(path):
+    """Open a FASTQ file, plain or gzipped, for fastq_records()."""
+    with open(path, 'rb') as in_file:
+        magic = in_file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _line_blocks(handle, buffer_size):
+    # The lines of handle, in lists of about buffer_size characters.  The
+    # last line of a block is always complete.
+    leftover = ''
+    while True:
+        data = handle.read(buffer_size)
+        if not data:
+            if leftover:
+                yield [leftover]
+            return
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        text = leftover + data
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        lines = text.split('\n')
+        leftover = lines.pop()
+        yield lines
+
+
+def _parse_record(lines, i, end, at_eof):
+    # Parse the record starting at lines[i], with as many sequence and
+    # quality lines as it has.  Returns the record and the index of the
+    # line after it, or None, i if the record goes on past lines[end - 1]
+    # (and this is not the end of the file).
+    while i < end and not lines[i]:
+        i += 1  # Blank lines between records
+    if i == end:
+        return None, i
+    start = i
+    title = lines[i]
+    if title[0] != '@':
+        if '\x00' in title or title[:2] == '\x1f\x8b':
+            raise ValueError("FASTQ files may contain binary information "
+                             "or are compressed")
+        raise ValueError("Records in FASTQ files should start with a '@' "
+                         "character. Files may be malformed or out of "
+                         "synch: %s" % title)
+    i += 1
+    seq = []
+    while i < end and lines[i][:1] != '+':
+        seq.append(lines[i])
+        i += 1
+    seq = ''.join(seq)
+    i += 1  # The '+' line
+    qual = []
+    length = 0
+    while i < end and (length < len(seq) or not qual):
+        qual.append(lines[i])
+        length += len(lines[i])
+        i += 1
+    if i > end or not qual or length < len(seq):
+        if at_eof and i == end and not seq:
+            return (title[1:], '', ''), i  # No line end after the last '+'
+        if at_eof:
+            raise ValueError("End of file without quality information. "
+                             "Files may be malformed or out of synch: %s"
+                             % title)
+        return None, start
+    if length > len(seq):
+        raise ValueError("Quality and sequence lengths differ for %s"
+                         % title)
+    return (title[1:], seq, ''.join(qual)), i
+
+
+def _record_blocks(handle, buffer_size):
+    # The records of handle as lists of titles (without the '@'),
+    # sequences and qualities, one block at a time.
+    lines = []
+    i = 0
+    for block in _line_blocks(handle, buffer_size):
+        if i < len(lines):
+            lines = lines[i:] + block
+        else:
+            lines = block
+        i = 0
+        end = len(lines) - len(lines) % 4
+        titles = lines[0:end:4]
+        seqs = lines[1:end:4]
+        quals = lines[3:end:4]
+        if (set(map(_head, titles)) <= _AT
+                and set(map(_head, lines[2:end:4])) <= _PLUS
+                and list(map(len, seqs)) == list(map(len, quals))):
+            # Standard 4-line records only
+            yield list(map(_title, titles)), seqs, quals
+            i = end
+            continue
+        titles, seqs, quals = [], [], []
+        while True:
+            record, i = _parse_record(lines, i, len(lines), False)
+            if record is None:
+                break
+            titles.append(record[0])
+            seqs.append(record[1])
+            quals.append(record[2])
+        yield titles, seqs, quals
+    titles, seqs, quals = [], [], []
+    while True:
+        record, i = _parse_record(lines, i, len(lines), True)
+        if record is None:
+            break
+        titles.append(record[0])
+        seqs.append(record[1])
+        quals.append(record[2])
+    yield titles, seqs, quals
+
+
+def fastq_records(handle, buffer_size=BUFFER_SIZE):
+    """Yield (title, sequence, quality) for each record of a FASTQ file.
+
+    handle is a file opened by fastq_input(), or any text or binary file.
+    The title is the name line without the '@'.
+    """
+    for titles, seqs, quals in _record_blocks(handle, buffer_size):
+        yield from zip(titles, seqs, quals)
+
+
+def same_pair(title1, title2):
+    """Whether two titles name read 1 and read 2 of the same pair."""
+    name1 = title1.partition(' ')[0]
+    name2 = title2.partition(' ')[0]
+    if name1 == name2:
+        return True
+    return len(name1) == len(name2) and all(
+        base1 == base2 or (base1 == '1' and base2 == '2')
+        for base1, base2 in zip(name1, name2))
+
+
+def _check_names(titles1, titles2):
+    # Raise ValueError unless each pair of titles passes same_pair().
+    if titles1 == titles2:
+        return
+    names1 = list(map(_first, map(str.partition, titles1, repeat(' '))))
+    names2 = list(map(_first, map(str.partition, titles2, repeat(' '))))
+    if names1 == names2:
+        return
+    for title1, title2 in zip(titles1, titles2):
+        if not same_pair(title1, title2):
+            raise ValueError("Read names %s and %s do not match. Files may "
+                             "be malformed or out of synch."
+                             % (title1, title2))
+
+
+def paired_fastq_records(handle1, handle2, buffer_size=BUFFER_SIZE):
+    """Yield (title1, title2, seq1, seq2, qual1, qual2) for each read pair.
+
+    Raises ValueError if the names of a pair differ, or if one file ends
+    before the other.
+    """
+    blocks1 = _record_blocks(handle1, buffer_size)
+    blocks2 = _record_blocks(handle2, buffer_size)
+    titles1 = seqs1 = quals1 = titles2 = seqs2 = quals2 = []
+    while True:
+        while not titles1:
+            titles1, seqs1, quals1 = next(blocks1, (None, None, None))
+            if titles1 is None:
+                break
+        while not titles2:
+            titles2, seqs2, quals2 = next(blocks2, (None, None, None))
+            if titles2 is None:
+                break
+        if titles1 is None or titles2 is None:
+            break
+        if len(titles1) == len(titles2):
+            # Usual for the two reads of a pair, which have the same lengths
+            _check_names(titles1, titles2)
+            yield from zip(titles1, titles2, seqs1, seqs2, quals1, quals2)
+            titles1 = titles2 = []
+            continue
+        n = min(len(titles1), len(titles2))
+        _check_names(titles1[:n], titles2[:n])
+        yield from zip(titles1[:n], titles2[:n], seqs1[:n], seqs2[:n],
+                       quals1[:n], quals2[:n])
+        titles1, seqs1, quals1 = titles1[n:], seqs1[n:], quals1[n:]
+        titles2, seqs2, quals2 = titles2[n:], seqs2[n:], quals2[n:]
+    if titles1:
+        raise ValueError("The second FASTQ file ends before the first, "
+                         "at %s" % titles1[0])
+    if titles2:
+        raise ValueError("The first FASTQ file ends before the second, "
+                         "at %s" % titles2[0])
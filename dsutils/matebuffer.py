@@ -0,0 +1,193 @@
+"""matebuffer.py
+Reads waiting for their mates, with a bound on the memory they use.
+
+ConsensusMaker.py and DuplexMaker.py go through a position-sorted file
+and keep each consensus read in a dictionary, keyed by tag, until the
+consensus for its mate is made.  Pairs with large inserts, or with mates
+on another contig, can keep that dictionary growing for the whole run.
+
+A MateBuffer behaves like that dictionary (in, [] =, pop, and taking
+the remaining reads in the order they were added), but holds at most
+limit reads in memory.  When it is full, reads are spilled to an SQLite
+table in a temporary file: first those whose mate position has already
+been passed, so that their mate can no longer turn up, then the oldest
+of the rest.  Spilled reads are still found by in and pop, so reads are
+paired exactly as with a plain dictionary, and pop_before and pop_all
+merge the spilled reads back in the order they were added.
+
+Reads must be added in file order; the position of the last read added
+is taken as the current position.
+"""
+
+import heapq
+import os
+import pickle
+import sqlite3
+import tempfile
+
+import pysam
+
+
+def pack(read):
+    return pickle.dumps((read.qname, read.flag, read.tid, read.pos,
+                         read.mapq, read.cigar, read.mrnm, read.mpos,
+                         read.isize, read.seq, read.qual, read.tags),
+                        pickle.HIGHEST_PROTOCOL)
+
+
+def unpack(record):
+    a = pysam.AlignedRead()
+    (a.qname, a.flag, a.tid, a.pos, a.mapq, a.cigar, a.mrnm, a.mpos,
+     a.isize, a.seq, a.qual, a.tags) = pickle.loads(record)
+    return a
+
+
+class MateBuffer:
+    """A tag -> read dictionary holding at most limit reads in memory.
+
+    The temporary file is made in directory when the first read is
+    spilled, and removed by close().
+    """
+
+    def __init__(self, limit=1000000, directory=None):
+        self.limit = max(1, limit)
+        self.directory = directory
+        self.reads = {}  # tag -> (order added, read)
+        self.added = 0
+        self.position = (-1, -1)
+        self.db = None
+        self.db_path = None
+        self.spilled = 0
+        self.spilled_min_pos = None
+
+    def __len__(self):
+        return len(self.reads) + self.spilled
+
+    def __contains__(self, tag):
+        return tag in self.reads or (self.spilled > 0 and self._find(tag)
+                                     is not None)
+
+    def __setitem__(self, tag, read):
+        self.position = (read.tid, read.pos)
+        if tag in self.reads:
+            # Replacing a read keeps its place, as in a dictionary.
+            self.reads[tag] = (self.reads[tag][0], read)
+            return
+        if self.spilled > 0:
+            found = self._find(tag)
+            if found is not None:
+                self.db.execute(
+                    "UPDATE spilled SET pos = ?, record = ? WHERE tag = ?",
+                    (read.pos, pack(read), tag))
+                self._spilled_pos(read.pos)
+                return
+        self.reads[tag] = (self.added, read)
+        self.added += 1
+        if len(self.reads) > self.limit:
+            self.spill()
+
+    def pop(self, tag):
+        if tag in self.reads:
+            return self.reads.pop(tag)[1]
+        found = self._find(tag) if self.spilled > 0 else None
+        if found is None:
+            raise KeyError(tag)
+        self.db.execute("DELETE FROM spilled WHERE tag = ?", (tag,))
+        self.spilled -= 1
+        return unpack(found[1])
+
+    def pop_before(self, pos):
+        """Remove and return the reads at positions before pos.
+
+        Returns a list of (tag, read) in the order they were added.
+        Positions on different contigs are compared as they are, as the
+        --isize check in ConsensusMaker.py always has.
+        """
+        in_memory = [(order, tag, read)
+                     for tag, (order, read) in self.reads.items()
+                     if read.pos < pos]
+        for order, tag, read in in_memory:
+            del self.reads[tag]
+        if self.spilled == 0 or self.spilled_min_pos >= pos:
+            return [(tag, read) for order, tag, read in in_memory]
+        rows = self.db.execute(
+            "SELECT seq, tag, record FROM spilled WHERE pos < ? "
+            "ORDER BY seq", (pos,)).fetchall()
+        self.db.execute("DELETE FROM spilled WHERE pos < ?", (pos,))
+        self.spilled -= len(rows)
+        self.spilled_min_pos = self.db.execute(
+            "SELECT MIN(pos) FROM spilled").fetchone()[0]
+        return [(tag, read if record is None else unpack(record))
+                for order, tag, read, record in heapq.merge(
+                    [(order, tag, read, None)
+                     for order, tag, read in in_memory],
+                    [(order, tag, None, record)
+                     for order, tag, record in rows],
+                    key=lambda row: row[0])]
+
+    def pop_all(self):
+        """Remove and yield every read as (tag, read), in the order added."""
+        in_memory = [(order, tag, read)
+                     for tag, (order, read) in self.reads.items()]
+        self.reads = {}
+        if self.spilled == 0:
+            for order, tag, read in in_memory:
+                yield tag, read
+            return
+        rows = self.db.execute(
+            "SELECT seq, tag, record FROM spilled ORDER BY seq")
+        for order, tag, read, record in heapq.merge(
+                ((order, tag, read, None) for order, tag, read in in_memory),
+                ((order, tag, None, record) for order, tag, record in rows),
+                key=lambda row: row[0]):
+            yield tag, (read if record is None else unpack(record))
+        self.db.execute("DELETE FROM spilled")
+        self.spilled = 0
+
+    def spill(self):
+        """Move reads to the temporary file until half the limit is left.
+
+        Reads whose mate position is behind the current position go
+        first, then the oldest of the others.
+        """
+        if self.db is None:
+            handle, self.db_path = tempfile.mkstemp(
+                suffix='.mates.sqlite', dir=self.directory)
+            os.close(handle)
+            self.db = sqlite3.connect(self.db_path, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode = OFF")
+            self.db.execute("PRAGMA synchronous = OFF")
+            self.db.execute("CREATE TABLE spilled (tag TEXT PRIMARY KEY, "
+                            "seq INTEGER, pos INTEGER, record BLOB)")
+            self.db.execute("CREATE INDEX spilled_seq ON spilled (seq)")
+            self.db.execute("CREATE INDEX spilled_pos ON spilled (pos)")
+        keep = self.limit // 2
+        passed = [tag for tag, (order, read) in self.reads.items()
+                  if read.mrnm < 0 or (read.mrnm, read.mpos) < self.position]
+        spill = passed[:len(self.reads) - keep]
+        if len(spill) < len(self.reads) - keep:
+            passed = set(passed)
+            spill.extend([tag for tag in self.reads if tag not in passed]
+                         [:len(self.reads) - keep - len(spill)])
+        rows = []
+        for tag in spill:
+            order, read = self.reads.pop(tag)
+            rows.append((tag, order, read.pos, pack(read)))
+            self._spilled_pos(read.pos)
+        self.db.executemany("INSERT INTO spilled VALUES (?, ?, ?, ?)", rows)
+        self.spilled += len(rows)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.db_path)
+            self.db = None
+
+    def _find(self, tag):
+        return self.db.execute(
+            "SELECT seq, record FROM spilled WHERE tag = ?",
+            (tag,)).fetchone()
+
+    def _spilled_pos(self, pos):
+        if self.spilled_min_pos is None or pos < self.spilled_min_pos:
+            self.spilled_min_pos = pos
@@ -0,0 +1,360 @@
+"""pileup.py
+Parsing the base column of samtools mpileup text, for CountMuts.py,
+mut-position.py and muts_by_read_position.py.
+
+Each read covering a position adds to the base column, in order: '^'
+and a mapping quality character if the read starts there, one base (.
+or , for the reference, a letter for another base or an N, * for a
+deleted base), an indel if one follows the base (+ or -, its length and
+that many bases), and '$' if the read ends there.
+
+pileup_blocks() reads a pileup file in large blocks (line_blocks() takes
+the lines themselves) and parses all the lines of a block at once with
+NumPy.  The base columns of the block are
+joined and scanned once for the characters that are not reference
+matches, which are few in duplex data; the read starts and indels are
+found among those.  For every line it gives the counts of A,
+C, G, T and N (in either case) among the bases of the reads, among the
+mapping qualities of the read starts and among the inserted and deleted
+bases, so that each program can count the way it always has.
+
+column_reads() splits a single base column into its reads, for programs
+that follow each read from line to line.
+
+The programs used to strip read starts and indels with regular
+expressions, which do not always agree with a clean parse: '\\+1.'
+also removes the start of '+12', and removing every '$' before every
+'^.' drops the base after a '$' mapping quality.  The second is kept
+track of (see PileupBlock.dropped); lines where anything else could
+differ are marked irregular and left to the programs' original code.
+These are lines where the length of one insertion (or deletion) is a
+prefix of another's, indels that run past the end of the column or
+contain markers or digits, lengths with leading zeros, three '^' in a
+row, a read start with no base after it, and lines whose position or
+depth is not a plain number.
+"""
+
+import re
+
+import numpy
+
+# Larger blocks are slower: they no longer fit in the cache
+BUFFER_SIZE = 1 << 20
+
+# Columns of the count tables: A, C, G, T and N in either case (and a
+# sixth for everything else, which is dropped).
+BASES = 'ACGTN'
+CODES = numpy.full(256, len(BASES), numpy.intp)
+for _i, _base in enumerate(BASES):
+    CODES[ord(_base)] = CODES[ord(_base.lower())] = _i
+
+# Characters that are not bases: the markers and indel lengths
+_NOT_BASE = numpy.zeros(256, bool)
+_NOT_BASE[numpy.frombuffer(b'^$+-0123456789', numpy.uint8)] = True
+_DIGIT = numpy.zeros(256, bool)
+_DIGIT[numpy.frombuffer(b'0123456789', numpy.uint8)] = True
+
+_COLUMN_INDEL = re.compile(r'[+-]([0-9]+)')
+_ODD_COLUMN_INDEL = re.compile(r'[\^$+\-0-9]')
+_READ = re.compile(r'(?:\^(.))?([^\^$+\-0-9])([+-][0-9]+)?(\$)?', re.S)
+_READS = re.compile(r'(?:(?:\^.)?[^\^$+\-0-9](?:[+-][0-9]+)?\$?)*', re.S)
+
+
+def _numbers(a, starts, ends):
+    # The integers in a[starts:ends] for each line, and whether each
+    # field was plain digits.
+    width = ends - starts
+    ok = (width >= 1) & (width <= 18)
+    value = numpy.zeros(len(starts), numpy.int64)
+    if len(starts):
+        last = len(a) - 1
+        for j in range(min(int(width.max()), 19)):
+            inside = j < width
+            digit = a[numpy.minimum(starts + j, last)].astype(numpy.int64) - 48
+            ok &= ~inside | ((digit >= 0) & (digit <= 9))
+            value = numpy.where(inside, value * 10 + digit, value)
+    return value, ok
+
+
+def count_table(lines, codes, n):
+    """Count the codes (from CODES) of each of n lines, in an n x 5 table."""
+    return numpy.bincount(lines * (len(BASES) + 1) + codes,
+                          minlength=n * (len(BASES) + 1)).reshape(
+                              n, len(BASES) + 1)[:, :len(BASES)]
+
+
+def has_prefix(lengths):
+    """Whether one indel length, written out, starts another.
+
+    The programs remove an indel of length 1 with '[+-]1.', which also
+    matches the start of one of length 12.
+    """
+    names = sorted(set(map(str, lengths)))
+    return any(b.startswith(a) for a, b in zip(names, names[1:]))
+
+
+class PileupBlock:
+    """The lines of one block of a pileup file.
+
+    If the block could not be parsed in bulk (because of empty fields,
+    fewer than five columns, spaces or other unusual characters), lines
+    is the list of its lines and nothing else is set.  Otherwise lines
+    is None, and for line i:
+
+        depth[i]      the depth column
+        pos[i]        the position column
+        ref[i]        the reference base, as a byte, or 0 if the column
+                      is not one character
+        bases[i]      counts of A, C, G, T and N among the bases of the
+                      reads
+        quals[i]      the same, among the mapping quality characters of
+                      the reads that start there
+        indels[i]     the same, among inserted and deleted bases
+        dropped[i]    the same, among the bases of reads with '$' as
+                      their mapping quality (also counted in bases)
+        ins[i]        the lengths of the insertions, in order, for the
+                      lines that have any; dels[i] the same for deletions
+        irregular[i]  whether the line must be parsed the old way; the
+                      counts of irregular lines are not set
+    """
+
+    def __init__(self, data, lines=None):
+        self.data = data
+        self.lines = lines
+
+    def text_lines(self):
+        """The text of every line, without line ends."""
+        if self.lines is not None:
+            return self.lines
+        return self.data.decode('ascii').split('\n')[:-1]
+
+    def line(self, i):
+        """The text of line i, without its line end."""
+        return self.data[self.starts[i]:self.seps[i, -1]].decode('ascii')
+
+    def site(self, i):
+        """The chromosome, position and reference columns of line i."""
+        return self.data[self.starts[i]:self.seps[i, 2]].decode(
+            'ascii').split('\t')
+
+    def field(self, i, k):
+        """The text of column k of line i."""
+        start = self.starts[i] if k == 0 else self.seps[i, k - 1] + 1
+        return self.data[start:self.seps[i, k]].decode('ascii')
+
+
+def parse_block(data):
+    """Parse whole lines of a pileup file, each ending with '\\n'."""
+    block = _parse(data)
+    if block is None:
+        return PileupBlock(data, data.decode('utf-8', 'surrogatepass').split(
+            '\n')[:-1])
+    return block
+
+
+def _parse(data):
+    if not data.isascii():
+        return None
+    a = numpy.frombuffer(data, numpy.uint8)
+    # Tabs and line ends; any other white space or control character
+    # leaves the block to the line by line code.
+    seps = numpy.flatnonzero(a <= 32)
+    kinds = a[seps]
+    n = int(numpy.count_nonzero(kinds == 10))
+    if n == 0 or len(seps) % n:
+        return None
+    width = len(seps) // n
+    if width < 5:
+        return None
+    seps = seps.reshape(n, width)
+    kinds = kinds.reshape(n, width)
+    if (kinds[:, :-1] != 9).any() or (kinds[:, -1] != 10).any():
+        return None
+    starts = numpy.zeros(n, numpy.intp)
+    starts[1:] = seps[:-1, -1] + 1
+    if (seps[:, 0] == starts).any() or (numpy.diff(seps, axis=1) == 1).any():
+        return None  # Empty fields
+
+    block = PileupBlock(data)
+    block.n = n
+    block.starts = starts
+    block.seps = seps
+    block.depth, depth_ok = _numbers(a, seps[:, 2] + 1, seps[:, 3])
+    block.pos, pos_ok = _numbers(a, seps[:, 0] + 1, seps[:, 1])
+    block.ref = numpy.where(seps[:, 2] - seps[:, 1] == 2, a[seps[:, 1] + 1],
+                            0)
+    irregular = ~(depth_ok & pos_ok)
+
+    # The base columns, joined
+    col_starts = (seps[:, 3] + 1).tolist()
+    col_ends = seps[:, 4].tolist()
+    col = b''.join([data[start:end]
+                    for start, end in zip(col_starts, col_ends)])
+    c = numpy.frombuffer(col, numpy.uint8)
+    ends = numpy.cumsum(seps[:, 4] - seps[:, 3] - 1)
+    begins = numpy.zeros(n, numpy.intp)
+    begins[1:] = ends[:-1]
+    last = max(len(c) - 1, 0)
+
+    # Everything but reference matches (. and , are 46 and 44)
+    found = numpy.flatnonzero((c | 2) != 46)
+    chars = c[found]
+    found_lines = numpy.repeat(numpy.arange(n), numpy.diff(
+        numpy.searchsorted(found, ends), prepend=0))
+    total = count_table(found_lines, CODES[chars], n)
+
+    # Read starts: a '^' right after another is its mapping quality.
+    carets = chars == 94
+    caret_pos = found[carets]
+    caret_lines = found_lines[carets]
+    follows = (caret_pos > begins[caret_lines]) & (
+        c[numpy.maximum(caret_pos - 1, 0)] == 94)
+    irregular[caret_lines[follows & (caret_pos - 1 > begins[caret_lines])
+                          & (c[numpy.maximum(caret_pos - 2, 0)] == 94)]] = True
+    starts_at = caret_pos[~follows]
+    start_lines = caret_lines[~follows]
+    qual_pos = starts_at + 1
+    base_pos = starts_at + 2
+    line_ends = ends[start_lines]
+    irregular[start_lines[base_pos >= line_ends]] = True
+    has_base = base_pos < line_ends
+    qual_chars = c[numpy.minimum(qual_pos, last)]
+    base_chars = c[numpy.minimum(base_pos, last)]
+    irregular[start_lines[has_base & _NOT_BASE[base_chars]]] = True
+    block.quals = count_table(start_lines[has_base],
+                              CODES[qual_chars[has_base]], n)
+    dollar = has_base & (qual_chars == 36)
+    block.dropped = count_table(start_lines[dollar],
+                                CODES[base_chars[dollar]], n)
+
+    # Indels: a + or - that is not a mapping quality, before a digit.  (A
+    # + or - after a '^' that is itself a mapping quality is the base of
+    # the read, which makes the line irregular anyway.)
+    signs = (chars == 43) | (chars == 45)
+    sign_pos = found[signs]
+    sign_lines = found_lines[signs]
+    not_qual = (sign_pos == begins[sign_lines]) | (
+        c[numpy.maximum(sign_pos - 1, 0)] != 94)
+    sign_pos = sign_pos[not_qual]
+    sign_lines = sign_lines[not_qual]
+    after = numpy.minimum(sign_pos + 1, last)
+    inside = sign_pos + 1 < ends[sign_lines]
+    marker_after = inside & ((c[after] == 94) | (c[after] == 36))
+    irregular[sign_lines[marker_after]] = True
+    digit_after = inside & _DIGIT[c[after]]
+    pos = sign_pos[digit_after]
+    lines = sign_lines[digit_after]
+    line_ends = ends[lines]
+    # The lengths, of up to six digits
+    width = numpy.ones(len(pos), numpy.intp)
+    more = numpy.ones(len(pos), bool)
+    for j in range(2, 8):
+        more &= (pos + j < line_ends) & _DIGIT[c[numpy.minimum(pos + j,
+                                                                last)]]
+        width += more
+    length = _numbers(c, pos + 1, pos + 1 + numpy.minimum(width, 6))[0]
+    seq_starts = pos + 1 + width
+    seq_ends = seq_starts + length
+    odd = (width > 6) | (c[numpy.minimum(pos + 1, last)] == 48) | (
+        seq_ends > line_ends)
+    # An indel among the bases of an earlier one
+    reach = numpy.maximum.accumulate(numpy.minimum(seq_ends, line_ends))
+    odd[1:] |= pos[1:] < reach[:-1]
+    irregular[lines[odd]] = True
+    pos = pos[~odd]
+    lines = lines[~odd]
+    length = length[~odd]
+    offsets = numpy.cumsum(length) - length
+    seq_pos = numpy.arange(int(length.sum())) + numpy.repeat(
+        seq_starts[~odd] - offsets, length)
+    seq_chars = c[seq_pos]
+    seq_lines = numpy.repeat(lines, length)
+    irregular[seq_lines[_NOT_BASE[seq_chars]]] = True
+    indels = count_table(seq_lines, CODES[seq_chars], n)
+    block.indels = indels
+    block.ins = {}
+    block.dels = {}
+    insertion = c[pos] == 43
+    for table, kind in ((block.ins, insertion), (block.dels, ~insertion)):
+        for line, line_length in zip(lines[kind].tolist(),
+                                     length[kind].tolist()):
+            table.setdefault(line, []).append(line_length)
+        # One-digit lengths cannot start one another
+        irregular[[line for line, lengths in table.items()
+                   if len(lengths) > 1 and max(lengths) > 9
+                   and has_prefix(lengths)]] = True
+    block.bases = total - block.quals - indels
+    block.irregular = irregular
+    return block
+
+
+def pileup_blocks(handle, buffer_size=BUFFER_SIZE):
+    """Yield a PileupBlock for each block of lines of a pileup file.
+
+    handle may be a text or a binary file.
+    """
+    leftover = b''
+    while True:
+        data = handle.read(buffer_size)
+        if not data:
+            break
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'surrogatepass')
+        data = leftover + data
+        cut = data.rfind(b'\n') + 1
+        leftover = data[cut:]
+        if cut:
+            yield parse_block(data[:cut])
+    if leftover:
+        yield parse_block(leftover + b'\n')
+
+
+def line_blocks(lines, buffer_size=BUFFER_SIZE):
+    """Yield a PileupBlock for each block of pileup lines.
+
+    lines are text lines without line ends, such as those that a
+    pysam.TabixFile fetches from a region of a bgzipped, indexed pileup.
+    """
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line) + 1
+        if size >= buffer_size:
+            yield parse_block(('\n'.join(block) + '\n').encode(
+                'utf-8', 'surrogatepass'))
+            block = []
+            size = 0
+    if block:
+        yield parse_block(('\n'.join(block) + '\n').encode(
+            'utf-8', 'surrogatepass'))
+
+
+def column_reads(bases):
+    """Split a base column into its reads.
+
+    Returns a list of (mapping quality, base, indel, end) for each read,
+    in order: the mapping quality is '' if the read does not start here,
+    the indel is '' or the marker and length (e.g. '+3', without the
+    bases), and end is '$' or ''.  Returns None if the column does not
+    split cleanly (see the irregular lines above).
+    """
+    if '+' in bases or '-' in bases:
+        pieces = []
+        start = 0
+        for match in _COLUMN_INDEL.finditer(bases):
+            if match.start() < start or bases[match.start() - 1:
+                                              match.start()] == '^':
+                return None
+            digits = match.group(1)
+            end = match.end() + int(digits)
+            if (digits[0] == '0' or end > len(bases)
+                    or _ODD_COLUMN_INDEL.search(bases, match.end(), end)):
+                return None
+            pieces.append(bases[start:match.end()])
+            start = end
+        pieces.append(bases[start:])
+        bases = ''.join(pieces)
+    if _READS.fullmatch(bases) is None:
+        return None
+    return _READ.findall(bases)
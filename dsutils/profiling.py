@@ -0,0 +1,149 @@
+"""profiling.py
+Built-in profiling hooks for the Duplex Sequencing programs.
+
+Every entry point accepts the same set of options:
+
+--profile cprofile      Deterministic profiling with cProfile.  Only the
+                        stage named by --profile_stage is profiled (or
+                        every stage, with --profile_stage all), and each
+                        profiled stage is written to
+                        <prefix>.<stage>.pstats, which can be read with
+                        the pstats module, snakeviz, or gprof2dot.
+--profile sample        Low-overhead statistical sampling of the whole
+                        run.  The main thread is interrupted every
+                        --profile_interval seconds of CPU time (SIGPROF)
+                        and its stack is recorded.  Stacks are written in
+                        collapsed format to <prefix>.collapsed, which can
+                        be fed to flamegraph.pl or loaded into speedscope.
+
+<prefix> is the --prefix (or equivalent) of the program being run, unless
+--profile_prefix is given.
+
+Programs mark their stages with begin() and end(); when profiling is off
+these calls do nothing.
+"""
+
+import atexit
+import cProfile
+import os
+import signal
+from collections import defaultdict
+
+
+def add_profile_arguments(parser, stages):
+    parser.add_argument(
+        '--profile',
+        dest = 'profile',
+        choices = ['cprofile', 'sample'],
+        default = None,
+        help = ("Profile this run.  'cprofile' gives deterministic "
+                "profiles of the stage chosen with --profile_stage; "
+                "'sample' gives a statistical profile of the whole run.  "
+                "[None]"
+                )
+        )
+    parser.add_argument(
+        '--profile_stage',
+        dest = 'profile_stage',
+        choices = list(stages) + ['all'],
+        default = 'all',
+        help = "Stage to profile with --profile cprofile. [all]"
+        )
+    parser.add_argument(
+        '--profile_interval',
+        dest = 'profile_interval',
+        type = float,
+        default = 0.005,
+        help = ("Seconds of CPU time between samples with "
+                "--profile sample. [0.005]"
+                )
+        )
+    parser.add_argument(
+        '--profile_prefix',
+        dest = 'profile_prefix',
+        default = None,
+        help = ("Prefix for profile output files.  Defaults to the "
+                "output prefix of the program. [None]"
+                )
+        )
+
+
+def profiler_from_args(o, default_prefix):
+    """Build a Profiler from options added by add_profile_arguments."""
+    prefix = o.profile_prefix if o.profile_prefix else default_prefix
+    return Profiler(o.profile, o.profile_stage, prefix, o.profile_interval)
+
+
+class Profiler:
+    def __init__(self, mode=None, stage='all', prefix='profile',
+                 interval=0.005):
+        self.mode = mode
+        self.stage = stage
+        self.prefix = prefix
+        self.interval = interval
+        self.current_stage = None
+        self.stacks = defaultdict(int)
+        self.profiles = {}
+        self.started = False
+        self.stopped = False
+
+    def start(self):
+        if self.mode is None or self.started:
+            return
+        self.started = True
+        if self.mode == 'sample':
+            if not hasattr(signal, 'setitimer'):
+                raise ValueError(
+                    "--profile sample needs signal.setitimer, which is "
+                    "not available on this platform."
+                    )
+            signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF,
+                             self.interval,
+                             self.interval
+                             )
+        # Make sure the profile is written even if the run dies.
+        atexit.register(self.stop)
+
+    def begin(self, stage):
+        self.current_stage = stage
+        if self.mode == 'cprofile' and self.stage in (stage, 'all'):
+            profile = self.profiles.get(stage)
+            if profile is None:
+                profile = self.profiles[stage] = cProfile.Profile()
+            profile.enable()
+
+    def end(self, stage):
+        if stage in self.profiles:
+            self.profiles[stage].disable()
+        self.current_stage = None
+
+    def stop(self):
+        if not self.started or self.stopped:
+            return
+        self.stopped = True
+        if self.mode == 'sample':
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_DFL)
+            with open(self.prefix + '.collapsed', 'w') as out_file:
+                for stack in sorted(self.stacks):
+                    out_file.write("%s %d\n" % (stack, self.stacks[stack]))
+        else:
+            for stage in sorted(self.profiles):
+                self.profiles[stage].disable()
+                self.profiles[stage].dump_stats(
+                    "%s.%s.pstats" % (self.prefix, stage)
+                    )
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno
+                                         ))
+            frame = frame.f_back
+        if self.current_stage is not None:
+            stack.append("stage:%s" % self.current_stage)
+        self.stacks[';'.join(reversed(stack))] += 1
@@ -0,0 +1,96 @@
+"""regions.py
+Cutting an indexed, position-sorted BAM file into regions for the
+--processes options of ConsensusMaker.py, DuplexMaker.py and
+CountMuts.py.
+
+genome_chunks() gives the regions in file order.  A read belongs to the
+region it starts in: fetch() also returns the reads that start before a
+region and overlap it, and region_reads() leaves those out, so every
+read is seen in exactly one region and in the same order as in the
+file.
+
+read_bed() and split_regions() give the regions of a BED file of
+targets instead, for CountMuts.py, which counts the pileup lines of
+each region rather than the reads that start in it.
+"""
+
+
+def read_key(read):
+    return read.tid, read.pos, read.qname, read.flag
+
+
+def genome_chunks(in_bam_file, chunk_size):
+    """Yield (contig, start, end) regions, in file order.
+
+    The regions are at most chunk_size bases long and cover the contigs
+    that have reads; None, for the reads with no coordinate, comes last.
+    """
+    for contig_stats in in_bam_file.get_index_statistics():
+        if contig_stats.total > 0:
+            length = in_bam_file.get_reference_length(contig_stats.contig)
+            for start in range(0, length, chunk_size):
+                yield contig_stats.contig, start, min(start + chunk_size,
+                                                      length)
+    if in_bam_file.nocoordinate > 0:
+        yield None
+
+
+def region_reads(bam_entry, region, skip=()):
+    """The reads of bam_entry that start in region.
+
+    Reads with a key (read_key) in skip are left out as well.
+    """
+    skip = list(skip)
+    skip_pos = set(key[1] for key in skip)
+    for read in bam_entry:
+        if region is not None and read.pos < region[1]:
+            continue  # Starts in an earlier region
+        if read.pos in skip_pos and read_key(read) in skip:
+            skip.remove(read_key(read))
+            continue
+        yield read
+
+
+def fetch_region(in_bam_file, region):
+    """fetch() for a region from genome_chunks()."""
+    if region is None:
+        return in_bam_file.fetch('*')
+    return in_bam_file.fetch(*region)
+
+
+def read_bed(path):
+    """The (contig, start, end) regions of a BED file.
+
+    The regions are sorted, and regions that overlap or touch are
+    joined, so that no position is in two of them.  Header, track and
+    browser lines are skipped.
+    """
+    regions = []
+    with open(path) as in_file:
+        for line_num, line in enumerate(in_file, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#') or fields[0] in (
+                    'track', 'browser'):
+                continue
+            try:
+                start, end = int(fields[1]), int(fields[2])
+            except (IndexError, ValueError):
+                raise ValueError("Line %d of %s is not a BED region: %s"
+                                 % (line_num, path, line.rstrip('\n')))
+            if end > start:
+                regions.append((fields[0], start, end))
+    regions.sort()
+    joined = []
+    for contig, start, end in regions:
+        if joined and joined[-1][0] == contig and start <= joined[-1][2]:
+            joined[-1] = (contig, joined[-1][1], max(end, joined[-1][2]))
+        else:
+            joined.append((contig, start, end))
+    return joined
+
+
+def split_regions(regions, chunk_size):
+    """Yield the regions cut into pieces of at most chunk_size bases."""
+    for contig, start, end in regions:
+        for piece_start in range(start, end, chunk_size):
+            yield contig, piece_start, min(piece_start + chunk_size, end)
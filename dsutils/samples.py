@@ -0,0 +1,116 @@
+"""samples.py
+Sample sheets, for demultiplexing read pairs by their sample index while
+the duplex tags are parsed, in tag_to_header.py and
+UnifiedConsensusMaker.py.
+
+A sample sheet is a text file with one sample per line: the index
+sequence and the prefix of the sample's output files, separated by a
+tab, a comma or spaces.  Blank lines and lines starting with '#' are
+skipped.  Dual indexes are written as they appear in the read names,
+e.g. ATCACG+GTTTCG.  Several indexes may have the same prefix.
+
+An index read matches a sample if it differs from the sample's index at
+no more than mismatches positions (an N counts as a mismatch).  Indexes
+of different samples must differ at more than twice as many positions,
+so that no index read can match two samples.  Index reads that match no
+sample are undetermined: they go to the undetermined prefix if there is
+one, and are dropped otherwise.
+"""
+
+import re
+
+_SEPARATOR = re.compile(r'[\t, ]+')
+
+# Distinct index reads remembered by SampleSheet.sample()
+CACHE_SIZE = 1 << 20
+
+
+def read_sample_sheet(path):
+    """The (index, prefix) pairs of a sample sheet file, in order."""
+    samples = []
+    with open(path) as in_file:
+        for line_num, line in enumerate(in_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = _SEPARATOR.split(line)
+            if len(fields) != 2:
+                raise ValueError("Line %d of %s should have an index and a "
+                                 "sample prefix: %s" % (line_num, path, line))
+            samples.append((fields[0].upper(), fields[1]))
+    if not samples:
+        raise ValueError("No samples in %s" % path)
+    return samples
+
+
+def mismatches(index1, index2):
+    """The number of positions at which two indexes differ, counting Ns."""
+    if len(index1) != len(index2):
+        return max(len(index1), len(index2))
+    return sum(base1 != base2 or base1 == 'N'
+               for base1, base2 in zip(index1, index2))
+
+
+class SampleSheet:
+    def __init__(self, samples, max_mismatches=1, undetermined=None):
+        self.max_mismatches = max_mismatches
+        self.undetermined = undetermined
+        self.indexes = {}
+        for index, prefix in samples:
+            if self.indexes.get(index, prefix) != prefix:
+                raise ValueError("Index %s is given for both %s and %s"
+                                 % (index, self.indexes[index], prefix))
+            self.indexes[index] = prefix
+        for index1, prefix1 in self.indexes.items():
+            for index2, prefix2 in self.indexes.items():
+                if (prefix1 != prefix2 and mismatches(index1, index2)
+                        <= 2 * max_mismatches):
+                    raise ValueError(
+                        "Indexes %s (%s) and %s (%s) are too close to tell "
+                        "apart with %d mismatches" % (
+                            index1, prefix1, index2, prefix2, max_mismatches))
+        # The output prefixes, in the order of the sheet
+        self.prefixes = list(dict.fromkeys(self.indexes.values()))
+        if undetermined is not None and undetermined not in self.prefixes:
+            self.prefixes.append(undetermined)
+        self.cache = {}
+
+    def __getstate__(self):
+        # Worker processes make their own cache.
+        state = dict(self.__dict__)
+        state['cache'] = {}
+        return state
+
+    def sample(self, index):
+        """The prefix of the sample of an index read, or undetermined."""
+        prefix = self.cache.get(index, False)
+        if prefix is not False:
+            return prefix
+        prefix = self.indexes.get(index)
+        if prefix is None and self.max_mismatches:
+            for sample_index, sample_prefix in self.indexes.items():
+                if (mismatches(index, sample_index)
+                        <= self.max_mismatches):
+                    prefix = sample_prefix
+                    break
+        if prefix is None:
+            prefix = self.undetermined
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[index] = prefix
+        return prefix
+
+
+def write_sample_counts(path, prefixes, counts, names):
+    """Write a table of per-sample counters.
+
+    counts maps each prefix (and None, for the pairs that were dropped)
+    to a list of counters, named by names.
+    """
+    with open(path, 'w') as out_file:
+        out_file.write('\t'.join(['sample'] + list(names)) + '\n')
+        for prefix in list(prefixes) + [None]:
+            if prefix in counts:
+                out_file.write('\t'.join(
+                    [prefix or 'undetermined']
+                    + ['%d' % count for count in counts[prefix]]) + '\n')
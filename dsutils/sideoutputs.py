@@ -0,0 +1,174 @@
+"""sideoutputs.py
+The _LCC and _NM side outputs of ConsensusMaker.py, under the policy
+chosen with --side_outputs.
+
+ConsensusMaker.py writes the reads it rejects to a _NM file and, for
+each family, the reads with less common cigar strings to a _LCC file.
+On noisy libraries these cost about as much as the SSCSs themselves.
+The policies are:
+
+    bam      The _LCC.bam and _NM.bam files, as they have always been.
+             The files can be compressed with several threads.
+    summary  Tab-separated _LCC.txt and _NM.txt tables with one line per
+             family instead of one read per line (see below).
+    counts   Only the counters, in a _side_counts.txt table; the reads
+             are never looked at again.
+    off      Nothing.
+
+The summary tables have a header line; contig and pos (1-based, as in
+SAM) are those of the family.  _NM.txt has tag, reason and reads: the
+number of reads of the family rejected for that reason.  _LCC.txt has
+tag, family_size (the reads used for the SSCS), family_cigar, cigar and
+reads: the number of reads of the family with that less common cigar.
+
+The counters in the summary statistics are the same whatever the
+policy.
+"""
+
+import pysam
+
+POLICIES = ('bam', 'summary', 'counts', 'off')
+
+REASONS = {'bF': 'bad_flag', 'oL': 'overlap', 'sC': 'soft_clipping',
+           'rT': 'repetitive_tag'}
+
+NM_HEADER = "contig\tpos\ttag\treason\treads\n"
+LCC_HEADER = ("contig\tpos\ttag\tfamily_size\tfamily_cigar\tcigar\t"
+              "reads\n")
+
+
+def side_paths(prefix, policy):
+    """The _LCC and _NM files of a policy, for an output named prefix."""
+    if policy == 'bam':
+        return prefix + "_LCC.bam", prefix + "_NM.bam"
+    if policy == 'summary':
+        return prefix + "_LCC.txt", prefix + "_NM.txt"
+    return ()
+
+
+def _cigar_string(cigar):
+    return ''.join('%d%s' % (length, 'MIDNSHP=XB'[operation])
+                   for operation, length in cigar)
+
+
+class SideOutputs:
+    def __init__(self, policy, prefix, template, quality_score,
+                 threads=1, header=True):
+        if policy not in POLICIES:
+            raise ValueError("unknown side output policy: %s" % policy)
+        self.policy = policy
+        self.template = template
+        self.quality_score = quality_score
+        # Whether the rejected and less common reads are wanted at all
+        self.keep_reads = policy in ('bam', 'summary')
+        if policy == 'bam':
+            lcc_path, nm_path = side_paths(prefix, policy)
+            self.lcc_file = pysam.Samfile(lcc_path, "wb", template=template,
+                                          threads=threads)
+            self.nm_file = pysam.Samfile(nm_path, "wb", template=template,
+                                         threads=threads)
+        elif policy == 'summary':
+            lcc_path, nm_path = side_paths(prefix, policy)
+            self.lcc_file = open(lcc_path, 'w')
+            self.nm_file = open(nm_path, 'w')
+            if header:
+                self.lcc_file.write(LCC_HEADER)
+                self.nm_file.write(NM_HEADER)
+
+    def _contig(self, tid):
+        if tid < 0:
+            return '*'
+        return self.template.get_reference_name(tid)
+
+    def rejected(self, reads):
+        """Take the rejected reads of one position.
+
+        reads is a list of (read, tag, reason), reason being the key of
+        its counter in the summary statistics.
+        """
+        if not reads:
+            return
+        if self.policy == 'bam':
+            for read, tag, reason in reads:
+                self.nm_file.write(read)
+        elif self.policy == 'summary':
+            families = {}
+            for read, tag, reason in reads:
+                families[tag, reason] = families.get((tag, reason), 0) + 1
+            contig = self._contig(reads[0][0].tid)
+            pos = reads[0][0].pos + 1
+            self.nm_file.writelines(
+                "%s\t%d\t%s\t%s\t%d\n" % (contig, pos, tag, REASONS[reason],
+                                          count)
+                for (tag, reason), count in families.items())
+
+    def less_common(self, families):
+        """Take the reads with less common cigar strings at one position.
+
+        families is a list of (tag, tag_reads, family_size, family_cigar,
+        cigar, seqs), tag_reads being the entry of the tag in the read
+        dictionary of ConsensusMaker.py, and the cigars tuples.  As
+        always, the _LCC.bam file gets all but the last two of seqs.
+        """
+        if not families:
+            return
+        if self.policy == 'bam':
+            for dict_tag, tag_reads, fam_size, max_cigar, cigar, seqs in families:
+                for seq in seqs[:-2]:
+                    a = pysam.AlignedRead()
+                    a.qname = dict_tag + ':' + str(fam_size)
+                    a.flag = tag_reads[0]
+                    a.seq = seq
+                    a.rname = tag_reads[1]
+                    a.pos = tag_reads[2]
+                    a.mapq = 255
+                    a.cigar = cigar
+                    a.mrnm = tag_reads[3]
+                    a.mpos = tag_reads[4]
+                    a.isize = tag_reads[5]
+                    a.qual = self.quality_score
+                    self.lcc_file.write(a)
+        elif self.policy == 'summary':
+            contig = self._contig(families[0][1][1])
+            pos = families[0][1][2] + 1
+            self.lcc_file.writelines(
+                "%s\t%d\t%s\t%d\t%s\t%s\t%d\n" % (
+                    contig, pos, dict_tag, fam_size, _cigar_string(max_cigar),
+                    _cigar_string(cigar), len(seqs))
+                for dict_tag, tag_reads, fam_size, max_cigar, cigar, seqs
+                in families)
+
+    def close(self):
+        if self.policy in ('bam', 'summary'):
+            self.lcc_file.close()
+            self.nm_file.close()
+
+
+def merge_side_outputs(policy, prefix, chunk_prefixes):
+    """Concatenate the side outputs written for each region, in order.
+
+    The regions' summary tables are expected to have no header.
+    """
+    if policy == 'bam':
+        for path, chunk_paths in zip(side_paths(prefix, policy), zip(
+                *[side_paths(chunk, policy) for chunk in chunk_prefixes])):
+            pysam.cat("-o", path, *chunk_paths)
+    elif policy == 'summary':
+        for path, header, chunk_paths in zip(
+                side_paths(prefix, policy), (LCC_HEADER, NM_HEADER), zip(
+                *[side_paths(chunk, policy) for chunk in chunk_prefixes])):
+            with open(path, 'w') as out_file:
+                out_file.write(header)
+                for chunk_path in chunk_paths:
+                    with open(chunk_path) as in_file:
+                        for line in in_file:
+                            out_file.write(line)
+
+
+def write_side_counts(path, stats):
+    """Write the counters of the side outputs (the counts policy)."""
+    with open(path, 'w') as out_file:
+        out_file.write("side_output\treason\treads\n")
+        for key in ('bF', 'oL', 'sC', 'rT'):
+            out_file.write("NM\t%s\t%d\n" % (REASONS[key], stats[key]))
+        out_file.write("LCC\tless_common_cigar\t%d\n" % stats['LCC'])
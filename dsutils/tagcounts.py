@@ -0,0 +1,172 @@
+"""tagcounts.py
+Tag counting with a bound on memory, for the tagcounts and tag_stats
+files.
+
+ConsensusMaker.py counts every tag it sees so that it can write the
+tagcounts file (tag and count, most common first, ties in the order the
+tags were first seen) and the family size histogram in tag_stats.  With
+a whole genome the number of distinct tags is far larger than anything
+else the program keeps.
+
+TagCounts takes the counts of one position at a time.  Past limit
+distinct tags, the counts in memory are written to a run file sorted by
+tag, together with the order in which each tag was first seen.  write()
+merges the runs, adding up the counts of each tag, sorts the totals by
+count (again in runs of at most limit tags), and writes the tagcounts
+file, adding each count to the histogram as it goes, so the tagcounts
+file never has to be read back.  If nothing was spilled, everything is
+done in memory exactly as before.
+
+Run files are made in directory and removed by close().
+"""
+
+import heapq
+import os
+import tempfile
+from collections import defaultdict
+from itertools import groupby
+
+
+def write_tag_stats(fam_size_counts, tag_stats_file):
+    """Write the fraction of reads in families of each size.
+
+    fam_size_counts maps family size to the number of tags of that size.
+    """
+    totals = 0
+    for size in fam_size_counts.keys():
+        totals += size * fam_size_counts[size]
+    with open(tag_stats_file, 'w') as out_file:
+        for size in sorted(fam_size_counts.keys()):
+            out_file.write("%s\t%s\n" % (
+                size, float(size * fam_size_counts[size]) / float(totals)))
+
+
+def _read_run(path, offset):
+    # Lines are tag, order first seen, count.
+    with open(path) as in_file:
+        for line in in_file:
+            tag, seen, count = line.rstrip('\n').split('\t')
+            yield tag, int(seen) + offset, int(count)
+
+
+def _read_sorted_run(path):
+    # Lines are count, order first seen, tag.
+    with open(path) as in_file:
+        for line in in_file:
+            count, seen, tag = line.rstrip('\n').split('\t')
+            yield -int(count), int(seen), tag
+
+
+class TagCounts:
+    def __init__(self, limit=1000000, directory=None):
+        self.limit = max(1, limit)
+        self.directory = directory
+        self.counts = {}
+        self.seen = 0  # Tags given an order in the runs so far
+        self.runs = []  # (path, offset added to the order in the file)
+        self.paths = []
+
+    def add(self, counts):
+        """Add the counts of one batch, a dictionary of tag -> count."""
+        total = self.counts
+        for tag, count in counts.items():
+            total[tag] = total.get(tag, 0) + count
+        if len(total) > self.limit:
+            self.spill()
+
+    def spill(self):
+        """Write the counts in memory to a run file, sorted by tag."""
+        if not self.counts:
+            return
+        path = self._temp_file('.tags')
+        with open(path, 'w') as out_file:
+            out_file.writelines(
+                "%s\t%d\t%d\n" % (tag, seen, count) for tag, seen, count in
+                sorted((tag, self.seen + seen, count) for seen, (tag, count)
+                       in enumerate(self.counts.items())))
+        self.runs.append((path, 0))
+        self.seen += len(self.counts)
+        self.counts = {}
+
+    def export(self):
+        """The state of a TagCounts filled in another process.
+
+        Give it to absorb() in the main process; the run files then
+        belong to that TagCounts.
+        """
+        return self.runs, self.seen, self.counts
+
+    def absorb(self, exported):
+        """Add the counts of a TagCounts exported after this one's."""
+        runs, seen, counts = exported
+        if runs:
+            self.spill()
+            self.runs.extend((path, offset + self.seen)
+                             for path, offset in runs)
+            self.paths.extend(path for path, offset in runs)
+            self.seen += seen
+        self.add(counts)
+
+    def totals(self):
+        """Yield (tag, order first seen, total count), sorted by tag."""
+        in_memory = sorted((tag, self.seen + seen, count) for seen, (tag, count)
+                           in enumerate(self.counts.items()))
+        merged = heapq.merge(in_memory,
+                             *[_read_run(path, offset)
+                               for path, offset in self.runs])
+        for tag, rows in groupby(merged, key=lambda row: row[0]):
+            rows = list(rows)
+            yield (tag, min(row[1] for row in rows),
+                   sum(row[2] for row in rows))
+
+    def ordered(self):
+        """Yield (tag, count), most common first, ties in first-seen order."""
+        if not self.runs:
+            for tag in sorted(self.counts.keys(), key=lambda x: self.counts[x],
+                              reverse=True):
+                yield tag, self.counts[tag]
+            return
+        sorted_runs = []
+        block = []
+        for tag, seen, count in self.totals():
+            block.append((-count, seen, tag))
+            if len(block) >= self.limit:
+                sorted_runs.append(self._write_sorted_run(block))
+                block = []
+        block.sort()
+        for count, seen, tag in heapq.merge(
+                block, *[_read_sorted_run(path) for path in sorted_runs]):
+            yield tag, -count
+
+    def write(self, tag_file, tag_stats_file):
+        """Write the tagcounts and tag_stats files."""
+        fam_size_counts = defaultdict(lambda: 0)
+        with open(tag_file, 'w') as out_file:
+            first = True
+            for tag, count in self.ordered():
+                if not first:
+                    out_file.write("\n")
+                out_file.write("%s\t%d" % (tag, count))
+                fam_size_counts[count] += 1
+                first = False
+        write_tag_stats(fam_size_counts, tag_stats_file)
+
+    def close(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.paths = []
+
+    def _temp_file(self, suffix):
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        os.close(handle)
+        self.paths.append(path)
+        return path
+
+    def _write_sorted_run(self, block):
+        block.sort()
+        path = self._temp_file('.sorted.tags')
+        with open(path, 'w') as out_file:
+            out_file.writelines("%d\t%d\t%s\n" % (-count, seen, tag)
+                                for count, seen, tag in block)
+        return path